@@ -22,6 +22,8 @@ EXPLORE_PROB = 1.0 #0.05
 EXPLORE_INTERRUPT_PROB = 0.01 #0.01
 MODEL_DIR = "models"
 LIB_FILE = "" #schema_lib_3_gather_mobs.pkl"
+# world snapshots: a full copy every KEYFRAME_EVERY, deltas in between (None for all full copies)
+KEYFRAME_EVERY = 10
 
 DIM = (600, 600)
 VIEWPORT = (600, 600)
@@ -65,7 +67,7 @@ def run_once(i):
              },
     ]
 
-    r = RunnerPassThrough(DIM, VIEWPORT, FIXED_TIMESTEP)
+    r = RunnerPassThrough(DIM, VIEWPORT, FIXED_TIMESTEP, KEYFRAME_EVERY)
     # eid for last entity is returned (for camera focus)
     focus_eid = r.setup(spec)
     if GUI: gui.init(VIEWPORT)
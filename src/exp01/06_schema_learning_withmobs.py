@@ -2,7 +2,8 @@ import os, pickle, re
 import numpy as np
 from exp01.evaluation import Schema, SchemaLib, generate_fv, generate_effects
 from exp01.estimation import LinearEstimator, RandomForestEstimator, RandomForestRegressionEstimator, GBClassifierEstimator, ABClassifierEstimator
-from exp01.trace_processing import load_traces, convert_traces, interaction_responses
+from exp01.trace_processing import iter_traces, convert_to_interactions, interaction_responses
+from exp01.training import Job, run_jobs, TRAIN, VALIDATE, WORKERS
 from constants import *
 
 DEBUG = True
@@ -58,24 +59,52 @@ def create_schema(htraces):
 
     # for each schema, process the examplars
     SchemaLib.lib = SchemaLib()
-    for s in S.values():
+    # collect the estimator jobs across all schema, then fit them together
+    jobs = []
+    durations = {}
+    for bname,s in S.items():
         print(s)
 
         # compute all outcome effect sets
         s.update_exemplar_outcomes()
 
+        # duration estimators, validated here, the better one is trained below
+        V, X, y = s.training_data_for_value('duration')
+        durations[bname] = (V, X, y)
+        jobs.append(Job((bname, 'duration', 'rf'), RandomForestRegressionEstimator(), V, X, y, (VALIDATE,)))
+        jobs.append(Job((bname, 'duration', 'lr'), LinearEstimator(), V, X, y, (VALIDATE,)))
+
+        for i in range(len(s.outcomes)):
+            #s.outcome_predictors.append(RandomForestEstimator())
+            V,X,y = s.training_data_for_outcome(i)
+            jobs.append(Job((bname, 'outcome', i), ABClassifierEstimator(), V, X, y, (VALIDATE, TRAIN)))
+
+        for i,r in enumerate(s.response_behaviors):
+            m = re.search('\(([a-z]*)', r)
+            V, X, y = s.training_data_for_response(m.group(1))
+            print("Training Response - {}, {} vars, {} exemplars".format(m.group(1), len(V), len(X)))
+            #s.response_predictors[i].train(V, X, y)
+            jobs.append(Job((bname, 'response', i), RandomForestEstimator(), V, X, y, (VALIDATE,)))
+
+    print("Training {} estimators ({} workers)".format(len(jobs), WORKERS))
+    fitted = {job.key : result for job,result in zip(jobs, run_jobs(jobs))}
+
+    # then train only the selected duration estimators
+    jobs = []
+    for bname,s in S.items():
+        rf, s.erf = fitted[(bname, 'duration', 'rf')]
+        lr, s.elr = fitted[(bname, 'duration', 'lr')]
+        V, X, y = durations[bname]
+        jobs.append(Job((bname, 'duration'), rf if s.erf < s.elr else lr, V, X, y, (TRAIN,)))
+    print("Training {} duration estimators".format(len(jobs)))
+    fitted.update({job.key : result for job,result in zip(jobs, run_jobs(jobs))})
+
+    for bname,s in S.items():
+        print(s)
+
         # train duration estimator
         print("Training duration estimator")
-        V, X, y = s.training_data_for_value('duration')
-        rf = RandomForestRegressionEstimator()
-        s.erf = rf.validate(V, X, y)
-        lr = LinearEstimator()
-        s.elr = lr.validate(V, X, y)
-        if s.erf < s.elr:
-            s.duration_estimator = rf
-        else:
-            s.duration_estimator = lr
-        s.duration_estimator.train(V, X, y)
+        s.duration_estimator, v = fitted[(bname, 'duration')]
         print("Variables: {}".format(s.duration_estimator.variables))
         #print("Weights: {}".format(s.duration_estimator.weights))
         #print("Residual: {}".format(s.duration_estimator.residuals))
@@ -83,23 +112,15 @@ def create_schema(htraces):
         s.outcome_validations = []
         for i in range(len(s.outcomes)):
             print("Training outcome {}: {}".format(i, s.outcomes[i]))
-            #s.outcome_predictors.append(RandomForestEstimator())
-            s.outcome_predictors.append(ABClassifierEstimator())
-            V,X,y = s.training_data_for_outcome(i)
-            f1 = s.outcome_predictors[i].validate(V, X, y)
+            est, f1 = fitted[(bname, 'outcome', i)]
+            s.outcome_predictors.append(est)
             s.outcome_validations.append(f1)
-            s.outcome_predictors[i].train(V, X, y)
             print(s.outcome_predictors[i].variables)
             print(s.outcome_predictors[i].clf.feature_importances_)
 
         for i,r in enumerate(s.response_behaviors):
-            m = re.search('\(([a-z]*)', r)
-            bname = m.group(1)
-            s.response_predictors.append(RandomForestEstimator())
-            V, X, y = s.training_data_for_response(bname)
-            print("Training Response - {}, {} vars, {} exemplars".format(bname, len(V), len(X)))
-            s.response_predictors[i].validate(V, X, y)
-            #s.response_predictors[i].train(V, X, y)
+            est, v = fitted[(bname, 'response', i)]
+            s.response_predictors.append(est)
             print(s.response_predictors[i].variables)
             if s.response_predictors[i].clf is not None:
                 print(s.response_predictors[i].clf.feature_importances_)
@@ -212,12 +233,8 @@ def create_schema(htraces):
     SchemaLib.save(MODEL_DIR, SCHEMA_LIB_FILE)
 
 if __name__ == '__main__':
-    TR = load_traces(DATA_DIR, limit=LIMIT)
-    #for tr in TR: print(tr)
-
-    HTR = convert_traces(TR)
-
-    create_schema(zip(HTR,TR))
+    # streamed, converting each trace as it's read
+    create_schema(((convert_to_interactions(trace), trace) for trace in iter_traces(DATA_DIR, limit=LIMIT)))
 
     for s in SchemaLib.get().schema:
         print(s, "duration_error RF {}, LR {}".format(s.erf, s.elr))
@@ -1,9 +1,10 @@
 import os, copy
 import data
-from exp01.trace_processing import load_traces
+from exp01.trace_processing import iter_traces
 from exp01.igraph import *
 from exp01.igraph_trainer import *
 from exp01.estimation import ABClassifierEstimator, RandomForestRegressionEstimator, LinearEstimator
+from exp01.training import Job, run_jobs, WORKERS
 
 DATA_DIR = os.path.join("traces_05_withmobs")
 MODEL_DIR = os.path.join("models")
@@ -41,6 +42,10 @@ def create_igraph(traces):
     # training
     graph.update_exemplar_outcomes()
 
+    # collect the estimator jobs, nodes are independent so they're fit together
+    jobs = []
+    # per job: (node, what it estimates, outcome index or transition key, extra entity labels)
+    slots = []
     for node in graph.nodes.values():
         print("Node:", node.key)
         if len(node.success) != 0:
@@ -50,39 +55,53 @@ def create_igraph(traces):
             # train outcome probs, duration across agent behavior entities
             if len(node.success) >= 10:
                 V, X, y = node.training_data_for_value('duration')
-                node.success_duration_estimator = []
-                for est in (RandomForestRegressionEstimator(), LinearEstimator()):
-                    est.train(V,X,y)
-                    node.success_duration_estimator.append((est, est.validate(V,X,y)))
+                for i,est in enumerate((RandomForestRegressionEstimator(), LinearEstimator())):
+                    jobs.append(Job((node.key, 'duration', i), est, V, X, y))
+                    slots.append((node, 'duration', i, None))
                 for i in range(len(node.success_outcomes)):
-                    o = node.success_outcomes[i]
-                    est = ABClassifierEstimator()
                     V,X,y = node.training_data_for_outcome(i)
                     if y.count(1) >= 10:
-                        est.train(V,X,y)
-                        o.probability_predictor = (est, est.validate(V, X, y))
-
-                print("    duration validations:", ', '.join((str(v) for e,v in node.success_duration_estimator)))
-                print("    outcome validations:", ', '.join((o.probability_predictor is not None and str(o.probability_predictor[1]) or '-' for o in node.success_outcomes)))
+                        jobs.append(Job((node.key, 'outcome', i), ABClassifierEstimator(), V, X, y))
+                        slots.append((node, 'outcome', i, None))
 
         if len(node.death) != 0:
             print(" {} DEATH ratio".format(len(node.death) / node.exemplar_count))
             # train death prob across all entities
             if len(node.death) >= 10 and len(node.success) >= 10:
                 V,X,y = node.training_data_for_death()
-                est = ABClassifierEstimator()
-                est.train(V,X,y)
-                node.death_estimator = (est, est.validate(V, X, y))
+                jobs.append(Job((node.key, 'death'), ABClassifierEstimator(), V, X, y))
+                slots.append((node, 'death', None, None))
 
         for key,E in node.transitions.items():
             print(" {} TRANS exemplars: {}".format(len(E), key))
             if len(E) >= 10:
                 ex,V,X,y = node.training_data_for_transition(key)
-                est = ABClassifierEstimator()
                 if y.count(1) >= 10 and y.count(0) >= 10:
-                    est.train(V, X, y)
-                    node.transition_predictors[key] = (est, est.validate(V,X,y), ex)
+                    jobs.append(Job((node.key, 'transition', key), ABClassifierEstimator(), V, X, y))
+                    slots.append((node, 'transition', key, ex))
+
+    print("Training {} estimators ({} workers)".format(len(jobs), WORKERS))
+    fitted = run_jobs(jobs)
 
+    # and hand them back to their nodes
+    for (node, kind, i, ex),(est,v) in zip(slots, fitted):
+        if kind == 'duration':
+            if node.success_duration_estimator is None:
+                node.success_duration_estimator = []
+            node.success_duration_estimator.append((est, v))
+        elif kind == 'outcome':
+            node.success_outcomes[i].probability_predictor = (est, v)
+        elif kind == 'death':
+            node.death_estimator = (est, v)
+        else:
+            node.transition_predictors[i] = (est, v, ex)
+
+    for node in graph.nodes.values():
+        if node.success_duration_estimator is not None or len(node.transition_predictors) != 0:
+            print("Node:", node.key)
+        if node.success_duration_estimator is not None:
+            print("    duration validations:", ', '.join((str(v) for e,v in node.success_duration_estimator)))
+            print("    outcome validations:", ', '.join((o.probability_predictor is not None and str(o.probability_predictor[1]) or '-' for o in node.success_outcomes)))
         for key,(e,v,ex) in node.transition_predictors.items():
             print("    transition validation:", key, v, ex)
 
@@ -209,6 +228,6 @@ def between(v, x0, x1):
 
 
 if __name__ == '__main__':
-    TR = load_traces(DATA_DIR, limit=LIMIT)
-    create_igraph(TR)
+    # IGraphTrain.add_exemplar keeps every trace, so peak memory is the whole corpus either way
+    create_igraph(iter_traces(DATA_DIR, limit=LIMIT))
 
@@ -8,7 +8,7 @@ from components.cbehavior import *
 from components.reasoning.goals import Goal_HasItemType, GoalNode
 from components.cagent import CAgent
 
-from exp01.igraph import StateSignature, IGraph, IGraphNodeBinding
+from exp01.igraph import StateSignature, IGraph, IGraphNodeBinding, evaluate_bindings
 
 MODEL_DIR = os.path.join("models")
 #SCHEMA_LIB_FILE = 'schema_lib_0_empty.pkl'
@@ -148,9 +148,10 @@ class CAgent_OutcomeEval(CAgent_ExploreExploit):
                 choice_state_sig = state_sig.update_agent_behavior(choice.sig())
                 cbound = self.igraph.bind_state(choice_state_sig)
                 if cbound is not None:
-                    cbound.evaluate(self, world)
                     candidates.append(cbound)
 
+            # one model call per estimator across all candidates
+            evaluate_bindings(candidates, self, world)
             candidates = bin_sort(candidates)
 
             # if len(candidates) == 0:
@@ -182,7 +183,6 @@ class CAgent_OutcomeEval(CAgent_ExploreExploit):
 
             bound = self.igraph.bind_state(state_sig)
             if bound is not None:
-                bound.evaluate(self, world)
                 candidates.append(bound)
 
             choices = self.random_choices(world)
@@ -190,9 +190,10 @@ class CAgent_OutcomeEval(CAgent_ExploreExploit):
                 choice_state_sig = state_sig.update_agent_behavior(choice.sig())
                 cbound = self.igraph.bind_state(choice_state_sig)
                 if cbound is not None:
-                    cbound.evaluate(self, world)
                     candidates.append(cbound)
 
+            # one model call per estimator across all candidates
+            evaluate_bindings(candidates, self, world)
             candidates = bin_sort(candidates)
 
             # if len(candidates) == 0:
@@ -5,7 +5,7 @@ import random
 import matplotlib.pyplot as plt
 from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor, GradientBoostingClassifier, AdaBoostClassifier
 
-from exp01.evaluation import generate_fv, get_attr, is_continuous, VALUE_CONTINUOUS, RELN_VALUES
+from exp01.evaluation import feature_plan, get_attr, is_continuous, VALUE_CONTINUOUS, RELN_VALUES
 
 class LinearEstimator:
 
@@ -78,14 +78,16 @@ class LinearEstimator:
         self.weights = temp
 
     def estimate_from_scenario(self, labeled_entities, world):
-        fv = generate_fv(world, labeled_entities, self.variables)
-        fv = [fv[vname] if vname in fv else None for vname in self.variables]
-        return self.estimate(fv)
+        return self.estimate(feature_plan(self.variables).row(world, labeled_entities))
 
     def estimate(self, a):
         yn = self.weights[-1] + sum((w*self.normalize(x,i) for i,(w,x) in enumerate(zip(self.weights[:-1],a))))
         return self.yunnormalize(yn)
 
+    def estimate_batch(self, scenarios, world):
+        """estimate_from_scenario for each labeled-entity scenario."""
+        return [self.estimate(fv) for fv in feature_plan(self.variables).rows(world, scenarios)]
+
     def validate(self, variables, A, Y, fold=10):
         test_step = int(len(A)/fold)
         if test_step == 0: test_step = 1
@@ -116,6 +118,12 @@ class LinearEstimator:
 
         return np.mean(errors)
 
+def proba_rows(clf, scenarios, variables, world):
+    """One predict_proba over all scenarios, split back into the 1-row results estimate() returns."""
+    if len(scenarios) == 0: return []
+    P = clf.predict_proba(feature_plan(variables).rows(world, scenarios))
+    return [P[i:i+1] for i in range(len(scenarios))]
+
 def filter_values(fv, variables, model_vars):
     """Only keep the values in fv that correspond to vars in model_vars."""
     V = []
@@ -159,15 +167,19 @@ class RandomForestEstimator:
     def estimate_from_scenario(self, labeled_entities, world):
         if self.clf is None: return [[0]]
 
-        fv = generate_fv(world, labeled_entities, self.variables)
-        fv = [fv[vname] if vname in fv else None for vname in self.variables]
-        return self.estimate(fv)
+        return self.estimate(feature_plan(self.variables).row(world, labeled_entities))
 
     def estimate(self, a):
         if self.clf is None: return [[0]]
 
         return self.clf.predict_proba([a])
 
+    def estimate_batch(self, scenarios, world):
+        """estimate_from_scenario for each labeled-entity scenario, with a single predict_proba."""
+        if self.clf is None: return [[[0]]] * len(scenarios)
+
+        return proba_rows(self.clf, scenarios, self.variables, world)
+
     def validate(self, variables, A, Y, fold=10):
         test_step = int(len(A)/fold)
         if test_step == 0: test_step = 1
@@ -249,15 +261,20 @@ class RandomForestRegressionEstimator:
     def estimate_from_scenario(self, labeled_entities, world):
         if self.clf is None: return [[0]]
 
-        fv = generate_fv(world, labeled_entities, self.variables)
-        fv = [fv[vname] if vname in fv else None for vname in self.variables]
-        return self.estimate(fv)
+        return self.estimate(feature_plan(self.variables).row(world, labeled_entities))
 
     def estimate(self, a):
         if self.clf is None: return 0
 
         return self.clf.predict([a])[0]
 
+    def estimate_batch(self, scenarios, world):
+        """estimate_from_scenario for each labeled-entity scenario, with a single predict."""
+        if self.clf is None: return [[[0]]] * len(scenarios)
+        if len(scenarios) == 0: return []
+
+        return list(self.clf.predict(feature_plan(self.variables).rows(world, scenarios)))
+
     def validate(self, variables, A, Y, fold=10):
         test_step = int(len(A)/fold)
         if test_step == 0: test_step = 1
@@ -323,15 +340,19 @@ class GBClassifierEstimator:
     def estimate_from_scenario(self, labeled_entities, world):
         if self.clf is None: return [[0]]
 
-        fv = generate_fv(world, labeled_entities, self.variables)
-        fv = [fv[vname] if vname in fv else None for vname in self.variables]
-        return self.estimate(fv)
+        return self.estimate(feature_plan(self.variables).row(world, labeled_entities))
 
     def estimate(self, a):
         if self.clf is None: return [[0]]
 
         return self.clf.predict_proba([a])
 
+    def estimate_batch(self, scenarios, world):
+        """estimate_from_scenario for each labeled-entity scenario, with a single predict_proba."""
+        if self.clf is None: return [[[0]]] * len(scenarios)
+
+        return proba_rows(self.clf, scenarios, self.variables, world)
+
     def validate(self, variables, A, Y, fold=10):
         test_step = int(len(A)/fold)
         if test_step == 0: test_step = 1
@@ -413,15 +434,19 @@ class ABClassifierEstimator:
     def estimate_from_scenario(self, labeled_entities, world):
         if self.clf is None: return [[0]]
 
-        fv = generate_fv(world, labeled_entities, self.variables)
-        fv = [fv[vname] if vname in fv else None for vname in self.variables]
-        return self.estimate(fv)
+        return self.estimate(feature_plan(self.variables).row(world, labeled_entities))
 
     def estimate(self, a):
         if self.clf is None: return [[0]]
 
         return self.clf.predict_proba([a])
 
+    def estimate_batch(self, scenarios, world):
+        """estimate_from_scenario for each labeled-entity scenario, with a single predict_proba."""
+        if self.clf is None: return [[[0]]] * len(scenarios)
+
+        return proba_rows(self.clf, scenarios, self.variables, world)
+
     def validate(self, variables, A, Y, fold=10):
         test_step = int(len(A)/fold)
         if test_step == 0: test_step = 1
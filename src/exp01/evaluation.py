@@ -2,6 +2,7 @@
 # retrieve vs. filter options
 
 import copy, math, os, pickle
+import numpy as np
 import data
 from components.cbehavior import *
 from components.reasoning.goals import Goal_HasItemType
@@ -637,6 +638,93 @@ def generate_fv(world, labeled_entities, attrs=None, categorical=True):
 
     return d
 
+#########################################
+# Compiled feature plans
+#########################################
+
+def attr_fn(key, tid):
+    """The function generate_fv reads attribute key with for entities of type tid, None if it has no such attribute."""
+    k = (key, tid)
+    if k not in ATTR_FNS:
+        ATTR_FNS[k] = None
+        for akey,(vtype,fn) in all_attrs(tid):
+            if akey == key:
+                ATTR_FNS[k] = fn
+    return ATTR_FNS[k]
+
+# (attribute key, tid) : fn or None
+ATTR_FNS = {}
+
+def reln_labels(n):
+    """Label tuples generate_fv computes relations over for n labeled entities (binary pairs and agent-target triples)."""
+    if n < 2 or n > 5: return set()
+    labels = ['agent', 'target'] + ['entity{}'.format(i) for i in range(1, n - 1)]
+    pairs = {(labels[i], labels[j]) for j in range(len(labels)) for i in range(j)}
+    triples = {('agent', 'target', l) for l in labels[2:]}
+    return pairs | triples
+
+RELN_LABELS = {n : reln_labels(n) for n in range(6)}
+
+class FeaturePlan:
+    """
+    A fixed list of variables compiled to the functions that compute them, so that a row of
+    values can be built without generate_fv's full dict. Rows are float arrays in variables
+    order, NaN where generate_fv would have no value (or None).
+    """
+    def __init__(self, variables):
+        self.variables = tuple(variables)
+        # per variable: (False, label, attr key) or (True, label tuple, reln fn)
+        self.steps = []
+        for var in self.variables:
+            alabel,key = var.split('.')
+            if not alabel.startswith('reln'):
+                self.steps.append((False, alabel, key))
+            else:
+                arity,vtype,fn = RELN_VALUES[key]
+                labels = tuple(alabel.split('-')[1:])
+                if len(labels) != (2 if arity is RELN_BINARY else 3):
+                    # generate_fv never names a relation like this
+                    labels = ()
+                self.steps.append((True, labels, fn))
+
+    def fill(self, out, world, labeled_entities):
+        relns = RELN_LABELS.get(len(labeled_entities), ())
+        for i,(is_reln, label, f) in enumerate(self.steps):
+            val = None
+            if is_reln:
+                if label in relns:
+                    val = f(world, *(labeled_entities[l] for l in label))
+            else:
+                ent = labeled_entities.get(label)
+                if ent is not None:
+                    fn = attr_fn(f, ent.tid)
+                    if fn is not None:
+                        val = fn(world, ent)
+            out[i] = np.nan if val is None else val
+        return out
+
+    def row(self, world, labeled_entities):
+        """Feature row for one labeled-entity binding."""
+        return self.fill(np.empty(len(self.steps)), world, labeled_entities)
+
+    def rows(self, world, scenarios):
+        """Feature matrix, one row per labeled-entity binding."""
+        out = np.empty((len(scenarios), len(self.steps)))
+        for i,labeled_entities in enumerate(scenarios):
+            self.fill(out[i], world, labeled_entities)
+        return out
+
+def feature_plan(variables):
+    """Shared plan for a variable list (estimators keep their variables, not plans, so models pickle as before)."""
+    k = tuple(variables)
+    plan = FEATURE_PLANS.get(k)
+    if plan is None:
+        plan = FEATURE_PLANS[k] = FeaturePlan(k)
+    return plan
+
+# variables tuple : FeaturePlan
+FEATURE_PLANS = {}
+
 #########################################
 # Attribute helpers
 #########################################
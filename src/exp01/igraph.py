@@ -1,14 +1,19 @@
-import os, pickle, re, copy
+import os, pickle, copy
 import numpy as np
 
-from queue import Queue
+from collections import deque
 from components.cbehavior import *
 from components.reasoning.goals import Goal_HasItemType
 
-from trace import behavior_class, behavior_params, explode_behavior_sig
+from trace import behavior_class, behavior_params, explode_behavior_sig, parse_behavior_sig, behavior_sig_generic
 from trace import ARG_ENTITY
 from constants import *
 
+# (agent eid, agent behavior, ((eid, behavior sig)...)) : (mapping to generic labels, key)
+CANONICAL = {}
+# entries kept before CANONICAL is cleared
+CANONICAL_LIMIT = 100000
+
 class StateSignature:
     def bind(self, cagent, world, trace):
         self.agent_eid = cagent.eid
@@ -20,12 +25,13 @@ class StateSignature:
             self.agent_behavior = 'dead'
             return
 
+        # only behaviors still going matter
+        active = trace.active_decisions()
         agent_dn = None
-        for dn in trace.decisions:
-            if dn.end_clock is None:
-                if dn.arg_value('agent') == cagent.eid:
-                    agent_dn = dn
-                    break
+        for dn in active:
+            if dn.arg_value('agent') == cagent.eid:
+                agent_dn = dn
+                break
         if agent_dn is None or agent_dn.status != RUNNING:
             self.agent_behavior = 'idle'
             active_eids = (self.agent_eid,)
@@ -34,12 +40,11 @@ class StateSignature:
             active_eids = agent_dn.labeled_entity_ids().values()
 
         # now other behaviors that overlap
-        for dn in trace.decisions:
-            if dn.end_clock is None:
-                if dn.arg_value('agent') != self.agent_eid:
-                    # currently active, not the agent
-                    if self.overlap_entity(active_eids, dn):
-                        self.behaviors[dn.arg_value('agent')] = dn.behavior_sig()
+        for dn in active:
+            if dn.arg_value('agent') != self.agent_eid:
+                # currently active, not the agent
+                if self.overlap_entity(active_eids, dn):
+                    self.behaviors[dn.arg_value('agent')] = dn.behavior_sig()
 
         self.generate_mapping()
 
@@ -47,52 +52,73 @@ class StateSignature:
         bname,args = explode_behavior_sig(self.agent_behavior)
         return behavior_class(bname)(*(int(aval) for acons,aname,aval in args))
 
+    def canonical(self):
+        """(mapping to generic labels, key), memoized on the agent and behavior sigs."""
+        sig = (self.agent_eid, self.agent_behavior, tuple(self.behaviors.items()))
+        c = CANONICAL.get(sig)
+        if c is None:
+            mapping = self.canonical_mapping()
+            c = (mapping, self.canonical_key(mapping))
+            if len(CANONICAL) >= CANONICAL_LIMIT:
+                CANONICAL.clear()
+            CANONICAL[sig] = c
+        return c
+
     def key(self):
-        # include behaviors in entity order, starting with agent
-        key = self.agent_behavior
+        """IGraph node key: the behavior sigs, entities replaced by their generic labels."""
+        return self.canonical()[1]
+
+    def canonical_key(self, mapping):
+        if self.agent_behavior == 'idle' or self.agent_behavior == 'dead':
+            key = self.agent_behavior
+        else:
+            key = behavior_sig_generic(self.agent_behavior, mapping)
 
+        # include behaviors in entity order, starting with agent
         for eid in self.ordered_entities():
             if eid in self.behaviors:
                 key += '-'
-                key += self.behaviors[eid]
-
-        pattern = re.compile(r'\b(' + '|'.join((str(i) for i in self.mapping_to_generic.keys())) + r')\b')
-        key = pattern.sub(lambda x: self.mapping_to_generic[int(x.group())], key)
+                key += behavior_sig_generic(self.behaviors[eid], mapping)
 
         return key
 
     def update_agent_behavior(self, new_behavior_sig):
         """Return copy with replaced agent behavior sig."""
+        if isinstance(new_behavior_sig, str):
+            new_behavior_sig = parse_behavior_sig(new_behavior_sig)
         ss = StateSignature()
         ss.agent_eid = self.agent_eid
         ss.agent_behavior = new_behavior_sig
         ss.behaviors = {}
-        bname, args = explode_behavior_sig(new_behavior_sig)
-        seids = [str(aval) for acons,aname,aval in args]
+        # keep the behaviors that share an argument with the new one
         for eid,bsig in self.behaviors.items():
-            if any((bsig.find(seid) != -1 for seid in seids)):
+            if any((aval in bsig.args for aval in new_behavior_sig.args)):
                 ss.behaviors[eid] = bsig
         ss.generate_mapping()
         return ss
 
     def generate_mapping(self):
-        """Return a dictionay mapping from actual entity ids to canonical labels."""
-        self.mapping_to_generic = {self.agent_eid : 'agent'}
+        """Return a dictionay mapping from actual entity ids to canonical labels (shared, don't modify)."""
+        self.mapping_to_generic = self.canonical()[0]
+        return self.mapping_to_generic
+
+    def canonical_mapping(self):
+        mapping = {self.agent_eid : 'agent'}
 
         if self.agent_behavior != 'idle' and self.agent_behavior != 'dead':
             bname,args = explode_behavior_sig(self.agent_behavior)
             for acons,aname,aval in args:
-                self.mapping_to_generic[int(aval)] = aname
+                mapping[aval] = aname
 
         # add other entities in argument order, so that keys are canonical
         next = 1
         for eid in self.ordered_entities():
-            if eid not in self.mapping_to_generic :
+            if eid not in mapping :
                 # new entity, give generic label
-                self.mapping_to_generic[eid] = 'entity{}'.format(next)
+                mapping[eid] = 'entity{}'.format(next)
                 next += 1
 
-        return self.mapping_to_generic
+        return mapping
 
     def ordered_entities(self):
         """Return all entities besides the agent, in argument appearance."""
@@ -100,7 +126,7 @@ class StateSignature:
 
         # start with the agent behavior, if there is one
         if self.agent_behavior != 'idle' and self.agent_behavior != 'dead':
-            q = Queue()
+            q = deque()
             bname,args = explode_behavior_sig(self.agent_behavior)
             done.add(self.agent_eid)
 
@@ -109,12 +135,12 @@ class StateSignature:
                 eid = int(aval)
                 if acons == ARG_ENTITY and eid not in done:
                     done.add(eid)
-                    q.put(eid)
+                    q.append(eid)
 
             # clear the queue (all behaviors linked by agent)
-            while not q.empty():
+            while q:
                 # return the next entity
-                next_eid = q.get()
+                next_eid = q.popleft()
                 yield next_eid
                 # then add any newcomers from it's behavior, in order, to the end of the queue
                 if next_eid in self.behaviors:
@@ -123,7 +149,7 @@ class StateSignature:
                         eid = int(aval)
                         if acons == ARG_ENTITY and eid not in done:
                             done.add(eid)
-                            q.put(eid)
+                            q.append(eid)
 
         # remining behaviors are linked by target, just return for now
         for next_eid in self.behaviors:
@@ -142,7 +168,7 @@ class StateSignature:
         return not self.__eq__(other)
 
     def __str__(self):
-        return "{}-{}".format(self.agent_behavior, '-'.join((b for b in self.behaviors.values())))
+        return "{}-{}".format(self.agent_behavior, '-'.join((str(b) for b in self.behaviors.values())))
 
 class IGraph:
     @staticmethod
@@ -194,11 +220,10 @@ class IGraph:
         agent_dn = None
         behaviors = {}
         # find agent dn, if any, first
-        for dn in trace.decisions:
-            if dn.end_clock is None:
-                if dn.arg_value('agent') == cagent.eid:
-                    agent_dn = dn
-                    break
+        for dn in trace.active_decisions():
+            if dn.arg_value('agent') == cagent.eid:
+                agent_dn = dn
+                break
 
         if agent_dn is None or agent_dn.status != RUNNING:
             key = 'idle'
@@ -209,14 +234,13 @@ class IGraph:
             if generic:
                 key = agent_dn.behavior_sig_generic(mapping)
             else:
-                key = agent_dn.behavior_sig()
+                key = str(agent_dn.behavior_sig())
 
         # get the rest of the behaviors by overlap
-        for dn in trace.decisions:
-            if dn.end_clock is None:
-                if dn.arg_value('agent') != cagent.eid:
-                    if self.overlap_entity(mapping.keys(), dn):
-                        behaviors[dn.arg_value('agent')] = dn
+        for dn in trace.active_decisions():
+            if dn.arg_value('agent') != cagent.eid:
+                if self.overlap_entity(mapping.keys(), dn):
+                    behaviors[dn.arg_value('agent')] = dn
 
         # add other entities in argument order, so that keys are canonical
         next = 1
@@ -233,7 +257,7 @@ class IGraph:
                 if generic:
                     key += behaviors[eid].behavior_sig_generic(mapping)
                 else:
-                    key += behaviors[eid].behavior_sig()
+                    key += str(behaviors[eid].behavior_sig())
 
         return key,mapping
 
@@ -247,7 +271,7 @@ class IGraph:
 
         # start with the agent behavior, if there is one
         if agent_dn is not None and agent_dn.status == RUNNING:
-            q = Queue()
+            q = deque()
             agent_eid = agent_dn.arg_value('agent')
             done.add(agent_eid)
 
@@ -255,19 +279,19 @@ class IGraph:
             for eid in agent_dn.arg_values(include_types=(ARG_ENTITY,)):
                 if eid not in done:
                     done.add(eid)
-                    q.put(eid)
+                    q.append(eid)
 
             # clear the queue (all behaviors linked by agent)
-            while not q.empty():
+            while q:
                 # return the next entity
-                next_eid = q.get()
+                next_eid = q.popleft()
                 yield next_eid
                 # then add any newcomers from it's behavior, in order, to the end of the queue
                 if next_eid in behaviors:
                     for eid in behaviors[next_eid].arg_values(include_types=(ARG_ENTITY,)):
                         if eid not in done:
                             done.add(eid)
-                            q.put(eid)
+                            q.append(eid)
 
         # remining behaviors are linked by target, just return for now
         for next_eid in behaviors:
@@ -320,73 +344,97 @@ class IGraphNodeBinding:
             bclass = behavior_class(bname)
             # target only for the moment
             for target_eid in bclass.target_eids_for_agent(agent, world):
-                new_behavior_sig = '({} {} {})'.format(bname, agent_eid, target_eid)
+                new_behavior_sig = BehaviorSig(bname, (agent_eid, target_eid))
                 choice_state_sig = self.state_sig.update_agent_behavior(new_behavior_sig)
                 next = igraph.bind_state(choice_state_sig)
                 if next is not None:
                     yield next
 
     def evaluate(self, cagent, world):
+        if self.node.is_idle():
+            self.dread = 0
+            self.death_prob = 0
+            self.reward = 0
+            self.cost = 1
+            return 0
+        evaluate_bindings((self,), cagent, world)
+
+    def queue_estimates(self, batch, world):
+        """Reset, and queue every estimate evaluate() needs. None if there is nothing to estimate."""
         self.dread = 0
         self.death_prob = 0
         self.reward = 0
         self.cost = 1
 
         if self.node.is_idle():
-            return 0
+            return None
 
         rmap = {v: world.entities.get(k) for k, v in self.state_sig.mapping_to_generic.items()}
         if any((v is None for v in rmap.values())):
             print("Bad RMap {}".format(self.state_sig.mapping_to_generic))
-            return
+            return None
 
-        noint = []
-        nodeath = []
+        # interruptions: (ticket, dest node) per extra-entity binding
+        transitions = []
         for dest_key,(est,v,extra_entity_labels) in self.node.transition_predictors.items():
             dest_node = self.node.igraph.nodes[dest_key]
             for bs in combo_bindings(extra_entity_labels, world, list((ent.eid for ent in rmap.values()))):
-                prob = est.estimate_from_scenario(dadd(rmap, {label:world.entities.get(eid) for label,eid in bs.items()}), world)[0][1]
-                #print("  Transition:", dest_key, v, bs, prob, dest_node.success_pct, dest_node.death_pct)
-                noint.append(1.0 - prob)
-                nodeath.append(1.0 - (prob * dest_node.death_pct * DREAD_FACTOR))
-
-        noint_prob = np.product(noint)
-        self.dread = 1.0 - np.product(nodeath)
+                scenario = dadd(rmap, {label:world.entities.get(eid) for label,eid in bs.items()})
+                transitions.append((batch.add(est, scenario), dest_node))
 
         # death odds
+        death = None
         if self.node.death_estimator is not None:
-            est, v = self.node.death_estimator
-            self.death_prob = est.estimate_from_scenario(rmap, world)[0][1]
+            death = batch.add(self.node.death_estimator[0], rmap)
 
+        # outcome odds (None if the outcome has no predictor)
+        outcomes = []
         for outcome in self.node.success_outcomes:
-            # REM: only entities from the actual agent behavior here, right?
-            prob = outcome.estimate_from_scenario(rmap, world)
-            #print("Odds of outcome {}: {}".format(outcome, prob))
-            for effect in outcome.effects:
-                for gn in cagent.planner.all_goal_nodes():
-                    #print(effect, gn, effect.outcome_value(gn))
-                    self.reward += prob * (effect.outcome_value(gn))
-
-        self.reward = self.reward * noint_prob
-
-        # material cost?
+            ticket = None
+            if outcome.probability_predictor is not None:
+                ticket = batch.add(outcome.probability_predictor[0], rmap)
+            outcomes.append((ticket, outcome))
 
         # time cost
+        duration = None
         if self.node.success_duration_estimator is not None:
             est = self.node.success_duration_estimator[0][0]
             if self.node.success_duration_estimator[1][1] > self.node.success_duration_estimator[0][1]:
                 est = self.node.success_duration_estimator[1][0]
-            self.cost = est.estimate_from_scenario(rmap, world)
+            duration = batch.add(est, rmap)
+
+        return transitions, death, outcomes, duration
+
+    def apply_estimates(self, queued, batch, cagent):
+        """Fill in reward, cost and death odds from a run batch."""
+        transitions, death, outcomes, duration = queued
+
+        noint = []
+        nodeath = []
+        for ticket, dest_node in transitions:
+            prob = batch.get(ticket)[0][1]
+            noint.append(1.0 - prob)
+            nodeath.append(1.0 - (prob * dest_node.death_pct * DREAD_FACTOR))
+
+        noint_prob = np.prod(noint)
+        self.dread = 1.0 - np.prod(nodeath)
+
+        if death is not None:
+            self.death_prob = batch.get(death)[0][1]
 
-        #print("  Value: {}, Death%: {}, ".format(self.value_ratio(), self.death_concern()))
+        for ticket, outcome in outcomes:
+            # REM: only entities from the actual agent behavior here, right?
+            prob = batch.get(ticket)[0][1] if ticket is not None else Outcome.UNKNOWN_PROB
+            for effect in outcome.effects:
+                for gn in cagent.planner.all_goal_nodes():
+                    self.reward += prob * (effect.outcome_value(gn))
+
+        self.reward = self.reward * noint_prob
 
-            #self.success_duration_estimator = None
-        #cost = dest.estimate([(target.pos - agent.pos).magnitude()])
-        #self.cost = self.schema.duration_estimator.estimate_from_scenario({'agent': agent, 'target': target}, world)
+        # material cost?
 
-        # print("{}".format(self.state_sig))
-        # print("expected reward: {}".format(self.reward))
-        # print("expected cost: {}".format(self.cost))
+        if duration is not None:
+            self.cost = batch.get(duration)
 
     def death_concern(self):
         return self.death_prob + self.dread
@@ -399,12 +447,55 @@ class IGraphNodeBinding:
         return self.state_sig.behavior()
 
 
+########################################################################
+# Batched estimation
+########################################################################
+
+class EstimateBatch:
+    """
+    Scenarios queued per estimator, so that evaluating many bindings costs one
+    model call per estimator instead of one per scenario.
+    """
+    def __init__(self, world):
+        self.world = world
+        self.queued = {}    # id(est) : (est, [scenario])
+        self.results = {}   # id(est) : [result]
+
+    def add(self, est, scenario):
+        """Queue a scenario, returns the ticket to get() its estimate with."""
+        entry = self.queued.get(id(est))
+        if entry is None:
+            entry = self.queued[id(est)] = (est, [])
+        entry[1].append(scenario)
+        return (id(est), len(entry[1]) - 1)
+
+    def run(self):
+        for key, (est, scenarios) in self.queued.items():
+            self.results[key] = est.estimate_batch(scenarios, self.world)
+
+    def get(self, ticket):
+        """Same as est.estimate_from_scenario(scenario, world) for the queued pair."""
+        key, i = ticket
+        return self.results[key][i]
+
+def evaluate_bindings(bindings, cagent, world):
+    """IGraphNodeBinding.evaluate for each binding, with the estimator calls batched."""
+    batch = EstimateBatch(world)
+    queued = [(b, b.queue_estimates(batch, world)) for b in bindings]
+    batch.run()
+    for b, q in queued:
+        if q is not None:
+            b.apply_estimates(q, batch, cagent)
+
 ########################################################################
 # Behavior outcome and effect models
 ########################################################################
 
 class Outcome:
     """Class just holds a list, but makes updating/splitting cleaner."""
+    # odds of an outcome with no predictor
+    UNKNOWN_PROB = 0.5
+
     def __init__(self, effects):
         self.effects = effects
         self.probability_predictor = None
@@ -416,7 +507,7 @@ class Outcome:
             return self.probability_predictor[0].estimate_from_scenario(labeled_entities, world)[0][1]
 
         # dunno
-        return 0.5
+        return Outcome.UNKNOWN_PROB
 
     def update(self, new_effects):
         # calculate intersection of effects, left overs on lhs and rhs
@@ -93,7 +93,7 @@ class IGraphExemplarNode:
             return '[{:.2f}-{:.2f}] {}'.format(self.start_clock, self.end_clock, self.manual_key)
         else:
             return '[{:.2f}-{:.2f}] {} :{}'.format(self.start_clock, self.end_clock,
-                                                   '-'.join([self.agent_dn.behavior_sig()] + [dn.behavior_sig() for dn in self.behaviors.values()]),
+                                                   '-'.join([str(self.agent_dn.behavior_sig())] + [str(dn.behavior_sig()) for dn in self.behaviors.values()]),
                                                    self.agent_dn.status)
 
 ######################################################
@@ -1,4 +1,5 @@
-import os, pickle
+import os, sys, pickle, json
+import numpy as np
 import data
 
 
@@ -13,7 +14,7 @@ SCHEMA_LIB_FILE = 'schema_lib_3_gather_mobs.pkl'
 def load_traces(dir, limit=None):
     """Read in game traces, return as a list."""
     games = []
-    for i, fn in enumerate(os.listdir(dir)):
+    for i, fn in enumerate(filter(is_trace_file, os.listdir(dir))):
         if limit is not None and i == limit: break
 
         f = open(os.path.join(dir, fn), 'rb')
@@ -23,6 +24,182 @@ def load_traces(dir, limit=None):
 
     return games
 
+##############################################################
+# Streaming trace corpus
+#
+# A directory of pickled (seed, trace) files, each holding one or more pickles back to back,
+# with an index of every trace in it: where it is (file, byte offset, size) and what it holds
+# (seed, decision/state counts, agent eids, behaviors, ending). Filtering and sharding read
+# only the index, and traces are unpickled one at a time as they're iterated.
+##############################################################
+
+# memory-mapped rows, and the json with file names, behavior names and agent eids
+INDEX_FILE = 'corpus-index.npy'
+INDEX_META = 'corpus-index.json'
+
+INDEX_DTYPE = np.dtype([('file', np.int32),         # into meta['files']
+                        ('offset', np.int64),       # of the pickle in its file, and its size
+                        ('size', np.int64),
+                        ('seed', np.int64),
+                        ('decisions', np.int32),
+                        ('states', np.int32),
+                        ('clock', np.float64),      # of the last decision
+                        ('behaviors', np.uint64),   # bit per name in meta['names'] that has a decision
+                        ('ending', np.int16)])      # name of the last decision, into meta['names']
+
+def is_trace_file(fn):
+    # (batch.py writes .tmp files first)
+    return fn.endswith('.pkl')
+
+def index_trace(seed, trace, names):
+    """Index fields of one trace, other than its location. Unknown behavior names are added to names."""
+    bits = 0
+    for bname in set(dn.behavior_name for dn in trace.decisions):
+        if bname not in names:
+            assert len(names) < 64, "Corpus index holds at most 64 behavior names"
+            names.append(bname)
+        bits |= 1 << names.index(bname)
+    last = trace.decisions[-1] if len(trace.decisions) > 0 else None
+    return (seed, len(trace.decisions), len(trace.state_clocks()),
+            last.start_clock if last is not None else 0.0, bits,
+            names.index(last.behavior_name) if last is not None else -1)
+
+def index_agents(trace):
+    """Sorted trace.agent_eids(), None if the trace has no state to type the actors with."""
+    clocks = trace.state_clocks()
+    if len(trace.decisions) == 0 or len(clocks) == 0 or clocks[-1] < max(dn.start_clock for dn in trace.decisions):
+        return None
+    return sorted(trace.agent_eids())
+
+def build_index(data_dir):
+    """
+    (Re)write the corpus index for data_dir, with one trace in memory at a time. Rows for
+    files whose size hasn't changed since the last index are kept rather than re-read.
+    """
+    old_rows, old_meta = read_index(data_dir)
+    old_files = {fn : i for i,(fn,size) in enumerate(old_meta['files'])} if old_meta is not None else {}
+
+    files = []
+    names = list(old_meta['names']) if old_meta is not None else []
+    rows = []
+    agents = []
+    for fn in sorted(filter(is_trace_file, os.listdir(data_dir))):
+        path = os.path.join(data_dir, fn)
+        size = os.path.getsize(path)
+        ifile = len(files)
+        files.append((fn, size))
+
+        if fn in old_files and old_meta['files'][old_files[fn]][1] == size:
+            for r in np.flatnonzero(old_rows['file'] == old_files[fn]):
+                rows.append((ifile,) + old_rows[r].item()[1:])
+                agents.append(old_meta['agents'][r])
+            continue
+
+        with open(path, 'rb') as f:
+            while f.tell() < size:
+                offset = f.tell()
+                seed, trace = pickle.load(f)
+                rows.append((ifile, offset, f.tell() - offset) + index_trace(seed, trace, names))
+                agents.append(index_agents(trace))
+
+    np.save(os.path.join(data_dir, INDEX_FILE), np.array(rows, dtype=INDEX_DTYPE))
+    with open(os.path.join(data_dir, INDEX_META), 'w') as f:
+        json.dump({'files' : files, 'names' : names, 'agents' : agents}, f)
+
+def read_index(data_dir, mmap_mode=None):
+    """(rows, meta) of the corpus index, (None, None) if there is none."""
+    path = os.path.join(data_dir, INDEX_FILE)
+    if not os.path.isfile(path) or not os.path.isfile(os.path.join(data_dir, INDEX_META)):
+        return None, None
+    with open(os.path.join(data_dir, INDEX_META)) as f:
+        meta = json.load(f)
+    return np.load(path, mmap_mode=mmap_mode), meta
+
+def index_is_current(data_dir, meta):
+    return meta is not None and \
+           [tuple(entry) for entry in meta['files']] == [(fn, os.path.getsize(os.path.join(data_dir, fn)))
+                                                         for fn in sorted(filter(is_trace_file, os.listdir(data_dir)))]
+
+class TraceCorpus:
+    """Traces in data_dir, read lazily through the corpus index (built or updated as needed)."""
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        rows, meta = read_index(data_dir)
+        if not index_is_current(data_dir, meta):
+            build_index(data_dir)
+        self.index, meta = read_index(data_dir, mmap_mode='r')
+        self.files = [fn for fn,size in meta['files']]
+        self.names = meta['names']
+        self.agents = meta['agents']
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return self.traces()
+
+    def select(self, behaviors=None, without=None, endings=None, limit=None, shard=None):
+        """
+        Index rows of matching traces, in corpus order. behaviors: has a decision with any of these
+        names. without: has none of these. endings: the last decision is one of these. The first
+        limit matches are taken, then every shard[1]th of them from shard[0].
+        """
+        keep = np.ones(len(self.index), dtype=bool)
+        if behaviors is not None:
+            keep &= (self.index['behaviors'] & self.name_bits(behaviors)) != 0
+        if without is not None:
+            keep &= (self.index['behaviors'] & self.name_bits(without)) == 0
+        if endings is not None:
+            keep &= np.isin(self.index['ending'], [self.names.index(n) for n in endings if n in self.names])
+        rows = np.flatnonzero(keep)
+        if limit is not None:
+            rows = rows[:limit]
+        if shard is not None:
+            k, n = shard
+            rows = rows[k::n]
+        return rows
+
+    def name_bits(self, names):
+        bits = 0
+        for n in names:
+            if n in self.names:
+                bits |= 1 << self.names.index(n)
+        return np.uint64(bits)
+
+    def traces(self, rows=None, **filters):
+        """Generate the traces at rows (or those select(**filters) picks), unpickling one at a time."""
+        if rows is None:
+            rows = self.select(**filters)
+        f = None
+        ifile = None
+        try:
+            for r in rows:
+                row = self.index[r]
+                if row['file'] != ifile:
+                    if f is not None: f.close()
+                    ifile = row['file']
+                    f = open(os.path.join(self.data_dir, self.files[ifile]), 'rb')
+                f.seek(int(row['offset']))
+                seed, trace = pickle.load(f)
+                yield trace
+        finally:
+            if f is not None: f.close()
+
+    def seed(self, row): return int(self.index[row]['seed'])
+
+    def agent_eids(self, row):
+        """As trace.agent_eids(), None if the trace couldn't tell."""
+        return set(self.agents[row]) if self.agents[row] is not None else None
+
+    def ending(self, row):
+        # -1 for an empty trace
+        ending = self.index[row]['ending']
+        return self.names[ending] if ending >= 0 else None
+
+def iter_traces(dir, limit=None, **filters):
+    """Streaming load_traces: generate the traces in dir, see TraceCorpus.select for the filters."""
+    return TraceCorpus(dir).traces(limit=limit, **filters)
+
 ##############################################################
 # Create hierarchical interactions in traces
 ##############################################################
@@ -31,6 +208,84 @@ def convert_traces(traces):
     return [convert_to_interactions(trace) for trace in traces]
 
 def convert_to_interactions(trace):
+    """
+    Group the decisions into interactions, as convert_to_interactions_rescan does, in one pass.
+
+    All interactions are open at once, each with its doing set. A decision is offered to the
+    open interactions it could involve (its agent or target acts or is targeted there), oldest
+    first, and starts a new interaction if none takes it. Interactions only see a decision if no
+    older one took it, which is what the rescan's used set gives.
+    """
+    interactions = []
+    # per interaction: eid : the behavior it's doing (retired lazily, as a decision is offered)
+    doings = []
+    # eid : interactions it may be involved in (a superset, pruned as they're found out of date)
+    involved = {}
+
+    for dn in trace.decisions:
+        agent = dn.agent(trace)
+        taken = False
+
+        if agent is not None:
+            target = dn.behavior_target(trace)
+            target_eid = target.eid if target is not None else None
+            candidates = involved.get(agent.eid, set())
+            if target_eid is not None:
+                candidates = candidates | involved.get(target_eid, set())
+
+            for k in sorted(candidates):
+                doing = doings[k]
+                taken = offer_decision(doing, dn, agent.eid, target_eid)
+                if taken:
+                    interactions[k].append(dn)
+                    involve(involved, dn, agent.eid, k)
+                    break
+                # keep the index to interactions these eids are still in
+                for eid in (agent.eid, target_eid):
+                    if eid in involved and not current_involvement(doing, eid):
+                        involved[eid].discard(k)
+
+        if not taken:
+            # starts its own interaction (non-behavioral events are one on their own)
+            interactions.append([dn])
+            doings.append({agent.eid : dn} if agent is not None else {})
+            if agent is not None:
+                involve(involved, dn, agent.eid, len(interactions) - 1)
+
+    return interactions
+
+def offer_decision(doing, dn, agent_eid, target_eid):
+    """The per-decision step of create_interaction: True if dn extends the interaction (updating doing)."""
+    # time moves on, retire active behaviors that have ended at the start of this behavior
+    for eid in [eid for eid,active in doing.items() if active.end_clock < dn.start_clock]:
+        del doing[eid]
+
+    if current_involvement(doing, agent_eid):
+        # agent already in interaction, extend if the target is also in or the agent continues
+        if (target_eid is not None and current_involvement(doing, target_eid)) or \
+                continued_involvement(doing, agent_eid, dn.start_clock):
+            doing[agent_eid] = dn
+            return True
+        # agent off to something else, no longer in this interaction
+        if agent_eid in doing:
+            del doing[agent_eid]
+
+    elif target_eid is not None and continued_involvement(doing, target_eid, dn.start_clock):
+        # agent not in interaction, target is continuing so extend
+        doing[agent_eid] = dn
+        return True
+
+    return False
+
+def involve(involved, dn, agent_eid, k):
+    """Index interaction k under the eids that dn, now doing[agent_eid] there, involves."""
+    for eid in (agent_eid, dn.behavior_target_id()):
+        if eid not in involved:
+            involved[eid] = set()
+        involved[eid].add(k)
+
+def convert_to_interactions_rescan(trace):
+    """Reference version of convert_to_interactions, each interaction scanning the rest of the trace."""
     used = set()
     return [create_interaction(trace, i, used) for i in range(len(trace.decisions)) if i not in used]
 
@@ -297,7 +552,67 @@ class MCNode:
 
 ##############################################################
 
-if __name__ == '__main__':
+def check_interactions(data_dir, sizes=(1000, 4000, 16000)):
+    """
+    convert_to_interactions against the rescan: the same grouping for every trace in data_dir
+    (whose states cover its decisions) and for synthetic traces of the given lengths, with timings.
+    """
+    import random, time
+    from components.cbehavior import BehaviorSig
+    from trace import Trace, DecisionNode
+
+    def grouping(trace, interactions):
+        position = {id(dn) : i for i,dn in enumerate(trace.decisions)}
+        return [[position[id(dn)] for dn in intr] for intr in interactions]
+
+    def compare(name, trace):
+        start = time.time()
+        ref = convert_to_interactions_rescan(trace)
+        t_rescan = time.time() - start
+        start = time.time()
+        got = convert_to_interactions(trace)
+        t_sweep = time.time() - start
+        assert grouping(trace, got) == grouping(trace, ref), name
+        print("{}: {} decisions, {} interactions, rescan {:.3f}s, sweep {:.3f}s".format(
+            name, len(trace.decisions), len(ref), t_rescan, t_sweep), flush=True)
+
+    if data_dir is not None and os.path.isdir(data_dir):
+        for trace in iter_traces(data_dir):
+            if index_agents(trace) is not None:
+                compare("trace", trace)
+
+    # synthetic: agents attacking, fleeing and gathering, over one state with all the entities
+    class Entity:
+        def __init__(self, eid): self.eid = eid
+    class Entities(dict):
+        pass
+    class State:
+        def __init__(self, clock, eids):
+            self.clock = clock
+            self.entities = Entities({eid : Entity(eid) for eid in eids})
+
+    rng = random.Random(0)
+    for n in sizes:
+        agents = list(range(2000, 2000 + max(4, n // 50)))
+        nodes = list(range(1000, 1000 + max(8, n // 25)))
+        trace = Trace()
+        clock = 0.0
+        for i in range(n):
+            clock += rng.random() * 0.2
+            agent = rng.choice(agents)
+            bname = rng.choice(('attack', 'flee', 'gather', 'gather'))
+            target = rng.choice(nodes if bname == 'gather' else [a for a in agents if a != agent])
+            trace.add_decision_node(clock, BehaviorSig(bname, (agent, target)), agent_eid=agent)
+            trace.decisions[-1].end_clock = clock + rng.random() * 3.0
+        trace.add_decision_node(clock, BehaviorSig('done', ()), instantaneous=True)
+        trace.states = [State(clock + 4.0, agents + nodes)]
+        compare("synthetic", trace)
+
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == 'check':
+    # python -m exp01.trace_processing check [trace dir]
+    check_interactions(sys.argv[2] if len(sys.argv) > 2 else DATA_DIR)
+
+elif __name__ == '__main__':
     traces = load_traces(DATA_DIR)
 
     # convert to hierarchical events
@@ -0,0 +1,101 @@
+import os, random, zlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+##############################################################
+# Parallel estimator training
+#
+# Training scripts collect their (estimator, training data) jobs first, fit them here, then
+# hand the fitted estimators back to their nodes/schema. Every job is seeded from its key,
+# so results don't depend on the worker count or which worker ran the job.
+##############################################################
+
+# worker processes (1 fits in this process)
+WORKERS = os.cpu_count() or 1
+
+# base seed for job seeds
+SEED = 0
+
+# job steps
+TRAIN = 'train'
+VALIDATE = 'validate'
+
+class Job:
+    """One estimator to fit: est.train/est.validate on (V, X, y), in the order given by steps."""
+    def __init__(self, key, est, V, X, y, steps=(TRAIN, VALIDATE)):
+        self.key = key
+        self.est = est
+        self.V = V
+        self.X = X
+        self.y = y
+        self.steps = steps
+
+def job_seed(key, seed=SEED):
+    """Seed for a job key (str() of the key, so not subject to per-process hash randomization)."""
+    return zlib.crc32('{}:{}'.format(seed, key).encode()) & 0x7fffffff
+
+def run_job(job, seed=SEED):
+    """Fit one job, returns (fitted estimator, last validation or None)."""
+    s = job_seed(job.key, seed)
+    random.seed(s)
+    np.random.seed(s)
+
+    validation = None
+    for step in job.steps:
+        if step == TRAIN:
+            job.est.train(job.V, job.X, job.y)
+        else:
+            validation = job.est.validate(job.V, job.X, job.y)
+    return job.est, validation
+
+def run_jobs(jobs, workers=None, seed=SEED):
+    """Fit all jobs, results in job order. Job keys should be unique."""
+    workers = WORKERS if workers is None else workers
+    if workers <= 1 or len(jobs) <= 1:
+        return [run_job(job, seed) for job in jobs]
+
+    # largest jobs first, so a big one doesn't start last
+    order = sorted(range(len(jobs)), key=lambda i: -len(jobs[i].X))
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        futures = [(i, pool.submit(run_job, jobs[i], seed)) for i in order]
+        for i, future in futures:
+            results[i] = future.result()
+    return results
+
+
+##############################################################
+# Serial vs pooled fits of synthetic jobs
+# (run from src: python -m exp01.training [workers])
+##############################################################
+
+if __name__ == '__main__':
+    import sys, time
+    from exp01.estimation import ABClassifierEstimator, RandomForestRegressionEstimator, LinearEstimator
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else WORKERS
+    rng = np.random.RandomState(1)
+    V = ['agent.hp', 'target.hp', 'reln-agent-target.dist', 'target.max_hp']
+    jobs = []
+    for n in range(8):
+        X = rng.rand(60 + 10 * n, len(V)).tolist()
+        y = [int(x[0] + rng.rand() > 1.0) for x in X]
+        jobs.append(Job(('node{}'.format(n), 'outcome', 0), ABClassifierEstimator(), V, X, y))
+        d = [10 * x[2] + rng.rand() for x in X]
+        jobs.append(Job(('node{}'.format(n), 'duration', 0), RandomForestRegressionEstimator(), V, X, d))
+        jobs.append(Job(('node{}'.format(n), 'duration', 1), LinearEstimator(), V, X, d))
+
+    start = time.time()
+    serial = run_jobs(jobs, workers=1)
+    t_serial = time.time() - start
+    start = time.time()
+    pooled = run_jobs(jobs, workers=workers)
+    t_pooled = time.time() - start
+
+    probe = rng.rand(50, len(V))
+    for (e0, v0), (e1, v1) in zip(serial, pooled):
+        assert e0.variables == e1.variables and str(v0) == str(v1)
+        rows = [[x[V.index(v)] for v in e0.variables] for x in probe]
+        assert all(str(e0.estimate(r)) == str(e1.estimate(r)) for r in rows)
+    print("{} jobs: serial {:.1f} s, {} workers {:.1f} s ({:.1f}x), same fits".format(
+        len(jobs), t_serial, workers, t_pooled, t_serial / t_pooled))
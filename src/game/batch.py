@@ -0,0 +1,117 @@
+# Headless batch trials - seeded Worldspec runs across a process pool, fixed timestep, no pygame
+#
+# python batch.py [spec] [trials] [processes]
+
+import os, sys, random, pickle, time
+import multiprocessing
+
+import eventlog
+
+from runner import RunnerPassThrough
+from worldspec import Worldspec
+
+# control variables
+DATA_DIR = os.path.join("..", "..", "results", "batch")
+SPEC = 'balance'
+TRIALS = 1000
+BASE_SEED = 0
+TIME_LIMIT = 120
+FIXED_TIMESTEP = 0.02
+# world snapshots in each trace (see Trace), None for full copies
+KEYFRAME_EVERY = 10
+
+DIM = (768, 768)
+
+WEAPONS = ((2004, 1), (2006, 1), (2007, 1), (2008, 1)) # 2004 is no weapon
+ATTACKS = ((3000, 1), (3001, 1), (3002, 1), (3003, 1))
+
+def trace_path(data_dir, spec_name, seed):
+    return os.path.join(data_dir, "trace-{}-{}.pkl".format(spec_name, seed))
+
+def quiet():
+    """Pool initializer: trials print a lot, and nobody reads it in batch runs."""
+    sys.stdout = open(os.devnull, 'w')
+    # and don't format log messages for it
+    eventlog.LIVE = eventlog.NULL
+
+def run_trial(job):
+    """Run one seeded trial to completion and write (seed, trace) to disk. Returns (seed, updates, clock, seconds)."""
+    spec_name, seed, data_dir, time_limit, fixed_timestep, keyframe_every = job
+    start = time.time()
+
+    # Worldspec seeds the generator, so the run is repeatable from the seed alone
+    worldspec = Worldspec(DIM, seed, WEAPONS, ATTACKS)
+    r = RunnerPassThrough(DIM, DIM, fixed_timestep, keyframe_every)
+    focus_eid = r.setup(worldspec.spec[spec_name])
+
+    while True:
+        # exit condition
+        exit = False
+        if r.done():
+            # still allow an update, for behavior cleanup
+            r.trace.add_event(r.world, '(done)')
+            exit = True
+
+        # focus death (killed or dehydration)
+        if r.world.entities.get(focus_eid) is None:
+            exit = True
+
+        r.advance(fixed_timestep)
+
+        if exit:
+            break
+
+        # loop
+        if r.trace.looping():
+            r.trace.add_event(r.world, '(looping)', out_of_update=True)
+            break
+
+        # time limit
+        if r.world.clock > time_limit:
+            r.trace.add_event(r.world, '(timeout)', out_of_update=True)
+            break
+
+    r.trace.annotate_endings()
+
+    # written under a temporary name first, so a killed batch never leaves a partial trace
+    path = trace_path(data_dir, spec_name, seed)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump((seed, r.trace), f)
+    os.replace(path + '.tmp', path)
+
+    return seed, r.uct, r.world.clock, time.time() - start
+
+def run_batch(spec_name, trials, data_dir, processes=None, base_seed=BASE_SEED, time_limit=TIME_LIMIT,
+              fixed_timestep=FIXED_TIMESTEP, keyframe_every=KEYFRAME_EVERY):
+    """
+    Run trials seeded trials of a Worldspec, writing one trace file per seed as each finishes.
+    Seeds whose trace is already on disk are skipped, so an interrupted batch can be restarted.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    seeder = random.Random(base_seed)
+    seeds = [seeder.randint(0, sys.maxsize) for i in range(trials)]
+    jobs = [(spec_name, seed, data_dir, time_limit, fixed_timestep, keyframe_every)
+            for seed in seeds if not os.path.exists(trace_path(data_dir, spec_name, seed))]
+    print("{} trials of '{}', {} already on disk".format(trials, spec_name, trials - len(jobs)), flush=True)
+
+    start = time.time()
+    updates = 0
+    sim_time = 0
+    with multiprocessing.Pool(processes, initializer=quiet) as pool:
+        for i, (seed, uct, clock, seconds) in enumerate(pool.imap_unordered(run_trial, jobs)):
+            updates += uct
+            sim_time += clock
+            elapsed = time.time() - start
+            print("[{}/{}] seed {}: {} updates, {:.2f}s world time in {:.2f}s ({:.0f} ups overall)".format(
+                i + 1, len(jobs), seed, uct, clock, seconds, updates / elapsed), flush=True)
+
+    elapsed = time.time() - start
+    print("Done: {} trials, {} updates, {:.0f}s world time in {:.1f}s => {:.0f} ups, {:.2f} trials/s".format(
+        len(jobs), updates, sim_time, elapsed, updates / max(elapsed, 1e-9), len(jobs) / max(elapsed, 1e-9)), flush=True)
+    return updates, elapsed
+
+if __name__ == '__main__':
+    spec_name = sys.argv[1] if len(sys.argv) > 1 else SPEC
+    trials = int(sys.argv[2]) if len(sys.argv) > 2 else TRIALS
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    run_batch(spec_name, trials, DATA_DIR, processes)
@@ -29,6 +29,9 @@ class VisibleFilter:
         # increment counts for each entity in world according to position
         offset = self.viewport_offset(world, pid)
         #print("offset {}, halfport {}".format(offset, self.halfport))
+        if hasattr(world.entities, 'columns'):
+            # columnar entity store, do it in one pass over the rows
+            return self.filter_columns(world.entities.columns, offset)
         for eid, ent in world.entities.all():
             vpos = self.world_to_viewport(ent.pos, offset)
             if self.within_viewport(vpos):
@@ -38,6 +41,14 @@ class VisibleFilter:
             #    print("{} => {} out of view".format(ent.pos, vpos))
         return self.obs
 
+    def filter_columns(self, columns, offset):
+        vpos = columns.live_pos() - (offset.x, offset.y) + (self.halfport.x, self.halfport.y)
+        inside = (vpos[:, 0] > 0) & (vpos[:, 0] < self.viewport_dim[0]) & (vpos[:, 1] > 0) & (vpos[:, 1] < self.viewport_dim[1])
+        fpos = (vpos[inside] * self.ratio).astype(np.int64)
+        types = [self.type_indeces[tid] for tid in columns.live_tid()[inside].tolist()]
+        np.add.at(self.obs, (fpos[:, 0], fpos[:, 1], types), 1)
+        return self.obs
+
     def within_viewport(self, pos):
         return pos.x > 0 and pos.x < self.viewport_dim[0] and pos.y > 0 and pos.y < self.viewport_dim[1]
 
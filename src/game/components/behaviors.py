@@ -2,6 +2,7 @@
 
 from constants import *
 import data
+import gamedata
 
 
 BTS = {}
@@ -280,7 +281,7 @@ class IsInRange(BTNode):
         if not "Target" in btcomp.bb or btcomp.bb["Target"] is None:
             return FAILURE, []
         else:
-            dist = data.render[e.tid]['size'] + data.render[btcomp.bb["Target"].tid]['size'] + self.range
+            dist = gamedata.melee_dist(e.tid, btcomp.bb["Target"].tid) + self.range
             path = btcomp.bb["Target"].pos - e.pos
             m = path.magnitude()
 
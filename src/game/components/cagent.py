@@ -2,15 +2,18 @@
 #  Agent Variables
 ##########################
 
-import random
+import random, copy, heapq
 
 from components.cbehavior import *
 from components.reasoning.goals import Goal_HasItemType, GoalNode
 import data
+import gamedata
 import constants
 
 # module level
 DEBUG = True
+# keep candidates and their scores across frames (False re-scores everything every frame)
+INCREMENTAL = True
 
 # component storage and system update class
 class ComponentStoreAgent(ComponentStore):
@@ -102,10 +105,10 @@ class CAgent:
 
             if self.active_behavior is not None:
                 #print(self.active_behavior.status)
-                if DEBUG: print("[{:.2f}] Agent: replacing active {}".format(world.clock, self.active_behavior.short_status()))
+                if DEBUG: world.log.debug("[{:.2f}] Agent: replacing active {}", world.clock, self.active_behavior.short_status())
                 world.behaviors.remove(self.eid, self.active_behavior.status, world)
             # apply new
-            if DEBUG and not world.simulation: print("[{:.2f}] Agent: starting {}".format(world.clock, self.proposal))
+            if DEBUG: world.log.debug("[{:.2f}] Agent: starting {}", world.clock, self.proposal)
             self.active_behavior = self.proposal
             self.active_behavior.status = RUNNING
             self.proposal = None
@@ -114,7 +117,7 @@ class CAgent:
 
         # got here, no proposal, check for reaping
         if self.active_behavior is not None and self.active_behavior.status != RUNNING:
-            if DEBUG: print("{} Agent: reaping active {}".format(world.clock, self.active_behavior.short_status()))
+            if DEBUG: world.log.debug("{} Agent: reaping active {}", world.clock, self.active_behavior.short_status())
             #if trace: trace.end_update(world, self.eid, self.active_behavior.sig(), self.active_behavior.status)
             world.behaviors.remove(self.eid, self.active_behavior.status, world)
             self.active_behavior = None
@@ -123,12 +126,63 @@ class CAgent:
         # has no current behavior or still running current behavior
         return
 
+##############################################################
+# Candidate behaviors kept across frames
+##############################################################
+
+class Candidate:
+    """A candidate behavior, its last score and the state that score was computed from."""
+    __slots__ = ('behavior', 'stamp', 'score')
+
+    def __init__(self, behavior):
+        self.behavior = behavior
+        self.stamp = None
+        self.score = None
+
+class CandidateSet:
+    """
+    One agent's candidates, created when their source appears (an entity entering awareness, a
+    new inventory item, a trap to lure to) and dropped when it goes, instead of every frame.
+    """
+    def __init__(self, agent_eid):
+        # gather at the remembered water source
+        self.memory = None
+        # eid in awareness : {kind : Candidate}
+        self.nearby = {}
+        # (eid, trap eid) : Candidate
+        self.lures = {}
+        # fixed, one per recipe
+        self.crafts = [Candidate(CBehaviorCraft(agent_eid, iclass)) for iclass in data.recipes.keys()]
+        # iid : {kind : Candidate}
+        self.items = {}
+
+    def remembered(self, agent_eid, target_eid):
+        if self.memory is None or self.memory.behavior.target_eid != target_eid:
+            self.memory = Candidate(CBehaviorMoveAndGather(agent_eid, target_eid))
+        return self.memory
+
+def candidate(cache, kind, make):
+    c = cache.get(kind)
+    if c is None:
+        c = cache[kind] = Candidate(make())
+    return c
+
+def detached(behavior):
+    """Copy of a cached candidate to hand out (proposals get activated and updated)."""
+    if isinstance(behavior, type):
+        return behavior
+    b = copy.copy(behavior)
+    if type(b) is CBehaviorMoveAndGather:
+        b.drop = list(behavior.drop)
+    return b
+
 ##############################################################
 # Behavior Evaluation Agent
 ##############################################################
 
 class CAgent_BehaviorEval(CAgent):
     """Incrementally generate, evaluate and choose best behavior."""
+    candidates = None
 
     def __init__(self, eid, goals):
         super().__init__(eid, goals)
@@ -139,6 +193,15 @@ class CAgent_BehaviorEval(CAgent):
         for g in goals:
             s.add_precedent(GoalNode(g))
 
+        # CandidateSet, built on first consider
+        self.candidates = None
+
+    def __getstate__(self):
+        # a cache, rebuilt by whichever copy considers next
+        state = self.__dict__.copy()
+        state['candidates'] = None
+        return state
+
 
     ########### behavior generation/evaluation ##############
 
@@ -146,6 +209,9 @@ class CAgent_BehaviorEval(CAgent):
         """Return the top n options at this time. Return all if n is None."""
 
         # generate all candidate behaviors: gather, fight, flee, craft
+        if self.candidates is None or not INCREMENTAL:
+            self.candidates = CandidateSet(self.eid)
+        cs = self.candidates
         candidates = []
         agent = world.entities.get(self.eid)
         a = world.drink.get(self.eid)
@@ -155,35 +221,55 @@ class CAgent_BehaviorEval(CAgent):
             a_mem = world.memory.get(self.eid)
             target_eid = a_mem.remember(1005)
             if target_eid is not None:
-                candidates.append(CBehaviorMoveAndGather(self.eid, target_eid))
+                candidates.append(cs.remembered(self.eid, target_eid))
 
+        # entities in awareness keep their candidates, ones that left are dropped
+        nearby = {}
+        trap = world.trap.get(self.eid)
         for eid,ent in world.entities_within_range(self.eid, data.awareness[data.AGENT_TYPE_ID]):
+            cache = nearby[eid] = cs.nearby.get(eid) or {}
             if ent.tid in data.gatherable:
-                if world.tag.get(ent.eid).tag is self.eid or world.tag.get(ent.eid).firmness is not 'Hard':
-                    candidates.append(CBehaviorMoveAndGather(self.eid, eid))
+                if world.tag.get(ent.eid).tag == self.eid or world.tag.get(ent.eid).firmness != 'Hard':
+                    candidates.append(candidate(cache, 'gather', lambda: CBehaviorMoveAndGather(self.eid, eid)))
             if ent.tid in data.combatants:
-                candidates.append(CBehaviorFlee(self.eid, eid))
-                candidates.append(CBehaviorMoveAndAttack(self.eid, eid))
-                if world.trap.get(self.eid):
-                    candidates.append(CBehaviorLure(self.eid, eid, world.trap.get(self.eid).eid))
-                candidates.append(CBehaviorTrap)
-        for iclass in data.recipes.keys():
-            candidates.append(CBehaviorCraft(self.eid, iclass))
+                candidates.append(candidate(cache, 'flee', lambda: CBehaviorFlee(self.eid, eid)))
+                candidates.append(candidate(cache, 'attack', lambda: CBehaviorMoveAndAttack(self.eid, eid)))
+                if trap:
+                    candidates.append(candidate(cs.lures, (eid, trap.eid), lambda: CBehaviorLure(self.eid, eid, trap.eid)))
+                candidates.append(candidate(cache, 'trap', lambda: CBehaviorTrap))
+        cs.nearby = nearby
+        if not trap:
+            cs.lures = {}
+
+        candidates.extend(cs.crafts)
 
         for idf in inv.all():
+            cache = cs.items.get(idf[0])
+            if cache is None:
+                cache = cs.items[idf[0]] = {}
             if idf[0] in data.edibles:
-                candidates.append(CBehaviorEat(self.eid, idf[0]))
+                candidates.append(candidate(cache, 'eat', lambda: CBehaviorEat(self.eid, idf[0])))
             if idf[0] in data.hp_items:
-                candidates.append(CBehaviorHeal(self.eid, idf[0]))
+                candidates.append(candidate(cache, 'heal', lambda: CBehaviorHeal(self.eid, idf[0])))
             if idf[0] in data.drinks:
-                candidates.append(CBehaviorDrink(self.eid, idf[0]))
+                candidates.append(candidate(cache, 'drink', lambda: CBehaviorDrink(self.eid, idf[0])))
 
-        # evaluate
+        # evaluate, only candidates whose inputs changed since they were last scored
         ent = world.entities.get(self.eid)
-        evaluated = [(b, self.evaluate(b, world, ent)) for b in candidates]
-
-        # sort
-        evaluated.sort(key=lambda e: e[1], reverse=True)
+        items = tuple(inv.item_counts.items())
+        goals = tuple((g.version for g in self.goals))
+        for c in candidates:
+            stamp = self.score_stamp(c.behavior, world, ent, inv, items, goals)
+            if stamp is None or stamp != c.stamp:
+                if type(c.behavior) is CBehaviorMoveAndGather:
+                    c.behavior.drop = []
+                c.score = self.evaluate(c.behavior, world, ent)
+                c.stamp = stamp
+
+        # best first (ties keep generation order), only as many as asked for
+        ranked = ((-c.score, i, c) for i, c in enumerate(candidates))
+        ranked = sorted(ranked) if n is None else heapq.nsmallest(n, ranked)
+        evaluated = [(detached(c.behavior), c.score) for neg, i, c in ranked]
         # print("Sorted: {}".format(", ".join(("{}: {}".format(s,b.short()) for b,s in evaluated))))
 
         if len(evaluated) > 0 and evaluated[0][1] > 0:
@@ -192,8 +278,7 @@ class CAgent_BehaviorEval(CAgent):
                 self.proposal = CBehaviorStun(self.eid)
             elif evaluated[0][0] != self.active_behavior:
                 self.proposal = evaluated[0][0]
-                if ACTION_LOG and not world.simulation: print(
-                    "[{:.2f}] {} selecting {}".format(world.clock, ent, self.proposal.short()))
+                if ACTION_LOG: world.log.info("[{:.2f}] {} selecting {}", world.clock, ent, self.proposal.short())
 
                 # return requested top n candidates (to support cursor)
                 if n is None: return [b for b, s in evaluated]
@@ -223,6 +308,38 @@ class CAgent_BehaviorEval(CAgent):
 
         return None
 
+    def score_stamp(self, behavior, world, agent, inv, items, goals):
+        """
+        The state behavior's score depends on, compared with the stamp from when it was last scored.
+        None for candidates that are re-scored every frame (fights and consumables read hp, timers
+        and other agents' actions, and are cheap).
+        """
+        t = type(behavior)
+        if t is CBehaviorMoveAndGather:
+            tgt = world.entities.get(behavior.target_eid)
+            d = world.drink.get(self.eid)
+            e = world.eat.get(self.eid)
+            # the relationship check, as evaluate reads it
+            rival = None
+            tgttag = world.tag.get(tgt.eid)
+            if tgttag is not None and tgttag.tag is not self.eid:
+                rival = world.relationship.get(self.eid).get(tgttag)
+                if rival < 0:
+                    pos = world.entities.get(tgttag.tag).pos
+                    rival = (rival, pos.x, pos.y)
+            # thirst, hunger and hp only as far as evaluate branches on them (they change every update)
+            hunger = None
+            if e.food < 0:
+                hunger = 3 if e.weak_timer >= 3.0 else 2 if e.weak_timer >= 2.0 else 1
+            return (tgt.tid, tgt.pos.x, tgt.pos.y, agent.pos.x, agent.pos.y, agent.hp if agent.hp < 1.0 else None,
+                    items, inv.item_limit, goals, d.thirst < .6, hunger, rival)
+        if t is CBehaviorCraft:
+            return (items, goals)
+        if behavior is CBehaviorTrap or t is CBehaviorLure:
+            # constant
+            return ()
+        return None
+
     def evaluate(self, behavior, world, agent, dirty=False):
         if type(behavior) is CBehaviorMoveAndAttack:
 
@@ -232,18 +349,17 @@ class CAgent_BehaviorEval(CAgent):
             dtid = data.loot[world.entities.get(behavior.target_eid).tid]
             a=world.agents.get(agent.eid)
             for b in a.goals:
-                c_l=b.tree_leaves()
-                if(len(c_l)==0):
+                view = b.view()
+                if(len(view.leaves)==0):
                     if len(b.needed)==0:
                         if b.tid == dtid:
                             reward =b.value
                             cost = ((world.entities.get(behavior.target_eid).pos - agent.pos).magnitude() / data.movement_speed[data.AGENT_TYPE_ID])
                 else:
-                    for c in c_l:
-                        if len(c.needed)==0:
-                            if c.tid==dtid:
-                                reward= c.value
-                                cost = ((world.entities.get(behavior.target_eid).pos - agent.pos).magnitude() / data.movement_speed[data.AGENT_TYPE_ID])
+                    c = view.done.get(dtid)
+                    if c is not None:
+                        reward= c.value
+                        cost = ((world.entities.get(behavior.target_eid).pos - agent.pos).magnitude() / data.movement_speed[data.AGENT_TYPE_ID])
             if reward != 0:
                 return 100 + reward / cost
 
@@ -355,20 +471,17 @@ class CAgent_BehaviorEval(CAgent):
 
             a = world.agents.get(agent.eid)
             for a in a.goals:
-                for b in a.tree_leaves():
-                    if len(b.needed)==0:  # this means that agent is doing winning goal
-                        gnode=b
-                        for dtid, dmin, dmax, drate in data.gatherable[tid][1]:
-                            if gnode.tid == dtid:
-                                # tgt drops goal item
-                                reward = gnode.value * (((dmin + dmax) / 2) / gnode.ct) * drate
-                    else:
-                        needed=b.needed
-                        for gnode in needed:
-                            for dtid, dmin, dmax, drate in data.gatherable[tid][1]:
-                                if gnode.tid == dtid:
-                                    # tgt drops goal item
-                                    reward = gnode.value * (((dmin + dmax) / 2) / gnode.ct) * drate
+                # the last goal node (done leaf, or needed item) that tgt drops, and its last drop entry
+                wanted = a.view().wanted
+                best = None
+                for dtid, drop in gamedata.DROPS[tid].items():
+                    w = wanted.get(dtid)
+                    if w is not None and (best is None or w[0] > best[0][0]):
+                        best = (w, drop)
+                if best is not None:
+                    # tgt drops goal item
+                    (rank, gnode), (mean, drate) = best
+                    reward = gnode.value * (mean / gnode.ct) * drate
 
 
             # if the behavior is being passed in with a fake entity don't run these evaluations.
@@ -417,16 +530,13 @@ class CAgent_BehaviorEval(CAgent):
             # done assessing goals, if there is reward, then calculate cost and return
             b=world.agents.get(agent.eid)
             for a in b.goals:
-                for c,prev in a.all_nodes(a.strategy):
-                    if c.tid==behavior.item_typeid:
-                        if behavior.enabled(world,self.eid):
-                            reward=1
-                    elif a.tid==behavior.item_typeid:
-                        if behavior.enabled(world,self.eid):
-                            reward=1
-                    if reward>0:
-                        cost = data.recipes[behavior.item_typeid][0]  # crafting time
-                        return reward / cost
+                view = a.view()
+                if view.nodes and (behavior.item_typeid in view.tids or a.tid==behavior.item_typeid):
+                    if behavior.enabled(world,self.eid):
+                        reward=1
+                if reward>0:
+                    cost = data.recipes[behavior.item_typeid][0]  # crafting time
+                    return reward / cost
 
         elif type(behavior) is CBehaviorEat:
             a = world.eat.get(self.eid)
@@ -485,3 +595,56 @@ class CAgent_BehaviorEval(CAgent):
         # nothing useful found
         return 0
 
+
+
+##########################
+#  Consider cost with and without the kept candidate set
+#  (run from src/game: python -m components.cagent [spec] [ticks])
+##########################
+
+if __name__ == '__main__':
+    import sys, time
+    import eventlog
+    # the module the world's agents come from (this one runs as __main__)
+    import components.cagent as cagent
+    from runner import RunnerPassThrough
+    from worldspec import Worldspec
+
+    spec = sys.argv[1] if len(sys.argv) > 1 else 'balance'
+    ticks = int(sys.argv[2]) if len(sys.argv) > 2 else 1500
+    DIM = (768, 768)
+    eventlog.LIVE = eventlog.NULL
+
+    def run(incremental):
+        """Seeded run timing CAgent_BehaviorEval.consider; returns (seconds, calls, proposals)."""
+        cagent.INCREMENTAL = incremental
+        random.seed(1)
+        worldspec = Worldspec(DIM, 1, ((3000, 1),), ((2004, 1),))
+        r = RunnerPassThrough(DIM, DIM, 0.02)
+        focus = r.setup(worldspec.spec[spec])
+        r.start()
+        spent = [0.0, 0]
+        proposals = []
+        consider = cagent.CAgent_BehaviorEval.consider
+        def timed(self, world, dt, n=1):
+            start = time.perf_counter()
+            options = consider(self, world, dt, n)
+            spent[0] += time.perf_counter() - start
+            spent[1] += 1
+            proposals.append(str(self.proposal))
+            return options
+        cagent.CAgent_BehaviorEval.consider = timed
+        try:
+            for t in range(ticks):
+                if r.world.entities.get(focus) is None:
+                    break
+                r.step(False)
+        finally:
+            cagent.CAgent_BehaviorEval.consider = consider
+        return spent[0], spent[1], proposals
+
+    full_t, calls, full_p = run(False)
+    inc_t, calls, inc_p = run(True)
+    assert full_p == inc_p, "proposals differ"
+    print("{} considers: full rebuild {:.1f} us, incremental {:.1f} us per call ({:.2f}x)".format(
+        calls, full_t / calls * 1e6, inc_t / calls * 1e6, full_t / inc_t))
@@ -5,6 +5,7 @@ import random
 
 from constants import *
 import data
+import gamedata
 
 from components.cstore import ComponentStore
 from random import randint
@@ -33,7 +34,7 @@ class CAttack:
 
         agent = world.entities.get(agent_eid)
         target = world.entities.get(target_eid)
-        self.melee_dist = data.render[agent.tid]['size'] + data.render[target.tid]['size']
+        self.melee_dist = gamedata.melee_dist(agent.tid, target.tid)
 
         self.originals = None
         self.debuff = False
@@ -45,15 +46,7 @@ class CAttack:
     def agent_best_weapon(self, agent_eid, world):
         inv = world.inventories.get(agent_eid)
         if inv is None: return
-        maxdps = 0
-        maxw = None
-        for wid,ct in inv.all_weapons():
-            cd,dmg,range = data.weapons[wid]
-            dps = (dmg[0] + dmg[1])/2.0/cd
-            if dps > maxdps:
-                maxdps = dps
-                maxw = wid
-        return maxw
+        return gamedata.best_weapon(inv.item_counts)
 
     def checkAttack(self, agent_eid, world):
         inv = world.inventories.get(agent_eid)
@@ -91,16 +84,15 @@ class ComponentStoreAttack(ComponentStore):
                     agent = self.world.entities.get(eid)
                     hpprior = target.hp
 
-                    dist = (target.pos - agent.pos).magnitude()
-                    if dist <= act.melee_dist + act.range:
+                    reach = act.melee_dist + act.range
+                    if target.pos.distance_sq(agent.pos) <= reach * reach:
                         if DET:
                             dmg = (act.damage[0]+act.damage[1])/2
                         else:
                             dmg = act.damage[0] + (random.random() * (act.damage[1] - act.damage[0]))
                         target.hp -= dmg
-                        if ACTION_LOG and not self.world.simulation: print("[{:.2f}] {} takes {:.2f} damage from {}".format(self.world.clock, target, dmg,
-                                                                                                                   self.world.entities.get(act.agent_eid),
-                                                                                                  ))
+                        if ACTION_LOG: self.world.log.info("[{:.2f}] {} takes {:.2f} damage from {}", self.world.clock, target, dmg,
+                                                           self.world.entities.get(act.agent_eid))
                         # and reset cooldown
 
                         act.cd_timer = act.cooldown
@@ -119,9 +111,9 @@ class ComponentStoreAttack(ComponentStore):
                                 if item is not 0:
                                     inv_mugged.remove(item, 1)
                                     inv.add(item, 1, self.world)
-                                    print("[{:.2f}] Agent mugged for {}x {}".format(self.world.clock, 1, item))
+                                    self.world.log.info("[{:.2f}] Agent mugged for {}x {}", self.world.clock, 1, item)
                                 else:
-                                    print("[{:.2f}] Agent finished mugging".format(self.world.clock))
+                                    self.world.log.info("[{:.2f}] Agent finished mugging", self.world.clock)
                                 target.hp = hpprior
                                 noConstantAttack = self.world.relationship.get(eid)
                                 if noConstantAttack is not None:
@@ -131,9 +123,8 @@ class ComponentStoreAttack(ComponentStore):
                                 self.world.entities.get(target.eid).flag = 'stun'
 
                             else:
-                                if ACTION_LOG and not self.world.simulation: print("[{:.2f}] {} slain by {}!".format(self.world.clock, target,
-                                                                                                                self.world.entities.get(act.agent_eid)
-                                                                                                                ))
+                                if ACTION_LOG: self.world.log.info("[{:.2f}] {} slain by {}!", self.world.clock, target,
+                                                                   self.world.entities.get(act.agent_eid))
                                 act.status = SUCCESS
 
 
@@ -151,8 +142,8 @@ class ComponentStoreAttack(ComponentStore):
                                                 relationship = self.world.relationship.get(attacker)
                                                 relationship.current = False
                                                 invs.add(data.loot[deadId], 1, self.world)
-                                                print("[{:.2f}] Agent obtained loot {}x {}".format(self.world.clock, 1,
-                                                                                                       data.loot[deadId]))
+                                                self.world.log.info("[{:.2f}] Agent obtained loot {}x {}", self.world.clock, 1,
+                                                                    data.loot[deadId])
                                 '''   ##########fire and ice stuff ################
                                     #set flag to type ready
                                 selectors = randint(0, 10)
@@ -39,17 +39,17 @@ class ComponentStoreAvoid(ComponentStore):
 
                 max_dist = 0
                 if(ent.tid == 2 or ent.tid == 3):
-                    print("if loop")
+                    world.log.debug("if loop")
                     possible_enemy.append(world.entities.get(eid))
 
 
                     enemy = world.entities.get(eid)
                     enemy = enemy.pos
-                    print("updating cavoid update")
+                    world.log.debug("updating cavoid update")
                     a.update(mov.dest, enemy)
 
             for k in possible_enemy:
-                print("possible enemy", k)
+                world.log.debug("possible enemy {}", k)
 
             # check for end of move condition
             if m < mov.dist:
@@ -63,5 +63,5 @@ class ComponentStoreAvoid(ComponentStore):
                 continue
 
             # normal move step
-            e.pos = e.pos + path.normalized(m) * step
+            e.pos = path.normalize_inplace(m).imul(step).iadd(e.pos)
             mov.status = RUNNING
\ No newline at end of file
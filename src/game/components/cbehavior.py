@@ -2,10 +2,12 @@
 #  Behaviors and Actions
 ##########################
 import random, math
+from collections import namedtuple
 
 from constants import *
 from vector2 import vector2
 import data
+import gamedata
 
 from components.cstore import ComponentStore
 
@@ -31,6 +33,20 @@ class ComponentStoreBehavior(ComponentStore):
         b.cleanup(eid, world)
         super().remove(eid, status, True)
 
+##########################
+# Behavior signatures
+##########################
+
+class BehaviorSig(namedtuple('BehaviorSig', ('name', 'args'))):
+    """
+    Hashable behavior signature, name and argument values: BehaviorSig('gather', (2028, 2013)).
+    Traces and igraph keys work on these; str() is the '(gather 2028 2013)' form, for display.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return '({} {})'.format(self.name, ' '.join((str(a) for a in self.args)))
+
 ##########################
 # Base Behavior
 ##########################
@@ -78,7 +94,7 @@ class CBehaviorFlee(CBehavior):
             # update direction each frame
             agent = world.entities.get(agent_eid)
             target = world.entities.get(self.target_eid)
-            flee_vector = (agent.pos - target.pos) * 100
+            flee_vector = (agent.pos - target.pos).imul(100)
 
             # DELETE_S1. data.attack_speed was being passed in instead of movement speed. Unsure if intentional. Has
             #            been changed to movement speed.
@@ -89,7 +105,7 @@ class CBehaviorFlee(CBehavior):
         if world.moving.get(eid) is not None:
             world.moving.remove(eid)
 
-    def sig(self): return str(self)
+    def sig(self): return BehaviorSig('flee', (self.agent_eid, self.target_eid))
 
     def __str__(self):
         return "(flee {} {})".format(self.agent_eid, self.target_eid)
@@ -132,16 +148,16 @@ class CBehaviorMoveAndGather(CBehavior):
                 # move done, at location for gather
                 world.moving.remove(agent)
                 world.gathering.add(agent, self.target_eid)
-                print("[{:.2f}] added gather, status {}".format(world.clock, world.gathering.get(agent).status))
+                world.log.debug("[{:.2f}] added gather, status {}", world.clock, world.gathering.get(agent).status)
             elif action_move.status == FAILURE:
                 # couldn't move there, bail out
                 world.moving.remove(agent)
-                print("moving failed")
+                world.log.debug("moving failed")
                 self.status = FAILURE
             elif not world.gathering.available(self.target_eid):
                 # move still running, but lost availability
                 world.moving.remove(agent)
-                print("node not available")
+                world.log.debug("node not available")
                 self.status = FAILURE
             # else moving in progress, done here either way
             return
@@ -150,12 +166,12 @@ class CBehaviorMoveAndGather(CBehavior):
             inv = world.inventories.get(agent)
             for iid in self.drop:
                 inv.drop(iid, 1, world)
-                print("[{:.2f}] Agent dropped 1x {}".format(world.clock, iid))
+                world.log.info("[{:.2f}] Agent dropped 1x {}", world.clock, iid)
 
         # not moving yet
         a = world.entities.get(agent)
         t = world.entities.get(self.target_eid)
-        dist = data.render[a.tid]['size'] + data.render[t.tid]['size']
+        dist = gamedata.melee_dist(a.tid, t.tid)
         world.moving.add(agent, t.pos, data.movement_speed[a.tid], dist)
 
     def cleanup(self, eid, world):
@@ -190,7 +206,7 @@ class CBehaviorMoveAndGather(CBehavior):
 
     ################# debug display #####################
 
-    def sig(self): return str(self)
+    def sig(self): return BehaviorSig('gather', (self.agent_eid, self.target_eid))
 
     def __str__(self):
         return "(gather {} {})".format(self.agent_eid, self.target_eid)
@@ -242,8 +258,7 @@ class CBehaviorMoveToLocation(CBehavior):
         if world.moving.get(eid) is not None:
             world.moving.remove(eid)
 
-    def sig(self):
-        return str(self)
+    def sig(self): return BehaviorSig('move', (self.agent_eid,))
 
     def __str__(self):
         return "(move {})".format(self.agent_eid)
@@ -282,7 +297,7 @@ class CBehaviorMoveToEntity(CBehavior):
         # not moving yet
         a = world.entities.get(agent_id)
         t = world.entities.get(self.target)
-        dist = data.render[a.tid]['size'] + data.render[t.tid]['size']
+        dist = gamedata.melee_dist(a.tid, t.tid)
         world.moving.add(agent_id, t.pos, self.speed, dist)
 
 ##########################
@@ -331,8 +346,7 @@ class CBehaviorCraft(CBehavior):
     def __str__(self):
         return "(craft {} {})".format(self.agent_eid, self.item_typeid)
 
-    def sig(self):
-        return str(self)
+    def sig(self): return BehaviorSig('craft', (self.agent_eid, self.item_typeid))
 
     def short(self):
         return "C{}".format(self.item_typeid)
@@ -404,13 +418,13 @@ class CBehaviorMoveAndAttack(CBehavior):
                     world.attacking.remove(agent_eid)
                 if power is None:
                     target = world.entities.get(self.target_eid)
-                    if ACTION_LOG and not world.simulation:
-                        print("[{:.2f}] {} super attacking {}".format(world.clock, agent, target))
+                    if ACTION_LOG:
+                        world.log.info("[{:.2f}] {} super attacking {}", world.clock, agent, target)
                     power = world.finisher.add(agent_eid, self.target_eid)
                     world.moving.add_replace(agent_eid, target.pos, data.attack_speed[agent.tid], power.melee_dist)
 
                 if power.status != RUNNING:
-                    print("done with power attack")
+                    world.log.debug("done with power attack")
                     world.finisher.remove(agent_eid)
                     world.attacking.add(agent_eid, self.target_eid)
                     return
@@ -424,8 +438,8 @@ class CBehaviorMoveAndAttack(CBehavior):
 
             elif action_attack is None:
                 # just starting
-                if ACTION_LOG and not world.simulation:
-                    print ("[{:.2f}] {} attacking {}".format(world.clock, agent, target))
+                if ACTION_LOG:
+                    world.log.info("[{:.2f}] {} attacking {}", world.clock, agent, target)
                 attack = world.attacking.add(agent_eid, self.target_eid)
                 world.moving.add_replace(agent_eid, target.pos, data.attack_speed[agent.tid], attack.melee_dist)
                 return
@@ -474,7 +488,7 @@ class CBehaviorMoveAndAttack(CBehavior):
 
     ################# debug display #####################
 
-    def sig(self): return str(self)
+    def sig(self): return BehaviorSig('attack', (self.agent_eid, self.target_eid))
 
     def __str__(self):
         return "(attack {} {})".format(self.agent_eid, self.target_eid)
@@ -499,7 +513,7 @@ class CBehaviorStun(CBehavior):
         stunner = world.stun.get(agent_eid)
         if agent.flag == 'stun':
             if stunner is None:
-                print("adding stunner")
+                world.log.debug("adding stunner")
                 stunner = world.stun.add(agent_eid)
             if stunner.status != RUNNING:
                 self.status = INTERRUPT
@@ -508,7 +522,7 @@ class CBehaviorStun(CBehavior):
             world.stun.remove(agent_eid)
             self.status = SUCCESS
 
-    def sig(self): return str(self)
+    def sig(self): return BehaviorSig('stunned', (self.agent_eid,))
 
     def __str__(self):
         return "(stunned {})".format(self.agent_eid)
@@ -549,7 +563,7 @@ class CBehaviorMobPatrol(CBehavior):
         return self.anchor + vector2(offset)
 
     def melee_dist(self, agent, target):
-        return data.render[agent.tid]['size'] + data.render[target.tid]['size']
+        return gamedata.melee_dist(agent.tid, target.tid)
 
     # specializing here, but stay stateless!
     def update(self, agent_eid, world, dt, trace=None):
@@ -588,7 +602,7 @@ class CBehaviorMobPatrol(CBehavior):
 
     ################# debug display #####################
 
-    def sig(self): return str(self)
+    def sig(self): return BehaviorSig('patrol', (self.agent_eid,))
 
     def __str__(self):
         return "(patrol {})".format(self.agent_eid)
@@ -616,8 +630,8 @@ class CBehaviorEat(CBehavior):
                 a.food = b[0]
             else:
                 a.food = a.food + item_hunger
-            print("[{:.2f}] agent eats for {} his new food meter is {}".format(world.clock, data.edibles[self.edible_iid][0],
-                                                                        a.food))
+            world.log.info("[{:.2f}] agent eats for {} his new food meter is {}", world.clock, data.edibles[self.edible_iid][0],
+                           a.food)
 
             #Check if the consumed food has removed the de-buffed state.
             if a.food > 0:
@@ -631,7 +645,7 @@ class CBehaviorEat(CBehavior):
         else:
             self.status = INTERRUPT
 
-    def sig(self): return str(self)
+    def sig(self): return BehaviorSig('eating', (self.agent_eid, self.edible_iid))
 
     def __str__(self):
         return "(eating {} {})".format(self.agent_eid, self.edible_iid)
@@ -672,14 +686,14 @@ class CBehaviorHeal(CBehavior):
                 a.hp = b[0]
             else:
                 a.hp = a.hp + item_heal
-            print("[{:.2f}] agent heals for {} his new hp is {}".format(world.clock, data.hp_items[self.heal_iid][0],
-                                                                        world.entities.get(agent_eid).hp))
+            world.log.info("[{:.2f}] agent heals for {} his new hp is {}", world.clock, data.hp_items[self.heal_iid][0],
+                           world.entities.get(agent_eid).hp)
 
             inv.remove(self.heal_iid, 1)
             world.heal.add(agent_eid, item_cd)
 
 
-    def sig(self): return str(self)
+    def sig(self): return BehaviorSig('healing', (self.agent_eid, self.heal_iid))
 
     def __str__(self):
         return "(healing {} {})".format(self.agent_eid, self.heal_iid)
@@ -715,15 +729,15 @@ class CBehaviorDrink(CBehavior): #Based off of CBehaviorMoveAndAttack & CBehavio
                 for iid, min, max, prob in g:
                     ct = (min+max)//2
                     inv.add(iid, ct, world)
-                    print("[{:.2f}] Agent obtained {}x {}".format(world.clock, ct, iid))
+                    world.log.info("[{:.2f}] Agent obtained {}x {}", world.clock, ct, iid)
 
-            print("[{:.2f}] agent drinks for {} his new thirst to be {}".format(world.clock, data.drinks[self.drink_iid], world.drink.get(agent_eid).thirst))
+            world.log.info("[{:.2f}] agent drinks for {} his new thirst to be {}", world.clock, data.drinks[self.drink_iid], world.drink.get(agent_eid).thirst)
             inv.remove(self.drink_iid, 1)
             self.status = SUCCESS
         else:
             self.status = INTERRUPT
 
-    def sig(self): return str(self)
+    def sig(self): return BehaviorSig('drink', (self.agent_eid, self.drink_iid))
 
     def __str__(self):
         return "(drink {} {})".format(self.agent_eid, self.drink_iid)
@@ -763,8 +777,7 @@ class CBehaviorTrap(CBehavior):
     def __str__(self):
         return "(set {} {})".format(self.agent_eid, self.trap_typeid)
 
-    def sig(self):
-        return str(self)
+    def sig(self): return BehaviorSig('set', (self.agent_eid, self.trap_typeid))
 
     def short(self):
         return "T{}".format(self.trap_typeid)
@@ -808,7 +821,7 @@ class CBehaviorLure(CBehavior):
         if world.moving.get(eid) is not None:
             world.moving.remove(eid)
 
-    def sig(self): return str(self)
+    def sig(self): return BehaviorSig('lure', (self.agent_eid, self.target_eid))
 
     def __str__(self):
         return "(lure {} {})".format(self.agent_eid, self.target_eid)
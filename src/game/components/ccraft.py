@@ -22,12 +22,12 @@ class CCraft:
         # initialize timer state
         self.progress = 0.0
         self.status = RUNNING
-        if DEBUG: print("Agent crafting {}...".format(item_typeid))
 
 # specialize for storing this type of component
 class ComponentStoreCraft(ComponentStore):
     def add(self, actor_eid, item_typeid):
         # REM: calculate duration
+        if DEBUG: self.world.log.debug("Agent crafting {}...", item_typeid)
         self.addc(actor_eid, CCraft(item_typeid))
 
     ##########################
@@ -64,7 +64,7 @@ class ComponentStoreCraft(ComponentStore):
                     if inv.item_amount(matid) < mct:
                         # failed!
                         act.status = FAILURE
-                        if DEBUG: print("...crafting failed!")
+                        if DEBUG: self.world.log.debug("...crafting failed!")
                         continue
 
                 # got the mats, remove them and add the crafted item
@@ -72,7 +72,7 @@ class ComponentStoreCraft(ComponentStore):
                     for matid,mct in recipe:
                         inv.remove(matid, mct)
                     inv.add(act.item_typeid, 1, self.world)
-                    if DEBUG: print("...crafting succeeded!")
+                    if DEBUG: self.world.log.debug("...crafting succeeded!")
 
                 # set status to end
                 act.status = SUCCESS
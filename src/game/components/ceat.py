@@ -38,16 +38,16 @@ class ComponentStoreEat(ComponentStore):
                 #               and 50 % respectively..
                 if a.weak_state == 0 and (a.weak_timer >= 1.0 and a.weak_timer <= 2.0):
                     a.weak_state = 1
-                    print("[{:.2f}] agent enters hunger state {}".format(self.world.clock, a.weak_state))
+                    self.world.log.info("[{:.2f}] agent enters hunger state {}", self.world.clock, a.weak_state)
                 elif a.weak_state == 1 and (a.weak_timer > 2.0 and a.weak_timer <= 3.0):
                     a.weak_state = 2
                     agent = self.world.entities.get(eid)
                     agent.debuff = 0.25
                     agent.buff_change = True
-                    print("[{:.2f}] agent enters hunger state {}".format(self.world.clock, a.weak_state))
+                    self.world.log.info("[{:.2f}] agent enters hunger state {}", self.world.clock, a.weak_state)
                 elif a.weak_state == 2 and a.weak_timer > 3.0:
                     a.weak_state = 3
                     agent = self.world.entities.get(eid)
                     agent.debuff = 0.5
                     agent.buff_change = True
-                    print("[{:.2f}] agent enters hunger state {}".format(self.world.clock, a.weak_state))
\ No newline at end of file
+                    self.world.log.info("[{:.2f}] agent enters hunger state {}", self.world.clock, a.weak_state)
\ No newline at end of file
@@ -4,12 +4,15 @@
 
 import data
 from components.cstore import ComponentStore
+from spatial import SpatialHash
 
 class CEntity:
-    def __init__(self, tid, eid, pos, hp, breed, flag):
+    def __init__(self, tid, eid, pos, hp, breed, flag, index=None):
         self.tid = tid
         self.eid = eid
-        self.pos = pos
+        # spatial index to notify on position changes (owned by the store)
+        self.index = index
+        self._pos = pos
         self.hp = hp
         self.breed = breed
         self.flag = flag
@@ -20,6 +23,25 @@ class CEntity:
         self.debuff = None
         self.buff_change = False
 
+    ########### position ##############
+
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, pos):
+        if self.index is not None:
+            self.index.move(self, self._pos, pos)
+        self._pos = pos
+
+    def __setstate__(self, state):
+        # traces pickled before the spatial index stored pos directly
+        if 'pos' in state:
+            state['_pos'] = state.pop('pos')
+            state.setdefault('index', None)
+        self.__dict__.update(state)
+
     ########### attributes ##############
 
 
@@ -32,8 +54,37 @@ class CEntity:
 
 # specialize for storing this type of component
 class ComponentStoreEntity(ComponentStore):
+    def reset(self):
+        super().reset()
+        # cells are a whole number of world grid steps
+        self.index = SpatialHash(self.world.grid_step * self.world.index_cells)
+
     def add(self, eid, tid, pos, hp, breed, flag):
-        return self.addc(eid, CEntity(tid, eid, pos, hp, breed, flag))
+        ent = self.addc(eid, CEntity(tid, eid, pos, hp, breed, flag, self.index))
+        self.index.insert(ent)
+        return ent
+
+    def fork(self, world, trace):
+        child = super().fork(world, trace)
+        child.index = self.index.fork()
+        return child
+
+    def cow_objects(self):
+        return {'index' : self.index}
+
+    def thaw(self, eid):
+        ent = super().thaw(eid)
+        # the index still points at the shared entity
+        self.index.buckets[self.index.key(ent.pos)][eid] = ent
+        return ent
+
+    def sweep(self, deleted):
+        for eid in self.remove_ids:
+            self.index.remove(self.cc[eid])
+        for eid in deleted:
+            if eid in self.cc:
+                self.index.remove(self.cc[eid])
+        super().sweep(deleted)
 
     def remove(self, eid):
         """Removal of entities is delayed to end-of-frame and supports sweeping all components for that entity."""
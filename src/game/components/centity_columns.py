@@ -0,0 +1,188 @@
+##########################
+#  Columnar (structure-of-arrays) entity storage
+#
+#  Optional replacement for ComponentStoreEntity, enabled with World(columnar=True).
+#  Positions, hp, tid and flags live in contiguous NumPy arrays so per-frame systems
+#  can run vectorized, while CEntityView keeps the CEntity interface for everything else.
+##########################
+
+import copy
+import numpy as np
+
+from vector2 import vector2
+from spatial import SpatialHash
+from components.centity import CEntity, ComponentStoreEntity
+
+class EntityColumns:
+    """
+    Dense rows of entity data plus the eid <-> row maps. Rows are packed: removing an
+    entity moves the last row into the hole, so [:size] is always the live set.
+    """
+    def __init__(self, capacity=256):
+        self.size = 0
+        self.pos = np.zeros((capacity, 2), dtype=np.float64)
+        self.hp = np.full(capacity, np.nan, dtype=np.float64)  # NaN is no hp (non-combatant)
+        self.tid = np.zeros(capacity, dtype=np.int32)
+        self.flag = np.zeros(capacity, dtype=np.int16)
+        self.eid = np.zeros(capacity, dtype=np.int64)
+
+        # eid -> row
+        self.rows = {}
+
+        # flags are small strings, stored as codes
+        self.flag_codes = {}
+        self.flag_names = []
+
+    def capacity(self):
+        return self.eid.shape[0]
+
+    def grow(self):
+        n = self.capacity() * 2
+        self.pos = np.resize(self.pos, (n, 2))
+        self.hp = np.resize(self.hp, n)
+        self.tid = np.resize(self.tid, n)
+        self.flag = np.resize(self.flag, n)
+        self.eid = np.resize(self.eid, n)
+
+    def flag_code(self, flag):
+        if flag not in self.flag_codes:
+            self.flag_codes[flag] = len(self.flag_names)
+            self.flag_names.append(flag)
+        return self.flag_codes[flag]
+
+    def add(self, eid, tid, pos, hp, flag):
+        if self.size == self.capacity():
+            self.grow()
+        row = self.size
+        self.size += 1
+
+        self.rows[eid] = row
+        self.eid[row] = eid
+        self.tid[row] = tid
+        self.pos[row] = (pos.x, pos.y)
+        self.hp[row] = np.nan if hp is None else hp
+        self.flag[row] = self.flag_code(flag)
+        return row
+
+    def remove(self, eid):
+        """Remove eid's row. Returns the eid whose row moved into the hole, or None."""
+        row = self.rows.pop(eid)
+        last = self.size - 1
+        self.size = last
+        if row == last:
+            return None
+
+        self.pos[row] = self.pos[last]
+        self.hp[row] = self.hp[last]
+        self.tid[row] = self.tid[last]
+        self.flag[row] = self.flag[last]
+        moved = int(self.eid[last])
+        self.eid[row] = moved
+        self.rows[moved] = row
+        return moved
+
+    ########### vectorized access ##############
+
+    def rows_for(self, eids):
+        """Row indices for a sequence of eids, in the same order."""
+        return np.fromiter((self.rows[eid] for eid in eids), dtype=np.int64, count=len(eids))
+
+    def live_pos(self): return self.pos[:self.size]
+    def live_hp(self): return self.hp[:self.size]
+    def live_tid(self): return self.tid[:self.size]
+    def live_flag(self): return self.flag[:self.size]
+    def live_eid(self): return self.eid[:self.size]
+
+class CEntityView(CEntity):
+    """CEntity whose core fields are read from and written to EntityColumns."""
+    def __init__(self, columns, eid, breed, index=None):
+        self.columns = columns
+        self.row = columns.rows[eid]
+        self.eid = eid
+        self.index = index
+        self.breed = breed
+
+        self.debuff = None
+        self.buff_change = False
+
+    @property
+    def pos(self):
+        x, y = self.columns.pos[self.row].tolist()
+        return vector2((x, y))
+
+    @pos.setter
+    def pos(self, pos):
+        if self.index is not None:
+            self.index.move(self, self.pos, pos)
+        self.columns.pos[self.row] = (pos.x, pos.y)
+
+    @property
+    def hp(self):
+        hp = self.columns.hp[self.row]
+        if hp != hp:
+            return None
+        return float(hp)
+
+    @hp.setter
+    def hp(self, hp):
+        self.columns.hp[self.row] = np.nan if hp is None else hp
+
+    @property
+    def tid(self):
+        return int(self.columns.tid[self.row])
+
+    @tid.setter
+    def tid(self, tid):
+        self.columns.tid[self.row] = tid
+
+    @property
+    def flag(self):
+        return self.columns.flag_names[self.columns.flag[self.row]]
+
+    @flag.setter
+    def flag(self, flag):
+        self.columns.flag[self.row] = self.columns.flag_code(flag)
+
+# specialize for storing this type of component
+class ComponentStoreEntityColumns(ComponentStoreEntity):
+    def reset(self):
+        super().reset()
+        self.columns = EntityColumns()
+
+    def add(self, eid, tid, pos, hp, breed, flag):
+        self.columns.add(eid, tid, pos, hp, flag)
+        ent = self.addc(eid, CEntityView(self.columns, eid, breed, self.index))
+        self.index.insert(ent)
+        return ent
+
+    def fork(self, world, trace):
+        # rows are cheap to copy outright, so the views are rebuilt instead of shared
+        child = super().fork(world, trace)
+        child.columns = copy.deepcopy(self.columns)
+        child.index = SpatialHash(self.index.step)
+        child.cc = {}
+        for eid, ent in self.cc.items():
+            view = copy.copy(ent)
+            view.columns = child.columns
+            view.index = child.index
+            child.cc[eid] = view
+            child.index.insert(view)
+        child.frozen = set()
+        self.frozen = set()
+        return child
+
+    def cow_objects(self):
+        # views are per-world, so anything still holding a parent's view remaps to ours
+        objects = {'view.{}'.format(eid) : view for eid, view in self.cc.items()}
+        objects.update({'index' : self.index, 'columns' : self.columns})
+        return objects
+
+    def sweep(self, deleted):
+        gone = set(self.remove_ids)
+        gone.update((eid for eid in deleted if eid in self.cc))
+        # index and component removal first, they still read positions from the rows
+        super().sweep(deleted)
+        for eid in gone:
+            moved = self.columns.remove(eid)
+            if moved is not None and moved in self.cc:
+                self.cc[moved].row = self.columns.rows[moved]
@@ -2,7 +2,7 @@ import random
 
 from constants import *
 import data
-import gui
+import gamedata
 from components.cstore import ComponentStore
 
 # module level
@@ -19,7 +19,7 @@ class CFinisher:
         target = world.entities.get_required(target_eid)
         self.targetBreed = target.breed
         hp, self.cooldown, self.damage, self.ranger = data.combatants[agent.tid]
-        self.melee_dist = data.render[agent.tid]['size'] + data.render[target.tid]['size']
+        self.melee_dist = gamedata.melee_dist(agent.tid, target.tid)
         ###############getting my attack###################
         if agent.flag == 'ready':
             self.damage, self.ranger, self.type = data.attacks[3005]
@@ -101,15 +101,15 @@ class ComponentStoreFinisher(ComponentStore):
                 if agent.flag != 'stun':
                     # apply damage if in range
 
-                    dist = (target.pos - agent.pos).magnitude()
-                    if dist <= act.melee_dist + act.ranger:
+                    reach = act.melee_dist + act.ranger
+                    if target.pos.distance_sq(agent.pos) <= reach * reach:
                         if DET:
                             dmg = (act.damage[0] + act.damage[1]) / 2
                         else:
                             dmg = act.damage[0] + (random.random() * (act.damage[1] - act.damage[0]))
                         target.hp -= dmg
                         if act.move != None:
-                            if ACTION_LOG and not self.world.simulation: print("[{:.2f}] {} takes {:.2f} super damage with {} from {}".format(self.world.clock, target, dmg, data.names[act.move], self.world.entities.get(act.agent_eid),))
+                            if ACTION_LOG: self.world.log.info("[{:.2f}] {} takes {:.2f} super damage with {} from {}", self.world.clock, target, dmg, data.names[act.move], self.world.entities.get(act.agent_eid))
 
                         ##########setting everything back to normal state##############
                             inv.remove(act.move, 1)
@@ -119,10 +119,8 @@ class ComponentStoreFinisher(ComponentStore):
                         #############################################################
                         # check for death
                         if target.hp < 0:
-                            if ACTION_LOG and not self.world.simulation: print(
-                                "[{:.2f}] {} super slain by {}!".format(self.world.clock, target,
-                                                                      self.world.entities.get(act.agent_eid)
-                                                                      ))
+                            if ACTION_LOG: self.world.log.info("[{:.2f}] {} super slain by {}!", self.world.clock, target,
+                                                               self.world.entities.get(act.agent_eid))
 
                             self.trace.death(act.agent_eid, act.target_eid, self.world)
                             dead = self.world.entities.get(act.target_eid)
@@ -133,8 +131,8 @@ class ComponentStoreFinisher(ComponentStore):
                                 if self.world.living(attacker):
                                     invs = self.world.inventories.get(attacker)
                                     invs.add(data.loot[deadId], 1, self.world)
-                                    print("[{:.2f}] Agent obtained loot {}x {}".format(self.world.clock, 1,
-                                                                                       data.loot[deadId]))
+                                    self.world.log.info("[{:.2f}] Agent obtained loot {}x {}", self.world.clock, 1,
+                                                        data.loot[deadId])
 
                             self.world.entities.remove(act.target_eid)
                             act.status = SUCCESS
@@ -117,9 +117,8 @@ class ComponentStoreGather(ComponentStore):
                                 self.world.tag.get(act.target_eid).remove(eid)
 
                             # info is printed to the console.
-                            if ACTION_LOG and not self.world.simulation: print(
-                                "[{:.2f}] {} takes {:.2f} damage from failing gather on ({})".format(self.world.clock,
-                                                                                                     agent, dmg, tid))
+                            if ACTION_LOG: self.world.log.info("[{:.2f}] {} takes {:.2f} damage from failing gather on ({})", self.world.clock,
+                                                               agent, dmg, tid)
                             act.status = SUCCESS
                     continue
 
@@ -129,18 +128,17 @@ class ComponentStoreGather(ComponentStore):
         for iid, min, max, prob in g:
             if DET:
                 inv.add(iid, (min+max)/2, self.world)
-                if ACTION_LOG and not self.world.simulation: print(
-                    "[{:.2f}] Agent obtained {}x {}".format(self.world.clock,
-                                                            (min+max)/2, iid))
+                if ACTION_LOG: self.world.log.info("[{:.2f}] Agent obtained {}x {}", self.world.clock,
+                                                   (min+max)/2, iid)
             else:
                 roll = random.random()
                 if roll < prob:
                     ct = random.randint(min, max) # inclusive
                     inv.add(iid, ct, self.world)
-                    if ACTION_LOG and not self.world.simulation: print("[{:.2f}] Agent obtained {}x {}".format(self.world.clock,
-                                                                                                  ct, iid))
+                    if ACTION_LOG: self.world.log.info("[{:.2f}] Agent obtained {}x {}", self.world.clock,
+                                                       ct, iid)
                 else:
-                    if ACTION_LOG and not self.world.simulation: print("[{:.2f}] Agent failed gather {}".format(self.world.clock, iid))
+                    if ACTION_LOG: self.world.log.info("[{:.2f}] Agent failed gather {}", self.world.clock, iid)
 
     def debuff(self, node, debuff):
         node.originals = node.duration
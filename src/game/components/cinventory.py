@@ -2,6 +2,7 @@
 #  Inventory Components
 ###########################
 import data
+import gamedata
 import random
 
 from components.cstore import ComponentStore
@@ -24,15 +25,7 @@ class CInventory:
                 yield iid,ct
 
     def max_dps_weapon(self, agent_eid, world):
-        maxdps = 0
-        maxwid = None
-        for wid,ct in self.all_weapons():
-            cd,dmg,range = data.weapons[wid]
-            dps = (dmg[0] + dmg[1])/2.0/cd
-            if dps > maxdps:
-                maxdps = dps
-                maxwid = wid
-        return maxwid
+        return gamedata.best_weapon(self.item_counts)
 
 
     def add(self, iid, ct, world):
@@ -108,6 +101,9 @@ class CInventory:
 
 # specialize for storing this type of component
 class ComponentStoreInv(ComponentStore):
+    # inventories outlive their owner (trace snapshots compare them before and after a death)
+    sweep_with_entity = False
+
     def add(self, agent):
         return self.addc(agent, CInventory(agent))
 
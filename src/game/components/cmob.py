@@ -33,11 +33,11 @@ class CMob:
         if self.proposal is not None:
             # clear old behavior, if active
             if self.active_behavior is not None:
-                print('mob behavior active behavior status', self.active_behavior.status)
-                if DEBUG: print("[{:.2f}] Mob: replacing active {}".format(world.clock, self.active_behavior.short_status()))
+                world.log.debug("mob behavior active behavior status {}", self.active_behavior.status)
+                if DEBUG: world.log.debug("[{:.2f}] Mob: replacing active {}", world.clock, self.active_behavior.short_status())
                 world.behaviors.remove(self.eid, self.active_behavior.status, world)
             # apply new
-            if DEBUG and not world.simulation: print("[{:.2f}] Mob: starting {}".format(world.clock, self.proposal))
+            if DEBUG: world.log.debug("[{:.2f}] Mob: starting {}", world.clock, self.proposal)
             self.active_behavior = self.proposal
             self.active_behavior.status = RUNNING
             self.proposal = None
@@ -46,8 +46,8 @@ class CMob:
 
         # got here, no proposal, check for reaping
         if self.active_behavior is not None and self.active_behavior.status != RUNNING:
-            print('mob behavior active behavior status', self.active_behavior.status)
-            if DEBUG: print("[{:.2f}] Mob: reaping active {}".format(world.clock, self.active_behavior.short_status()))
+            world.log.debug("mob behavior active behavior status {}", self.active_behavior.status)
+            if DEBUG: world.log.debug("[{:.2f}] Mob: reaping active {}", world.clock, self.active_behavior.short_status())
             #if trace: trace.end_update(world, self.eid, self.active_behavior.sig(), self.active_behavior.status)
             world.behaviors.remove(self.eid, self.active_behavior.status, world)
             self.active_behavior = None
@@ -109,7 +109,8 @@ class CMob_BehaviorEval(CMob):
         else:
             min_dist = 0
             for eid, ent in world.agents_within_range(self.eid, aware):
-                dist = (agent.pos - ent.pos).magnitude()
+                # squared, only compared
+                dist = agent.pos.distance_sq(ent.pos)
                 if min_dist == 0 or dist < min_dist:
                     min_dist = dist
                     self.attack_target = eid
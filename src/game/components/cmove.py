@@ -42,5 +42,6 @@ class ComponentStoreMove(ComponentStore):
                 continue
 
             # normal move step
-            e.pos = e.pos + path.normalized(m) * step
+            # path is our own temporary, so it becomes the new position
+            e.pos = path.normalize_inplace(m).imul(step).iadd(e.pos)
             mov.status = RUNNING
@@ -0,0 +1,136 @@
+##########################
+#  Batched Movement System
+#
+#  Same CMove components and SUCCESS/RUNNING semantics as ComponentStoreMove, but every
+#  mover is advanced in one NumPy pass. Used by World(columnar=True).
+##########################
+import numpy as np
+
+from constants import *
+from vector2 import vector2
+from components.cmove import ComponentStoreMove
+
+# below this many movers the per-object loop is cheaper than building arrays
+BATCH_MIN = 16
+
+class ComponentStoreMoveBatch(ComponentStoreMove):
+
+    ##########################
+    #  System Update
+    ##########################
+    def update(self, dt):
+        if len(self.cc) < BATCH_MIN:
+            return super().update(dt)
+        self.update_batch(dt)
+
+    def update_batch(self, dt):
+        if len(self.cc) == 0:
+            return
+        movers = list(self.all())
+        eids = [eid for eid, mov in movers]
+        movs = [mov for eid, mov in movers]
+        entities = self.world.entities
+        columns = getattr(entities, 'columns', None)
+
+        dest = np.array([(mov.dest.x, mov.dest.y) for mov in movs], dtype=np.float64)
+        speed = np.array([mov.speed for mov in movs], dtype=np.float64)
+        dist = np.array([mov.dist for mov in movs], dtype=np.float64)
+        if columns is not None:
+            rows = columns.rows_for(eids)
+            pos = columns.pos[rows]
+        else:
+            ents = [entities.get(eid) for eid in eids]
+            pos = np.array([(e.pos.x, e.pos.y) for e in ents], dtype=np.float64)
+
+        # same operations, in the same order, as the per-mover loop
+        path = dest - pos
+        m = np.sqrt(path[:, 0] * path[:, 0] + path[:, 1] * path[:, 1])
+        step = speed * dt
+
+        close = m < dist
+        arrive = ~close & (step >= m)
+        running = ~(close | arrive)
+
+        new_pos = pos.copy()
+        new_pos[arrive] = dest[arrive]
+        new_pos[running] = pos[running] + (path[running] / m[running, None]) * step[running, None]
+
+        for mov, r in zip(movs, running.tolist()):
+            mov.status = RUNNING if r else SUCCESS
+
+        if columns is not None:
+            # write rows directly, and only touch the index for movers that changed cell
+            index = entities.index
+            old_keys = np.floor_divide(pos, index.step).astype(np.int64)
+            new_keys = np.floor_divide(new_pos, index.step).astype(np.int64)
+            columns.pos[rows] = new_pos
+            for i in np.flatnonzero((old_keys != new_keys).any(axis=1)).tolist():
+                index.rekey(entities.get(eids[i]), tuple(old_keys[i].tolist()), tuple(new_keys[i].tolist()))
+        else:
+            for e, mov, a, r, xy in zip(ents, movs, arrive.tolist(), running.tolist(), new_pos.tolist()):
+                if a:
+                    e.pos = mov.dest
+                elif r:
+                    e.pos = vector2(xy)
+
+
+##########################
+#  Equivalence check against the per-mover loop
+#  (run from src/game: python -m components.cmove_batch)
+##########################
+
+if __name__ == '__main__':
+    import copy, random, time
+    from world import World
+
+    def build(columnar, n, seed):
+        random.seed(seed)
+        world = World((2048, 2048), columnar=columnar)
+        for i in range(n):
+            eid, ent = world.add_entity({'tid': random.choice((2, 3, 4, 5))})
+            speed = random.choice((80.0, 120.0, 300.0))
+            dist = random.choice((0, 0, 10, 25))
+            world.moving.add(eid, world.randloc(), speed, dist)
+        return world
+
+    def retarget(world, seed):
+        # new destinations for the finished movers, the way behaviors do it
+        random.seed(seed)
+        for eid, mov in world.moving.all():
+            if mov.status == SUCCESS:
+                mov.dest = world.randloc()
+        # and some chasing another mover's current position
+        movers = list(world.moving.all())
+        for (eid, mov), (other, _) in zip(movers[::7], movers[1::7]):
+            mov.dest = world.entities.get(other).pos
+
+    def state(world):
+        return [(eid, world.entities.get(eid).pos.xy(), world.moving.get(eid).status) for eid, _ in world.entities.all()]
+
+    for columnar in (False, True):
+        for n in (20, 200):
+            loop = build(columnar, n, n)
+            batch = copy.deepcopy(loop)
+            for t in range(400):
+                ComponentStoreMove.update(loop.moving, 0.02)
+                ComponentStoreMoveBatch.update_batch(batch.moving, 0.02)
+                assert state(loop) == state(batch), "diverged at tick {} (columnar={}, n={})".format(t, columnar, n)
+                retarget(loop, t)
+                retarget(batch, t)
+            cells = sorted((k, sorted(b)) for k, b in batch.entities.index.buckets.items())
+            assert cells == sorted((k, sorted(b)) for k, b in loop.entities.index.buckets.items())
+            print("equivalent: columnar={} movers={}".format(columnar, n))
+
+    for n in (50, 500, 5000):
+        for columnar in (False, True):
+            world = build(columnar, n, n)
+            start = time.time()
+            for t in range(50):
+                ComponentStoreMove.update(world.moving, 0.02)
+            loop_t = time.time() - start
+            world = build(columnar, n, n)
+            start = time.time()
+            for t in range(50):
+                ComponentStoreMoveBatch.update_batch(world.moving, 0.02)
+            batch_t = time.time() - start
+            print("movers {:>5} columnar={!s:<5} loop {:.4f}s batch {:.4f}s".format(n, columnar, loop_t, batch_t))
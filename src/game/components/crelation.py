@@ -61,14 +61,14 @@ class ComponentStoreRelation(ComponentStore):
             if type(agent.active_behavior) is CBehaviorMoveAndGather:
                 tag = self.world.tag.get(agent.active_behavior.target_eid)
                 if tag is not None:
-                    if tag.tag is not agent_eid and tag.firmness is 'Hard' and tag.tag is not None and not c.current:
-                        if DEBUG: print("lost race")
+                    if tag.tag != agent_eid and tag.firmness == 'Hard' and tag.tag is not None and not c.current:
+                        if DEBUG: self.world.log.debug("lost race")
                         c.decrease(tag.tag)
                     if self.world.entities.get(agent.active_behavior.target_eid).tid == 1005:
                         if tag.contains(agent_eid) and not c.current:
                             for x in tag.tag:
                                 if x is not agent_eid:
-                                    if DEBUG: print("peaceful waters")
+                                    if DEBUG: self.world.log.debug("peaceful waters")
                                     c.increase(x)
                                     if self.world.relationship.get(x) is not None:
                                         self.world.relationship.get(x).increase(agent_eid)
@@ -81,13 +81,13 @@ class ComponentStoreRelation(ComponentStore):
                     if len(tag.tag) > 1:
                         for eid in tag.tag:
                             if eid is not agent_eid and self.world.living(eid) and not c.current:
-                                if DEBUG: print("co-op")
+                                if DEBUG: self.world.log.debug("co-op")
                                 c.increase(eid)
                             c.begin_action()
 
                 target = self.world.entities.get(agent.active_behavior.target_eid)
                 if target is not None and target.tid is 1 and not c.current:
-                    if DEBUG: print("under attack")
+                    if DEBUG: self.world.log.debug("under attack")
                     c.decrease(target.eid)
                     c.begin_action()
 
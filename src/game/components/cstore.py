@@ -1,6 +1,15 @@
 ##### general component storage
 
+import copy
+
 class ComponentStore:
+    # eids whose component object is shared with a forked world (copy before handing out)
+    frozen = frozenset()
+    # attribute name on the world, set by World; keys the world's component registry
+    name = None
+    # components are swept along with their entity (see World.update)
+    sweep_with_entity = True
+
     def __init__(self, world, trace=None):
         self.world = world
         self.reset()
@@ -9,11 +18,65 @@ class ComponentStore:
     def reset(self):
         self.cc = {}
         self.remove_ids = set()
+        self.frozen = set()
+
+    def __getstate__(self):
+        # deep copies and pickles own all of their components
+        state = self.__dict__.copy()
+        state['frozen'] = set()
+        return state
+
+    ########### copy-on-write forking ##############
+
+    def fork(self, world, trace):
+        """Child store for a forked world. Both sides share every current component until first access."""
+        child = copy.copy(self)
+        child.world = world
+        child.trace = trace if self.trace is not None else None
+        child.cc = dict(self.cc)
+        child.remove_ids = set(self.remove_ids)
+        child.frozen = set(self.cc)
+        self.frozen = set(self.cc)
+        return child
+
+    def cow_objects(self):
+        """Store-level objects that components may reference, by role (remapped when thawing)."""
+        return {}
+
+    def thaw(self, eid):
+        """Replace a shared component with this world's own copy."""
+        c = copy.deepcopy(self.cc[eid], self.world.cow_memo)
+        self.cc[eid] = c
+        self.frozen.discard(eid)
+        return c
+
+    def thaw_all(self):
+        for eid in list(self.frozen):
+            if eid in self.cc:
+                self.thaw(eid)
+        self.frozen.clear()
+
+    ########### world component registry ##############
+
+    def register(self, eid):
+        if self.name is not None:
+            registry = self.world.registry
+            registry[eid] = registry.get(eid, frozenset()) | {self.name}
+
+    def unregister(self, eid):
+        if self.name is not None:
+            registry = self.world.registry
+            names = registry[eid] - {self.name}
+            if names:
+                registry[eid] = names
+            else:
+                del registry[eid]
 
     def addc(self, eid, c, d=False):
-        if eid in self.cc.keys():
+        if eid in self.cc:
             raise KeyError("Duplicate component add", eid)
         self.cc[eid] = c
+        self.register(eid)
         if d:
             testEntity = self.world.entities.get(eid).tid
             if testEntity != 1:
@@ -34,35 +97,45 @@ class ComponentStore:
             else:
                 agent = self.world.agents.get(eid)
             self.trace.end_update(self.world, eid, agent.active_behavior.sig(), status)
-        del self.cc[eid]
+        self.drop(eid)
         #self.remove_ids.add(eid)
 
+    def drop(self, eid):
+        """Delete eid's component, no cleanup."""
+        del self.cc[eid]
+        if self.frozen: self.frozen.discard(eid)
+        self.unregister(eid)
+
     def sweep(self, deleted):
         # remove marked components
         for eid in self.remove_ids:
-            del self.cc[eid]
+            self.drop(eid)
         self.remove_ids.clear()
         # remove components for deleted entities
         for eid in deleted:
             if eid in self.cc:
-                del self.cc[eid]
+                self.drop(eid)
 
     def get(self, eid):
-        if eid in self.cc.keys():
-            return self.cc[eid]
-        return None
+        c = self.cc.get(eid)
+        if c is not None and self.frozen and eid in self.frozen:
+            return self.thaw(eid)
+        return c
 
     def get_required(self, eid):
         """
         Errors if not there
         """
+        if self.frozen and eid in self.frozen:
+            return self.thaw(eid)
         return self.cc[eid]
 
     def all(self):
+        if self.frozen: self.thaw_all()
         return self.cc.items()
 
     def count(self):
-        return len(self.cc.keys())
+        return len(self.cc)
 
     def __str__(self):
         s = ""
@@ -18,7 +18,7 @@ class CTag:
         self.firmness = None
 
     def hard(self):
-        if self.firmness is not 'Hard':
+        if self.firmness != 'Hard':
             self.firmness = 'Hard'
             if DEBUG : print("Hardened {}".format(self.tag))
 
@@ -32,6 +32,6 @@ class ComponentStoreDrink(ComponentStore):
                 a.cd_drink -= dt
 
             if a.thirst <= 0:
-                print("[{:.2f}] {} died of dehydration!".format(self.world.clock, self.world.entities.get(eid)))
+                self.world.log.info("[{:.2f}] {} died of dehydration!", self.world.clock, self.world.entities.get(eid))
                 self.world.entities.remove(eid)
                 self.trace.dehydration(eid, self.world)
\ No newline at end of file
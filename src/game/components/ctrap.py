@@ -27,7 +27,7 @@ class CTrap:
             self.status = FAILURE
 
     def activate(self, target_eid):
-        if DEBUG: print("trap activated")
+        if DEBUG: self.world.log.debug("trap activated")
         self.world.entities.remove(self.eid)
         self.world.entities.get(target_eid).flag = self.effect
 
@@ -42,7 +42,7 @@ class ComponentStoreTrap(ComponentStore):
             elif act.status is not SUCCESS:
                 act.progress += dt
                 if act.progress >= act.setup:
-                    if DEBUG: print("trap set")
+                    if DEBUG: self.world.log.debug("trap set")
                     act.status = SUCCESS
             else:
                 for close_eid, ent in self.world.entities_within_range(act.eid, 5):
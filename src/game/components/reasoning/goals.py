@@ -5,10 +5,44 @@ import data
 #################################################
 
 class Goal:
+    # bumped whenever the goal tree below changes (see Goal_HasItemType.update)
+    version = 0
+
     def expand(self):
         pass
 
+class GoalTreeView:
+    """
+    Queries on a goal tree as of one version: leaves, all nodes, and tid indexes for the
+    item-seeking evaluations. Lists are in the order tree_leaves()/all_nodes() visit them.
+    """
+    def __init__(self, goal):
+        self.version = goal.version
+        self.leaves = goal.tree_leaves()
+        self.nodes = list(goal.all_nodes(goal.strategy))
+        # tid : node, any node of the tree
+        self.tids = {}
+        for b, prev in self.nodes:
+            self.tids.setdefault(b.tid, b)
+        # tid : last leaf still to be collected itself (its needed list is done)
+        self.done = {}
+        # tid : (rank, node), last of the nodes a gather works towards: done leaves and the
+        # needed items of the others
+        self.wanted = {}
+        rank = 0
+        for leaf in self.leaves:
+            if len(leaf.needed) == 0:
+                self.done[leaf.tid] = leaf
+                self.wanted[leaf.tid] = (rank, leaf)
+                rank += 1
+            else:
+                for need in leaf.needed:
+                    self.wanted[need.tid] = (rank, need)
+                    rank += 1
+
 class Goal_HasItemType(Goal):
+    cached_view = None
+
     def __init__(self, tid, ct,value):
         self.tid = tid
         self.ct = ct
@@ -18,6 +52,12 @@ class Goal_HasItemType(Goal):
         if(tid in data.recipes or tid == 2013):
             self.expand()
 
+    def __getstate__(self):
+        # rebuilt on demand
+        state = self.__dict__.copy()
+        state.pop('cached_view', None)
+        return state
+
 
     def expand(self):
         if (self.tid == 2013):
@@ -61,26 +101,39 @@ class Goal_HasItemType(Goal):
                 yield b,prevs
             yield a,prev
 
+    def view(self):
+        """GoalTreeView of the tree below, rebuilt only after update() has changed it."""
+        v = self.cached_view
+        if v is None or v.version != self.version:
+            v = self.cached_view = GoalTreeView(self)
+        return v
+
     def update(self,eid,world):
         inv=world.inventories.get(eid)
 
         #INSERT NEW THING
-        for b,prev in self.all_nodes(self.strategy):
-            if(b.ct<=inv.item_amount(b.tid)):
-                del prev[:]
+        # (walk the live tree only when something is there to cut)
+        if any((b.ct<=inv.item_amount(b.tid) for b,prev in self.view().nodes)):
+            for b,prev in self.all_nodes(self.strategy):
+                if(b.ct<=inv.item_amount(b.tid)):
+                    if prev:
+                        self.version += 1
+                    del prev[:]
 
 
-        for a in self.tree_leaves(): #INSERT LEAVE TRAVERSAL
+        for a in self.view().leaves: #INSERT LEAVE TRAVERSAL
             if len(a.needed)==0:
                 for need in self.needed:
                     if need.ct <=inv.item_amount(need.tid):
-                        print("Removing something from NEEDED {}".format(need.tid))
+                        world.log.debug("Removing something from NEEDED {}", need.tid)
                         self.needed.remove(need)
+                        self.version += 1
             else:
                 for need in a.needed:
                     if need.ct <=inv.item_amount(need.tid):
-                        print("Removing something from NEEDED {}".format(need.tid))
+                        world.log.debug("Removing something from NEEDED {}", need.tid)
                         a.needed.remove(need)
+                        self.version += 1
 
 
     def satisfied(self, world, agent_id):
@@ -193,3 +246,36 @@ class PlanGraph:
     def update(self, world_view):
         pass
 
+
+
+#################################################
+# Tree walk vs. cached view, per query
+#  (run from src/game: python -m components.reasoning.goals)
+#################################################
+
+if __name__ == '__main__':
+    import timeit
+
+    goal = Goal_HasItemType(2013, 1, 1.0)
+    drops = [d for tid, (t, ds) in data.gatherable.items() for d in ds]
+    def walk():
+        reward = 0
+        for b in goal.tree_leaves():
+            for gnode in (b.needed or [b]):
+                for dtid, dmin, dmax, drate in drops:
+                    if gnode.tid == dtid:
+                        reward = gnode.value
+        return reward, len(list(goal.all_nodes(goal.strategy)))
+    def lookup():
+        view = goal.view()
+        reward = 0
+        for dtid, dmin, dmax, drate in drops:
+            w = view.wanted.get(dtid)
+            if w is not None:
+                reward = w[1].value
+        return reward, len(view.nodes)
+
+    N = 20000
+    t_walk = min(timeit.repeat(walk, number=N, repeat=3)) / N * 1e6
+    t_view = min(timeit.repeat(lookup, number=N, repeat=3)) / N * 1e6
+    print("{} drop entries: tree walk {:.2f} us, view {:.2f} us ({:.1f}x)".format(len(drops), t_walk, t_view, t_walk / t_view))
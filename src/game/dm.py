@@ -11,9 +11,12 @@ Policies must be used in rollouts to create new nodes (because of the real-time
 silly. Existing nodes can be selected with UCB. Estimated simulation could be a heuristic speed up.
 """
 
-import time, copy, math
+import time, copy, math, io, pickle, random, sys
+import multiprocessing
+import data
 from components.cbehavior import CBehaviorNoOp
 from components.cagent import Cursor2
+from trace import Trace
 
 # module level
 DEBUG=True
@@ -64,11 +67,66 @@ class DramaManager:
 
 ########################### MCTS Drama Manager #############################
 
+# transposition keys compare hp in this many buckets of max hp
+HP_BUCKETS = 4
+# and positions in cells of this many world grid steps
+POS_CELL = 8
+
+def behavior_key(behavior):
+    """Signature of a behavior for transposition keys (its type for those without one, e.g. no-op)."""
+    if behavior is None:
+        return None
+    sig = getattr(behavior, 'sig', None)
+    return sig() if sig is not None else type(behavior).__name__
+
+def state_key(world, agent_id):
+    """
+    Compact key for equivalent search states, from agent_id's point of view: for every agent and
+    mob, its cell (POS_CELL grid steps), active behavior sig, hp bucket and inventory. Behavior
+    progress and the clock are left out, so the same situation reached through a different
+    ordering of behaviors matches.
+    """
+    # read-only, through cc so forked worlds don't take copies
+    entities, inventories, behaviors = world.entities.cc, world.inventories.cc, world.behaviors.cc
+    cell = world.grid_step * POS_CELL
+    key = [agent_id]
+    for store in (world.agents, world.mob):
+        for eid in sorted(store.cc):
+            ent = entities.get(eid)
+            if ent is None: continue
+            inv = inventories.get(eid)
+            hp = None
+            if ent.hp is not None and ent.tid in data.combatants:
+                hp = min(int(ent.hp / data.combatants[ent.tid][0] * HP_BUCKETS), HP_BUCKETS)
+            pos = ent.pos
+            key.append((eid, int(pos.x // cell), int(pos.y // cell), behavior_key(behaviors.get(eid)), hp,
+                        inv and tuple(sorted(inv.item_counts.items()))))
+    return tuple(key)
+
+class MCTranspositions:
+    """(state key, behavior sig) : MCNodeStats shared by every node for that behavior in an equivalent state."""
+    def __init__(self):
+        self.table = {}
+        self.lookups = 0
+        self.hits = 0
+
+    def share(self, group, node):
+        key = (group.state_key, behavior_key(node.behavior))
+        self.lookups += 1
+        stats = self.table.get(key)
+        if stats is None:
+            self.table[key] = node.stats
+        else:
+            node.stats = stats
+            self.hits += 1
+
 class MCStats:
     def __init__(self):
         self.tree_depth = 0
         self.rollout_ct = 0
         self.update_ct = 0
+        self.transpositions = 0
+        self.transposition_lookups = 0
         self.start_time = None
         self.total_effort = 0
         self.applied_behaviors = []
@@ -79,9 +137,9 @@ class MCStats:
         else: return self.total_effort/(self.application_time - self.start_time)
 
     def __str__(self):
-        return "MCTS ({:.2f} - {:.2f}), depth: {}, updates: {}, rollouts: {}, effort/s: {:.4f}, effort/consider: {:.4f}\nBeh: {}".format(
+        return "MCTS ({:.2f} - {:.2f}), depth: {}, updates: {}, rollouts: {}, transpositions: {}/{}, effort/s: {:.4f}, effort/consider: {:.4f}\nBeh: {}".format(
             self.start_time, self.application_time,
-            self.tree_depth, self.update_ct, self.rollout_ct,
+            self.tree_depth, self.update_ct, self.rollout_ct, self.transpositions, self.transposition_lookups,
             self.effort_per_sec(), self.total_effort/self.update_ct,
             ", ".join((str(b) for b in self.applied_behaviors)))
 
@@ -89,17 +147,23 @@ class MCNodeGroup:
     """
     A set of nodes in the search tree with a common timestamp and agent.
     """
-    def __init__(self, agent_id, timestamp, first_behavior, cursor, world):
+    def __init__(self, agent_id, timestamp, first_behavior, cursor, world, transpositions=None, saved_world=None):
         # common to the group
         self.agent_id = agent_id
         self.timestamp = timestamp
-        self.saved_world = copy.deepcopy(world)
+        # (groups that are never rolled out from can share one saved world)
+        self.saved_world = saved_world if saved_world is not None else world.fork()
         self.reward = 0
         self.cost = 0
 
+        # members share stats with equivalent nodes elsewhere in the tree
+        self.transpositions = transpositions
+        if transpositions is not None:
+            self.state_key = state_key(world, agent_id)
+
         # structure
-        self.members = [first_behavior]
-        first_behavior.group = self
+        self.members = []
+        self.add_node(first_behavior)
 
         # enable incremental expansion
         self.cursor = cursor
@@ -113,6 +177,8 @@ class MCNodeGroup:
     def add_node(self, node):
         self.members.append(node)
         node.group = self
+        if self.transpositions is not None:
+            self.transpositions.share(self, node)
 
     def most_rewarding(self):
         """Return member with highest normalized reward."""
@@ -150,6 +216,12 @@ class MCNodeGroup:
     def __str__(self):
         return "MCNodeGroup({},{}: {})".format(self.agent_id, self.timestamp, ",".join((str(n) for n in self.members)))
 
+class MCNodeStats:
+    """Visit count and per-agent rewards of a node (shared by transposed nodes)."""
+    def __init__(self):
+        self.visits = 0
+        self.rewards = {}
+
 class MCNode:
     """
     A node in the search tree. Specifies a particular agent-behavior-time tuple (incl. no-op).
@@ -172,13 +244,24 @@ class MCNode:
         self.group = None
         self.next_group = None
 
-        # accounting
-        self.visits = 0
-        self.rewards = {}
+        # accounting (visits, rewards)
+        self.stats = MCNodeStats()
         self.applied = False
 
         #print("added node {}".format(self.behavior))
 
+    @property
+    def visits(self): return self.stats.visits
+
+    @visits.setter
+    def visits(self, visits): self.stats.visits = visits
+
+    @property
+    def rewards(self): return self.stats.rewards
+
+    @rewards.setter
+    def rewards(self, rewards): self.stats.rewards = rewards
+
     def depth(self):
         if self.next_group is None: return 1
         return self.next_group.depth() + 1
@@ -212,19 +295,23 @@ class MCNode:
         #print("updated node {} to {} (visit {})".format(self.behavior, self.normalized_rewards(), self.visits))
 
     def update_rewards_recursive(self, dm, end_world):
-        """Update rewards up the tree through all parents."""
-        self.update_rewards(dm, end_world)
-        if self.group is not None:
-            self.group.previous_node.update_rewards_recursive(dm, end_world)
+        """Update rewards up the tree through all parents, once per stats (transposed nodes share them)."""
+        updated = set()
+        node = self
+        while node is not None:
+            if id(node.stats) not in updated:
+                updated.add(id(node.stats))
+                node.update_rewards(dm, end_world)
+            node = node.group.previous_node if node.group is not None else None
 
     def set_next_group(self, group):
         self.next_group = group
         if group is not None:
             group.previous_node = self
 
-    def insert_group(self, agent_id, timestamp, behavior, cursor, world):
+    def insert_group(self, agent_id, timestamp, behavior, cursor, world, transpositions=None):
         """Insert the specified group (with one member) between this node and the next group.
-        The one member has the same stats as this node.
+        The one member has the same stats as this node (or those of an equivalent node, if transposed).
         """
         # create member node and duplicate stats
         node = MCNode(behavior)
@@ -232,18 +319,18 @@ class MCNode:
         node.rewards = copy.deepcopy(self.rewards)
 
         # insert into hierarchy
-        group = MCNodeGroup(agent_id, timestamp, node, cursor, world)
+        group = MCNodeGroup(agent_id, timestamp, node, cursor, world, transpositions)
         node.set_next_group(self.next_group)
         self.set_next_group(group)
 
         # return group for syntactic nicety
         return group
 
-    def append_group(self, agent_id, timestamp, behavior, cursor, world):
+    def append_group(self, agent_id, timestamp, behavior, cursor, world, transpositions=None):
         """Append the specified group (with one member) after this node."""
 
         # create group w/ one member to append
-        group = MCNodeGroup(agent_id, timestamp, MCNode(behavior), cursor, world)
+        group = MCNodeGroup(agent_id, timestamp, MCNode(behavior), cursor, world, transpositions)
         self.set_next_group(group)
 
         # return group for syntactic nicety
@@ -263,18 +350,62 @@ class MCNode:
         return "(MCNode({}),{}/{}: {})".format(self.behavior, self.rewards, self.visits, self.next_group)
 
 class DramaManager_MCTS(DramaManager):
-    def __init__(self, world, kb, fixed_timestep):
+    def __init__(self, world, kb, fixed_timestep, transpositions=True, workers=0, seed=None):
         """
         :param world: the world in the starting state
         :param kb: accumulated policy knowledge
         :param fixed_timestep: the time step for the rollouts to simulate (seconds)
+        :param transpositions: share stats between nodes reached in equivalent states
+        :param workers: root-parallel search in this many worker processes (0 searches in-process);
+                        every update_consider then pickles the whole world once, see search_parallel
+        :param seed: base seed for the workers' rollouts (worker i uses seed + i)
         """
         super().__init__(world)
         self.kb = kb
         self.fixed_timestep = fixed_timestep
+        self.use_transpositions = transpositions
 
         self.active_tree = None
         self.active_stats = None
+        self.transpositions = None
+        # root-parallel: (merged root summary, root visits) of the current search, see search_parallel
+        self.merged = None
+
+        # (process, connection) per search worker
+        self.workers = []
+        if workers > 0:
+            if seed is None:
+                seed = random.randrange(sys.maxsize)
+            for i in range(workers):
+                conn, child_conn = multiprocessing.Pipe()
+                p = multiprocessing.Process(target=mcts_worker, args=(child_conn, kb, fixed_timestep, transpositions, seed + i),
+                                            daemon=True)
+                p.start()
+                child_conn.close()
+                self.workers.append((p, conn))
+
+    def close(self):
+        """Shut down the search workers."""
+        for p, conn in self.workers:
+            conn.send(None)
+        for p, conn in self.workers:
+            p.join()
+            conn.close()
+        self.workers = []
+
+    def start_tree(self):
+        self.active_tree = MCNode(None)
+        self.active_stats = MCStats()
+        self.transpositions = MCTranspositions() if self.use_transpositions else None
+        self.active_stats.start_time = self.world.clock
+        self.merged = None
+
+    def next_timestamp(self):
+        """Time of the search's first group, None while it has none."""
+        if self.workers:
+            return self.merged[0][1] if self.merged is not None and self.merged[0] is not None else None
+        group = self.active_tree.next_group
+        return group.timestamp if group is not None else None
 
     def update_consider(self, dt, effort, depth_limit):
         """
@@ -286,34 +417,43 @@ class DramaManager_MCTS(DramaManager):
         #print("Update {}: effort {}".format(self.world.clock, effort))
 
         # restart the search, as necessary
-        if self.active_tree is None:
+        restart = self.active_tree is None
+        if restart:
             if DEBUG: print("================= Starting MCTS at time {} ====================".format(self.world.clock))
-            self.active_tree = MCNode(None)
-            self.active_stats = MCStats()
-            self.active_stats.start_time = self.world.clock
+            self.start_tree()
 
         # only rollout if there is effort and the simulation has gone past the tree
-        if self.active_tree.next_group is None or self.world.clock <= self.active_tree.next_group.timestamp:
+        timestamp = self.next_timestamp()
+        if timestamp is None or self.world.clock <= timestamp:
             # if there is effort, spend it
             if effort > 0:
                 self.active_stats.update_ct += 1
 
             initial_effort = effort
-            while effort > 0:
-                effort = self.update_mcts(effort, depth_limit)
-                #print(str(self.active_tree.next_group))
+            if self.workers:
+                effort = self.search_parallel(effort, depth_limit, restart)
+            else:
+                effort = self.search(effort, depth_limit)
             self.active_stats.total_effort += (initial_effort - effort)
 
         #print("...effort left: {}".format(effort))
         #print("...total effort: {}".format(self.active_stats.total_effort))
 
+        # root-parallel searches only build their merged tree once its first choices are due
+        if self.workers and self.active_tree.next_group is None:
+            timestamp = self.next_timestamp()
+            if timestamp is not None and timestamp <= self.world.clock:
+                self.build_tree()
+
         # if the time is right for first-level choices, assign those agent behaviors
         group = self.active_tree.next_group
         assigned=False
         while group is not None and group.timestamp <= self.world.clock:
             node = group.most_rewarding()
-            node.behavior.reset()
-            self.world.agents.get(group.agent_id).proposal = node.behavior
+            # no-op means carry on with the current behavior, as in rollouts
+            if not isinstance(node.behavior, CBehaviorNoOp):
+                node.behavior.reset()
+                self.world.agents.get(group.agent_id).proposal = node.behavior
             self.active_stats.applied_behaviors.append(node.behavior)
             if DEBUG: print("============== MCTS applying {} from group {} ===================".format(node.behavior, group))
 
@@ -331,16 +471,73 @@ class DramaManager_MCTS(DramaManager):
             self.active_stats.tree_depth = tree.depth()
             self.active_stats.application_time = self.world.clock
             self.active_stats.rollout_ct = tree.visits
+            if self.transpositions is not None:
+                self.active_stats.transpositions = self.transpositions.hits
+                self.active_stats.transposition_lookups = self.transpositions.lookups
             print("==== MCTS Stats: {}".format(self.active_stats))
             return tree,self.active_stats,effort
 
         return None,None,effort
 
+    def search(self, effort, depth_limit):
+        """Grow self.active_tree until effort is spent, returns the remaining (<= 0) effort."""
+        while effort > 0:
+            effort = self.update_mcts(effort, depth_limit)
+            #print(str(self.active_tree.next_group))
+        return effort
+
+    def search_parallel(self, effort, depth_limit, restart):
+        """
+        Root-parallel search: every worker grows its own tree from the current world for the same effort,
+        then their root-level groups are merged into self.merged (replacing the previous merge).
+        The world is pickled and sent on every call, not only on restart: rollouts from the root start
+        at the current world, which moves on every frame. That pickle is a fixed cost per call on top of
+        effort, so keep effort well above the time dump_world takes.
+        """
+        start = time.time()
+        world = dump_world(self.world)
+        for p, conn in self.workers:
+            conn.send((world, effort, depth_limit, restart))
+        results = [conn.recv() for p, conn in self.workers]
+
+        self.merged = (merge_summaries([summary for summary, visits, hits, lookups in results]),
+                       sum((visits for summary, visits, hits, lookups in results)))
+        if self.transpositions is not None:
+            # worker counts are for their whole search so far
+            self.transpositions.hits = sum((hits for summary, visits, hits, lookups in results))
+            self.transpositions.lookups = sum((lookups for summary, visits, hits, lookups in results))
+        return effort - (time.time() - start)
+
+    def build_tree(self):
+        """Rebuild self.merged as self.active_tree (its groups share one saved world, nothing rolls out from them)."""
+        summary, visits = self.merged
+        self.active_tree.visits = visits
+        if summary is not None:
+            self.build_group(self.active_tree, summary, self.world.fork())
+
+    def build_group(self, parent, summary, saved_world):
+        """Rebuild a merged group summary (see group_summary) under parent."""
+        agent_id, timestamp, members = summary
+        nodes = []
+        for behavior, visits, rewards, child in members:
+            node = MCNode(behavior)
+            node.visits = visits
+            node.rewards = rewards
+            nodes.append(node)
+        group = MCNodeGroup(agent_id, timestamp, nodes[0], None, self.world, saved_world=saved_world)
+        for node in nodes[1:]:
+            group.add_node(node)
+        parent.set_next_group(group)
+        for node, (behavior, visits, rewards, child) in zip(nodes, members):
+            if child is not None:
+                self.build_group(node, child, saved_world)
+        return group
+
     def update_mcts(self, effort, depth_limit):
         """Perform a MCTS update of self.active_tree."""
         start = time.time()
         current = self.active_tree
-        rollout = copy.deepcopy(self.world)
+        rollout = self.world.fork()
         rollout.simulation = True
         depth = 0
 
@@ -397,7 +594,8 @@ class DramaManager_MCTS(DramaManager):
                                     rollout.clock, agent.proposal, current.next_group, "\n".join(n.short() for n in path)))
 
                                 # agent proposed an interruption, insert pre-emptive group w/ no-op behavior above current tree
-                                group = current.insert_group(aid, rollout.clock, CBehaviorNoOp(), Cursor2(options[1:]), rollout)
+                                group = current.insert_group(aid, rollout.clock, CBehaviorNoOp(), Cursor2(options[1:]), rollout,
+                                                             self.transpositions)
                                 # add proposed behavior as second member of the inserted group
                                 node = MCNode(agent.proposal)
                                 group.add_node(node)
@@ -410,7 +608,8 @@ class DramaManager_MCTS(DramaManager):
                             else:
                                 # there is no next group (this also works for adding more than one action in this frame)
                                 #print("{} Pre-Insert: {}".format(rollout.clock, self.active_tree))
-                                group = current.append_group(aid, rollout.clock, agent.proposal, Cursor2(options[1:]), rollout)
+                                group = current.append_group(aid, rollout.clock, agent.proposal, Cursor2(options[1:]), rollout,
+                                                             self.transpositions)
                                 if DEBUG_ROLLOUT: print("[{:.2f}] post-append: {}".format(rollout.clock, self.active_tree))
                                 current = group.members[0]
                                 depth += 1
@@ -434,3 +633,169 @@ class DramaManager_MCTS(DramaManager):
         # return remaining effort
         return effort - (time.time() - start)
 
+
+
+########################### Root-parallel search #############################
+
+# levels of each worker tree sent back for merging (the root group, plus simultaneous follow-ups)
+SUMMARY_DEPTH = 3
+
+class TracePickler(pickle.Pickler):
+    """
+    Pickles a world for a search worker. The trace is swapped for a stub holding only each agent's open
+    decisions (what rollouts end or replace), rather than the whole history and its snapshots.
+    """
+    def __init__(self, file, trace):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.trace = trace
+        self.stub = None
+        if trace is not None:
+            self.stub = Trace()
+            self.stub.decisions = open_decisions(trace)
+
+    def persistent_id(self, obj):
+        if obj is self.trace and obj is not None:
+            return self.stub
+        return None
+
+class TraceUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        return pid
+
+def open_decisions(trace):
+    """Decision nodes from each agent's latest behavior onward (Trace.end_update looks back past kills only)."""
+    start = {}
+    for i in range(len(trace.decisions) - 1, -1, -1):
+        dn = trace.decisions[i]
+        if dn.agent_eid is not None and dn.agent_eid not in start and not dn.is_behavior('killed'):
+            start[dn.agent_eid] = i
+    return [dn for i, dn in enumerate(trace.decisions) if i >= start.get(dn.agent_eid, len(trace.decisions))]
+
+def dump_world(world):
+    f = io.BytesIO()
+    TracePickler(f, world.trace).dump(world)
+    return f.getvalue()
+
+def load_world(data):
+    return TraceUnpickler(io.BytesIO(data)).load()
+
+def group_summary(group, depth=SUMMARY_DEPTH):
+    """(agent_id, timestamp, [(behavior, visits, rewards, child summary)...]) for group and depth levels below, or None."""
+    if group is None or depth == 0:
+        return None
+    return (group.agent_id, group.timestamp,
+            [(n.behavior, n.visits, dict(n.rewards), group_summary(n.next_group, depth - 1)) for n in group.members])
+
+def merge_summaries(summaries):
+    """
+    Merge group summaries from independent trees: visits add up, rewards are visit-weighted averages,
+    members match by behavior signature. Trees that put their group at a different time or agent are
+    outvoted by visits.
+    """
+    by_key = {}
+    for s in summaries:
+        if s is not None:
+            by_key.setdefault((s[0], s[1]), []).append(s[2])
+    if not by_key:
+        return None
+    (agent_id, timestamp), member_lists = max(by_key.items(),
+        key=lambda kv: sum((visits for members in kv[1] for b, visits, r, c in members)))
+
+    # signature : [behavior, visits, {agent : reward * visits}, [child summaries]]
+    merged = {}
+    for members in member_lists:
+        for behavior, visits, rewards, child in members:
+            m = merged.setdefault(str(behavior), [behavior, 0, {}, []])
+            m[1] += visits
+            for aid, r in rewards.items():
+                m[2][aid] = m[2].get(aid, 0) + r * visits
+            m[3].append(child)
+
+    return (agent_id, timestamp,
+            [(behavior, visits, {aid : total / visits for aid, total in rewards.items()} if visits else {},
+              merge_summaries(children))
+             for behavior, visits, rewards, children in merged.values()])
+
+def mcts_worker(conn, kb, fixed_timestep, transpositions, seed):
+    """
+    Search worker process: keeps its own tree across calls, growing it from the world it is sent.
+    Each request is (pickled world, effort, depth_limit, restart), answered with
+    (root summary, root visits, transposition hits, transposition lookups).
+    """
+    global DEBUG
+    DEBUG = False
+    random.seed(seed)
+    dm = None
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        data, effort, depth_limit, restart = msg
+        world = load_world(data)
+        if dm is None:
+            dm = DramaManager_MCTS(world, kb, fixed_timestep, transpositions)
+        dm.world = world
+        if restart or dm.active_tree is None:
+            dm.start_tree()
+        dm.search(effort, depth_limit)
+        t = dm.transpositions
+        conn.send((group_summary(dm.active_tree.next_group), dm.active_tree.visits,
+                   t.hits if t is not None else 0, t.lookups if t is not None else 0))
+    conn.close()
+
+
+########################### Transposition check #############################
+# Searches a seeded world, checking that a rollout updates each node's stats at most once,
+# and reports how often node groups found an equivalent node's stats. Then again with two
+# root-parallel workers, checking the merged tree the same way and that close() stops them
+# (run from src/game: python dm.py [spec] [ticks] [effort])
+
+if __name__ == '__main__':
+    import contextlib
+    import eventlog
+    from runner import RunnerPassThrough
+    from worldspec import Worldspec
+
+    spec = sys.argv[1] if len(sys.argv) > 1 else 'balance'
+    ticks = int(sys.argv[2]) if len(sys.argv) > 2 else 1500
+    effort = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+    DIM = (768, 768)
+    DEBUG = False
+    eventlog.LIVE = eventlog.NULL
+
+    def tree_nodes(node):
+        yield node
+        if node.next_group is not None:
+            for n in node.next_group.members:
+                yield from tree_nodes(n)
+
+    def run(workers):
+        """Search a fresh seeded world for ticks frames, returns (searches, hits, lookups)."""
+        random.seed(3)
+        worldspec = Worldspec(DIM, 3, ((2004, 1),), ((3000, 1),))
+        r = RunnerPassThrough(DIM, DIM, 0.02)
+        with contextlib.redirect_stdout(io.StringIO()):
+            focus = r.setup(worldspec.spec[spec])
+        dm = DramaManager_MCTS(r.world, None, 0.02, workers=workers, seed=3)
+        processes = [p for p, conn in dm.workers]
+        searches = hits = lookups = 0
+        for t in range(ticks):
+            with contextlib.redirect_stdout(io.StringIO()):
+                tree, stats, left = dm.update_consider(0.02, effort, 20)
+            if tree is not None:
+                # for root-parallel searches this is the merged tree
+                assert all(n.visits <= tree.visits for n in tree_nodes(tree))
+                searches += 1
+                hits += stats.transpositions
+                lookups += stats.transposition_lookups
+            r.world.update(0.02)
+            if r.world.entities.get(focus) is None:
+                break
+        dm.close()
+        assert dm.workers == [] and not any(p.is_alive() for p in processes)
+        return searches, hits, lookups
+
+    for workers in (0, 2):
+        searches, hits, lookups = run(workers)
+        print("{} workers, {} searches: {} of {} node lookups transposed ({:.1%})".format(
+            workers, searches, hits, lookups, hits / max(lookups, 1)))
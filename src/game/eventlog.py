@@ -0,0 +1,103 @@
+##########################
+#  Event log with levels and sinks
+#
+#  Components log through world.log: world.log.info("[{:.2f}] ...", world.clock, ...).
+#  The message is only formatted when the level is enabled, so a disabled log costs a
+#  method call. Simulation worlds (MCTS rollouts, search workers) use SIMULATION, which
+#  is NULL unless replaced; live worlds use LIVE. A world can be given its own log by
+#  setting world.logger.
+#
+#  The per-module DEBUG / ACTION_LOG switches still pick which messages exist at all.
+##########################
+
+import sys
+
+DEBUG, INFO, WARN = 10, 20, 30
+OFF = 100
+
+class StreamSink:
+    """Writes lines to a stream (sys.stdout as it is at write time, by default)."""
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, level, msg):
+        print(msg, file=self.stream or sys.stdout)
+
+class ListSink:
+    """Keeps (level, message) pairs, e.g. to inspect what a rollout would have said."""
+    def __init__(self):
+        self.records = []
+
+    def write(self, level, msg):
+        self.records.append((level, msg))
+
+class Log:
+    def __init__(self, sink=None, level=DEBUG):
+        self.sink = sink
+        # no sink is a null log
+        self.level = level if sink is not None else OFF
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, fmt, *args):
+        if level >= self.level:
+            self.sink.write(level, fmt.format(*args) if args else fmt)
+
+    def debug(self, fmt, *args):
+        if DEBUG >= self.level:
+            self.sink.write(DEBUG, fmt.format(*args) if args else fmt)
+
+    def info(self, fmt, *args):
+        if INFO >= self.level:
+            self.sink.write(INFO, fmt.format(*args) if args else fmt)
+
+    def warn(self, fmt, *args):
+        if WARN >= self.level:
+            self.sink.write(WARN, fmt.format(*args) if args else fmt)
+
+NULL = Log()
+LIVE = Log(StreamSink())
+SIMULATION = NULL
+
+
+##########################
+#  Rollouts/sec with the null simulation log vs. formatting everything
+#  (run from src/game: python eventlog.py [spec] [seconds])
+##########################
+
+if __name__ == '__main__':
+    import os, time
+    import eventlog
+    from runner import RunnerPassThrough
+    from worldspec import Worldspec
+
+    spec = sys.argv[1] if len(sys.argv) > 1 else 'balance'
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    DIM = (768, 768)
+    # policy-normal rollouts of this many ticks from the starting world, as in DramaManager_MCTS
+    ROLLOUT_TICKS = 200
+    DT = 0.02
+
+    def rollouts_per_sec(simulation_log):
+        # (this file runs as __main__, components see the imported module)
+        eventlog.SIMULATION = simulation_log
+        worldspec = Worldspec(DIM, 1, ((2004, 1),), ((3000, 1),))
+        r = RunnerPassThrough(DIM, DIM, DT)
+        r.setup(worldspec.spec[spec])
+        rollouts = 0
+        start = time.time()
+        while time.time() - start < seconds:
+            rollout = r.world.fork()
+            rollout.simulation = True
+            for t in range(ROLLOUT_TICKS):
+                rollout.consider(DT)
+                rollout.update(DT)
+            rollouts += 1
+        return rollouts / (time.time() - start)
+
+    devnull = open(os.devnull, 'w')
+    null = rollouts_per_sec(eventlog.NULL)
+    formatted = rollouts_per_sec(eventlog.Log(eventlog.StreamSink(devnull)))
+    print("{}-tick rollouts/s: null log {:.2f}, formatted to devnull {:.2f} ({:.2f}x)".format(
+        ROLLOUT_TICKS, null, formatted, null / formatted))
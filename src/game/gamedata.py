@@ -0,0 +1,113 @@
+##########################
+#  Lookup tables compiled from data.py
+#
+#  Derived facts the components used to recompute from the raw tables on every call,
+#  built once at import. Dense tables are lists indexed by tid (None/0 where the tid has
+#  no entry); sparse ones are dicts. data.py stays the one place to edit game content.
+##########################
+
+import data
+
+# one past the highest tid in any table
+TID_LIMIT = 1 + max(max(data.names), max(data.render), max(data.gatherable), max(data.weapons))
+
+def dense(table, default=None):
+    """List indexed by tid from a {tid : value} dict."""
+    out = [default] * TID_LIMIT
+    for tid, v in table.items():
+        out[tid] = v
+    return out
+
+########### rendering / melee ##############
+
+# render size per tid
+SIZE = dense({tid : r['size'] for tid, r in data.render.items()}, 0)
+
+def melee_dist(agent_tid, target_tid):
+    """Center distance at which two entities touch."""
+    return SIZE[agent_tid] + SIZE[target_tid]
+
+########### gathering ##############
+
+def compile_drops(table):
+    """
+    {item : (mean count, drop chance)} for one drop table. An item listed twice keeps its
+    last entry, as the evaluations scanning the table in order did.
+    """
+    drops = {}
+    for dtid, dmin, dmax, drate in table:
+        drops[dtid] = ((dmin + dmax) / 2, drate)
+    return drops
+
+# gatherable tid : {item : (mean count, drop chance)}
+DROPS = dense({tid : compile_drops(table) for tid, (duration, table) in data.gatherable.items()})
+
+# gatherable tid : {item : expected count per gather}
+AVG_YIELD = dense({tid : {dtid : mean * rate for dtid, (mean, rate) in drops.items()}
+                   for tid, drops in enumerate(DROPS) if drops is not None})
+
+# item : gatherable tids that can drop it
+DROPPED_BY = {}
+for tid, (duration, table) in data.gatherable.items():
+    for dtid, dmin, dmax, drate in table:
+        if drate > 0 and tid not in DROPPED_BY.get(dtid, ()):
+            DROPPED_BY[dtid] = DROPPED_BY.get(dtid, ()) + (tid,)
+
+########### weapons ##############
+
+def weapon_dps(wid):
+    cd, dmg, range = data.weapons[wid]
+    return (dmg[0] + dmg[1])/2.0/cd
+
+WEAPON_DPS = dense({wid : weapon_dps(wid) for wid in data.weapons}, 0.0)
+
+# weapons with any dps, best first (equal dps keep data.weapons order)
+WEAPONS_BY_DPS = tuple(sorted((wid for wid in data.weapons if WEAPON_DPS[wid] > 0), key=lambda wid: -WEAPON_DPS[wid]))
+
+def best_weapon(item_counts):
+    """The highest dps weapon among the items held, None if there is none."""
+    for wid in WEAPONS_BY_DPS:
+        if wid in item_counts:
+            return wid
+    return None
+
+
+##########################
+#  Check against the raw tables, and per-call cost
+#  (run from src/game: python gamedata.py)
+##########################
+
+if __name__ == '__main__':
+    import itertools, timeit
+
+    def scan_best_weapon(item_counts):
+        # as CInventory.max_dps_weapon computed it
+        maxdps = 0
+        maxwid = None
+        for wid in item_counts:
+            if wid in data.weapons:
+                cd,dmg,range = data.weapons[wid]
+                dps = (dmg[0] + dmg[1])/2.0/cd
+                if dps > maxdps:
+                    maxdps = dps
+                    maxwid = wid
+        return maxwid
+
+    items = list(data.weapons) + [2000, 2009]
+    for n in range(len(items) + 1):
+        for held in itertools.permutations(items, n):
+            counts = {iid : 1 for iid in held}
+            assert best_weapon(counts) == scan_best_weapon(counts), held
+    for tid, (duration, table) in data.gatherable.items():
+        for dtid, dmin, dmax, drate in table:
+            assert tid in DROPPED_BY.get(dtid, (tid,))
+        assert set(AVG_YIELD[tid]) == {d[0] for d in table}
+
+    counts = {2000 : 3, 2003 : 1, 2006 : 1, 2007 : 1, 2009 : 2}
+    N = 200000
+    t_scan = min(timeit.repeat(lambda: scan_best_weapon(counts), number=N, repeat=3)) / N * 1e9
+    t_table = min(timeit.repeat(lambda: best_weapon(counts), number=N, repeat=3)) / N * 1e9
+    print("best weapon: scan {:.0f} ns, table {:.0f} ns".format(t_scan, t_table))
+    t_scan = min(timeit.repeat(lambda: data.render[1]['size'] + data.render[3]['size'], number=N, repeat=3)) / N * 1e9
+    t_table = min(timeit.repeat(lambda: SIZE[1] + SIZE[3], number=N, repeat=3)) / N * 1e9
+    print("melee dist: render dicts {:.0f} ns, SIZE {:.0f} ns".format(t_scan, t_table))
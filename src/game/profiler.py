@@ -0,0 +1,131 @@
+##########################
+#  Per-system frame profiler for World.update
+#
+#  Opt-in: set world.profiler = FrameProfiler() (or RunnerPassThrough(..., profile=True)).
+#  Each tick records wall time and component count (removals, for sweeps) for every store
+#  update and sweep, keeping the last `frames` ticks in a ring buffer.
+##########################
+
+import json, time
+
+UPDATE = 'update'
+SWEEP = 'sweep'
+
+class FrameProfiler:
+    def __init__(self, frames=600):
+        self.frames = frames
+        self.ring = [None] * frames
+        self.next = 0
+        self.count = 0
+
+        # tick being recorded: clock, start time, [(system, phase, start, duration, components)...]
+        self.current = None
+
+    ########### recording (called by World.update) ##############
+
+    def begin_frame(self, clock):
+        self.current = (clock, time.perf_counter(), [])
+
+    def record(self, system, phase, start, end, components):
+        self.current[2].append((system, phase, start, end - start, components))
+
+    def end_frame(self):
+        clock, start, records = self.current
+        self.ring[self.next] = (clock, start, time.perf_counter() - start, records)
+        self.next = (self.next + 1) % self.frames
+        self.count = min(self.count + 1, self.frames)
+        self.current = None
+
+    def reset(self):
+        self.ring = [None] * self.frames
+        self.next = self.count = 0
+
+    ########### reporting ##############
+
+    def recorded(self):
+        """Recorded ticks, oldest first."""
+        start = (self.next - self.count) % self.frames
+        for i in range(self.count):
+            yield self.ring[(start + i) % self.frames]
+
+    def summary(self):
+        """(system, phase) : {p50, p95, max, mean (seconds), components (mean)}, plus ('frame', 'total') and ('sweep', 'total')."""
+        times = {}
+        counts = {}
+        for clock, start, duration, records in self.recorded():
+            times.setdefault(('frame', 'total'), []).append(duration)
+            counts.setdefault(('frame', 'total'), []).append(0)
+            sweep = 0
+            for system, phase, s, d, components in records:
+                times.setdefault((system, phase), []).append(d)
+                counts.setdefault((system, phase), []).append(components)
+                if phase == SWEEP:
+                    sweep += d
+            times.setdefault(('sweep', 'total'), []).append(sweep)
+            counts.setdefault(('sweep', 'total'), []).append(0)
+
+        stats = {}
+        for key, samples in times.items():
+            samples = sorted(samples)
+            stats[key] = {'p50' : percentile(samples, 50),
+                          'p95' : percentile(samples, 95),
+                          'max' : samples[-1],
+                          'mean' : sum(samples) / len(samples),
+                          'components' : sum(counts[key]) / len(counts[key])}
+        return stats
+
+    def report(self):
+        """Summary table, slowest systems (by p95) first."""
+        stats = self.summary()
+        lines = ["{} ticks".format(self.count),
+                 "{:<24} {:>10} {:>10} {:>10} {:>11}".format("system", "p50 us", "p95 us", "max us", "components")]
+        for (system, phase), s in sorted(stats.items(), key=lambda kv: -kv[1]['p95']):
+            lines.append("{:<24} {:>10.1f} {:>10.1f} {:>10.1f} {:>11.1f}".format(
+                system + '.' + phase, s['p50'] * 1e6, s['p95'] * 1e6, s['max'] * 1e6, s['components']))
+        return "\n".join(lines)
+
+    def chrome_trace(self, path=None):
+        """Timeline in Chrome trace event format (chrome://tracing, Perfetto). Written to path if given."""
+        events = []
+        for clock, start, duration, records in self.recorded():
+            events.append({'name' : 'World.update', 'cat' : 'frame', 'ph' : 'X', 'pid' : 0, 'tid' : 0,
+                           'ts' : start * 1e6, 'dur' : duration * 1e6, 'args' : {'clock' : clock}})
+            for system, phase, s, d, components in records:
+                events.append({'name' : system, 'cat' : phase, 'ph' : 'X', 'pid' : 0, 'tid' : 0,
+                               'ts' : s * 1e6, 'dur' : d * 1e6, 'args' : {'components' : components}})
+        trace = {'traceEvents' : events, 'displayTimeUnit' : 'ms'}
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(trace, f)
+        return trace
+
+def percentile(samples, p):
+    """Nearest-rank percentile of sorted samples."""
+    i = max(0, -(-len(samples) * p // 100) - 1)
+    return samples[int(i)]
+
+
+##########################
+#  Profile a worldspec run
+#  (run from src/game: python profiler.py [spec] [ticks] [trace.json])
+##########################
+
+if __name__ == '__main__':
+    import sys
+    from runner import RunnerPassThrough
+    from worldspec import Worldspec
+
+    spec = sys.argv[1] if len(sys.argv) > 1 else 'balance'
+    ticks = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    DIM = (768, 768)
+
+    worldspec = Worldspec(DIM, 0, ((2004, 1),), ((3000, 1),))
+    r = RunnerPassThrough(DIM, DIM, 0.02, profile=True)
+    r.setup(worldspec.spec[spec])
+    r.start()
+    for t in range(ticks):
+        r.step(False)
+
+    print(r.profiler.report())
+    if len(sys.argv) > 3:
+        r.profiler.chrome_trace(sys.argv[3])
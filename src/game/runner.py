@@ -8,24 +8,28 @@ from dm import DramaManager
 from components import cagent
 from components.cbehavior import CBehaviorMobPatrol
 from trace import Trace
+from profiler import FrameProfiler
 
 # module level
 DEBUG = True
 
 class RunnerPassThrough:
-    def __init__(self, dim, viewport, fixed_timestep=None):
+    def __init__(self, dim, viewport, fixed_timestep=None, keyframe_every=None, profile=False):
         self.dim = dim
         self.viewport = viewport
         self.fixed_timestep = fixed_timestep
 
         # for reporting simplicity
         self.ups = self.uct = 0
+        # per-system World.update timings (FrameProfiler), when profiling
+        self.profiler = FrameProfiler() if profile else None
 
-        # list of decision nodes
-        self.trace = Trace()
+        # list of decision nodes (and world snapshots, delta-encoded if keyframe_every is set)
+        self.trace = Trace(keyframe_every)
 
     def setup(self, entities):
         self.world = World(self.dim, self.trace)
+        self.world.profiler = self.profiler
         eid = 0
         for spec in entities:
             ct = ('ct' in spec and spec['ct']) or 1
@@ -66,10 +70,16 @@ class RunnerPassThrough:
             self.fps_ct = 0
             self.fps_timer -= 1.0
 
+        self.advance((self.fixed_timestep is not None and self.fixed_timestep) or delta)
+
+        return None,None
+
+    def advance(self, dt):
+        """One simulation update of dt seconds, without frame timing (headless runs call this directly)."""
+        self.uct += 1
+
         # first time in, full consider for second move, and set to 0
-        self.dm.update_consider((self.fixed_timestep is not None and self.fixed_timestep) or delta)
+        self.dm.update_consider(dt)
 
         # update the world, acting on any moves the dm/agents have chosen
-        self.world.update((self.fixed_timestep is not None and self.fixed_timestep) or delta)
-
-        return None,None
+        self.world.update(dt)
@@ -0,0 +1,239 @@
+##########################
+#  Delta-encoded world snapshots for traces
+#
+#  Every keyframe_every-th snapshot is a full copy of the world, the ones in between only
+#  record what changed since that keyframe: entity core fields (pos, hp, tid, flag),
+#  inventory counts, and which components each store holds. A World is rebuilt on demand
+#  by forking the keyframe and applying the delta.
+#
+#  Components that are still the same object as at the keyframe come back as they were at
+#  the keyframe, apart from the fields above. New or replaced components are copied when
+#  the snapshot is taken.
+##########################
+
+import copy
+from collections import OrderedDict
+
+from vector2 import vector2
+
+# rebuilt worlds kept per timeline
+CACHE_SIZE = 8
+
+class SnapshotDelta:
+    def __init__(self, clock):
+        self.clock = clock
+        # eid : (tid, x, y, hp, flag, breed), for entities that are new or changed
+        self.entities = {}
+        # eid : item counts, for inventories that are new or changed
+        self.inventories = {}
+        # store name : eids gone since the keyframe
+        self.removed = {}
+        # store name : {eid : component}, new or replaced since the keyframe
+        self.added = {}
+
+class DeltaSnapshots:
+    def __init__(self, keyframe_every=10):
+        self.keyframe_every = keyframe_every
+        self.keyframes = []
+        # per snapshot: clock, keyframe number, and the delta (None for the keyframe itself)
+        self.clocks = []
+        self.frames = []
+
+        # recently rebuilt worlds, snapshot number : world (LRU order)
+        self.cache = OrderedDict()
+
+        # live-side bookkeeping for the current keyframe (not pickled)
+        self.since_key = None
+        self.key_live = None
+        self.key_objects = None
+        self.key_entities = None
+        self.key_inventories = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in ('since_key', 'key_live', 'key_objects', 'key_entities', 'key_inventories'):
+            state[k] = None
+        state['cache'] = OrderedDict()
+        return state
+
+    def __len__(self):
+        return len(self.clocks)
+
+    def fork(self):
+        """Copy for a forked trace; keyframes and deltas are never modified, so they are shared."""
+        child = copy.copy(self)
+        child.keyframes = list(self.keyframes)
+        child.clocks = list(self.clocks)
+        child.frames = list(self.frames)
+        child.cache = OrderedDict()
+        return child
+
+    ########### capture ##############
+
+    def capture(self, world):
+        if self.since_key is None or self.since_key + 1 >= self.keyframe_every:
+            self.capture_keyframe(world)
+        else:
+            self.capture_delta(world)
+
+    def capture_keyframe(self, world):
+        # snapshots don't carry the trace (it would copy every earlier snapshot too)
+        memo = {id(world.trace) : None} if world.trace is not None else {}
+        key = copy.deepcopy(world, memo)
+        self.keyframes.append(key)
+        self.clocks.append(world.clock)
+        self.frames.append((len(self.keyframes) - 1, None))
+
+        self.since_key = 0
+        self.key_live = {name : dict(store.cc) for name, store in world.component_stores()}
+        self.key_objects = key.cow_objects()
+        self.key_entities = {eid : entity_fields(ent) for eid, ent in key.entities.cc.items()}
+        self.key_inventories = {eid : dict(inv.item_counts) for eid, inv in key.inventories.cc.items()}
+
+    def capture_delta(self, world):
+        delta = SnapshotDelta(world.clock)
+
+        # anything a copied component points at in the live world maps onto the keyframe
+        memo = {id(o) : self.key_objects[role] for role, o in world.cow_objects().items() if role in self.key_objects}
+        if world.trace is not None:
+            memo[id(world.trace)] = None
+
+        for name, store in world.component_stores():
+            live = self.key_live[name]
+            removed = set(live).difference(store.cc)
+            if removed:
+                delta.removed[name] = removed
+            if store is world.entities:
+                continue
+            added = {eid : copy.deepcopy(c, memo) for eid, c in store.cc.items() if live.get(eid) is not c}
+            if added:
+                delta.added[name] = added
+
+        for eid, ent in world.entities.cc.items():
+            fields = entity_fields(ent)
+            if self.key_entities.get(eid) != fields:
+                delta.entities[eid] = fields
+
+        for eid, inv in world.inventories.cc.items():
+            if self.key_inventories.get(eid) != inv.item_counts:
+                delta.inventories[eid] = dict(inv.item_counts)
+
+        self.clocks.append(world.clock)
+        self.frames.append((len(self.keyframes) - 1, delta))
+        self.since_key += 1
+
+    ########### rebuild ##############
+
+    def world(self, i):
+        """World as of snapshot i."""
+        k, delta = self.frames[i]
+        key = self.keyframes[k]
+        if delta is None:
+            return key
+
+        world = self.cache.get(i)
+        if world is not None:
+            self.cache.move_to_end(i)
+            return world
+        world = self.rebuild(key, delta)
+        self.cache[i] = world
+        if len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return world
+
+    def rebuild(self, key, delta):
+        world = key.fork()
+        world.clock = delta.clock
+
+        entities = world.entities
+        for name, eids in delta.removed.items():
+            if name != 'entities':
+                getattr(world, name).sweep(eids)
+        # entities last, columnar rows are still read while the index is updated
+        entities.sweep(delta.removed.get('entities', ()))
+
+        for name, comps in delta.added.items():
+            store = getattr(world, name)
+            for eid, c in comps.items():
+                # handed out through thaw, so references land on this world
+                if eid not in store.cc:
+                    store.register(eid)
+                store.cc[eid] = c
+                store.frozen.add(eid)
+
+        for eid, (tid, x, y, hp, flag, breed) in delta.entities.items():
+            if eid not in entities.cc:
+                entities.add(eid, tid, vector2((x, y)), hp, breed, flag)
+                continue
+            ent = entities.get(eid)
+            if ent.pos.x != x or ent.pos.y != y:
+                ent.pos = vector2((x, y))
+            ent.tid = tid
+            ent.hp = hp
+            ent.flag = flag
+
+        for eid, counts in delta.inventories.items():
+            inv = world.inventories.get(eid)
+            inv.item_counts = dict(counts)
+            inv.count = sum(counts.values())
+
+        return world
+
+def entity_fields(ent):
+    pos = ent.pos
+    return (ent.tid, pos.x, pos.y, ent.hp, ent.flag, ent.breed)
+
+
+##########################
+#  Size and rebuild cost vs. keyframe spacing
+#  (run from src/game: python snapshots.py)
+##########################
+
+if __name__ == '__main__':
+    import pickle, random, time
+    import data
+    from runner import RunnerPassThrough
+    from components.cagent import CAgent_BehaviorEval
+    from components.reasoning.goals import Goal_HasItemType
+    import components.cagent, components.cmob, components.cbehavior, components.cattack, runner
+    components.cagent.DEBUG = components.cmob.DEBUG = components.cbehavior.DEBUG = False
+    components.cattack.DEBUG = runner.DEBUG = False
+
+    DIM = (600, 600)
+    TICKS = 3000
+
+    def run(keyframe_every):
+        """Snapshot every 10 ticks, as if a decision started or ended. Also returns plain copies to check against."""
+        random.seed(5)
+        r = RunnerPassThrough(DIM, DIM, 0.02, keyframe_every)
+        spec = [{'tid': 1000, 'ct': 20}, {'tid': 1001, 'ct': 20},
+                {'tid': 2, 'ct': 4, 'mob_fn': lambda eid, world: components.cmob.CMob_BehaviorEval(eid, world.entities.get(eid).pos, 100)},
+                {'tid': data.AGENT_TYPE_ID, 'loc': vector2([d / 2 for d in DIM]),
+                 'agent_fn': lambda eid, world: CAgent_BehaviorEval(eid, (Goal_HasItemType(2000, 6, 1.0),))}]
+        r.setup(spec)
+        r.start()
+        copies = []
+        for t in range(TICKS):
+            r.step(False)
+            if t % 10 == 0:
+                r.trace.snapshot_state = True
+                r.trace.snapshot(r.world)
+                copies.append(copy.deepcopy(r.world, {id(r.trace) : None}))
+        return r.trace, copies
+
+    def summary(world):
+        return ([(eid, entity_fields(ent)) for eid, ent in world.entities.all()],
+                [(eid, sorted(inv.item_counts.items())) for eid, inv in world.inventories.all()],
+                [(name, sorted(store.cc)) for name, store in world.component_stores()])
+
+    print("{:>10} {:>12} {:>14}".format("keyframes", "pickle KB", "rebuild ms"))
+    for keyframe_every in (1, 5, 10, 25, 50):
+        trace, copies = run(keyframe_every)
+        start = time.time()
+        for i in range(len(copies)):
+            trace.states.world(i)
+        rebuild = (time.time() - start) / len(copies) * 1000
+        trace.states.cache.clear()
+        for i, s in enumerate(copies):
+            assert summary(trace.states.world(i)) == summary(s), "snapshot {} differs".format(i)
+        print("{:>10} {:>12.0f} {:>14.3f}".format(keyframe_every, len(pickle.dumps(trace)) / 1024, rebuild), flush=True)
@@ -0,0 +1,160 @@
+##########################
+#  Spatial index for range queries
+##########################
+
+class SpatialHash:
+    """
+    Uniform bucket grid over entity positions. Each cell is a whole number of world grid
+    steps wide, and holds eid : entity for everything whose position falls inside it.
+
+    Results are returned in eid order, which matches the insertion order of the entity
+    store, so callers see the same ordering as a full scan.
+    """
+    def __init__(self, step):
+        self.step = step
+        self.buckets = {}
+
+    def reset(self):
+        self.buckets = {}
+
+    def fork(self):
+        """Copy of the cell structure (entities themselves are shared)."""
+        child = SpatialHash(self.step)
+        child.buckets = {k : dict(b) for k,b in self.buckets.items()}
+        return child
+
+    def key(self, pos):
+        return (int(pos.x // self.step), int(pos.y // self.step))
+
+    ########### maintenance ##############
+
+    def insert(self, ent):
+        k = self.key(ent.pos)
+        if k in self.buckets:
+            self.buckets[k][ent.eid] = ent
+        else:
+            self.buckets[k] = {ent.eid : ent}
+
+    def remove(self, ent):
+        k = self.key(ent.pos)
+        bucket = self.buckets.get(k)
+        if bucket is not None and ent.eid in bucket:
+            del bucket[ent.eid]
+            if len(bucket) == 0:
+                del self.buckets[k]
+
+    def move(self, ent, old_pos, new_pos):
+        """Called by the entity when its position is replaced."""
+        self.rekey(ent, self.key(old_pos), self.key(new_pos))
+
+    def rekey(self, ent, old, new):
+        """Move ent between cells given as keys (for callers that compute keys in bulk)."""
+        if old == new:
+            return
+        bucket = self.buckets.get(old)
+        if bucket is not None and ent.eid in bucket:
+            del bucket[ent.eid]
+            if len(bucket) == 0:
+                del self.buckets[old]
+        if new in self.buckets:
+            self.buckets[new][ent.eid] = ent
+        else:
+            self.buckets[new] = {ent.eid : ent}
+
+    ########### queries ##############
+
+    def candidates(self, pos, radius):
+        """All entities in cells overlapped by the square around pos (no distance check)."""
+        x0, y0 = int((pos.x - radius) // self.step), int((pos.y - radius) // self.step)
+        x1, y1 = int((pos.x + radius) // self.step), int((pos.y + radius) // self.step)
+
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.buckets):
+            # sparse world or huge radius, cheaper to walk the occupied cells
+            for (cx, cy), bucket in self.buckets.items():
+                if x0 <= cx <= x1 and y0 <= cy <= y1:
+                    yield from bucket.values()
+        else:
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    bucket = self.buckets.get((cx, cy))
+                    if bucket is not None:
+                        yield from bucket.values()
+
+    def within_range(self, pos, radius):
+        """Entities within radius of pos, in eid order."""
+        r2 = radius * radius
+        found = [ent for ent in self.candidates(pos, radius) if pos.distance_sq(ent.pos) <= r2]
+        found.sort(key=lambda e: e.eid)
+        return found
+
+    def at_cell(self, pos, grid_step):
+        """Entities whose world grid cell (grid_step sized) contains pos, in eid order."""
+        gp = (int(pos.x // grid_step), int(pos.y // grid_step))
+        bucket = self.buckets.get(self.key(pos))
+        if bucket is None:
+            return []
+        found = [ent for ent in bucket.values()
+                 if (int(ent.pos.x // grid_step), int(ent.pos.y // grid_step)) == gp]
+        found.sort(key=lambda e: e.eid)
+        return found
+
+    def count(self):
+        return sum((len(b) for b in self.buckets.values()))
+
+
+##########################
+#  Benchmark: tick rate vs. entity count
+##########################
+
+if __name__ == '__main__':
+    import random, time
+    import data
+    from vector2 import vector2
+    from world import World
+    from trace import Trace
+    from components.cagent import CAgent_BehaviorEval
+    from components.cmob import CMob_BehaviorEval
+    from components.reasoning.goals import Goal_HasItemType
+    import components.cagent, components.cmob, components.cbehavior
+    components.cagent.DEBUG = components.cmob.DEBUG = components.cbehavior.DEBUG = False
+
+    DIM = (4096, 4096)
+    TICKS = 50
+    DT = 0.02
+
+    def brute_range(world, focus_eid, range):
+        focus_ent = world.entities.get(focus_eid)
+        for eid, ent in world.entities.all():
+            if eid != focus_eid and (focus_ent.pos - ent.pos).magnitude() <= range:
+                yield eid, ent
+
+    def build(n):
+        random.seed(n)
+        world = World(DIM, Trace(), simulation=True)
+        world.add_entity({'tid': data.AGENT_TYPE_ID, 'loc': vector2([d / 2 for d in DIM]),
+                          'agent_fn': lambda eid, world: CAgent_BehaviorEval(eid, (Goal_HasItemType(2000, 6, 1.0),))})
+        for i in range(n):
+            if i % 10 == 0:
+                world.add_entity({'tid': 5, 'mob_fn': lambda eid, world: CMob_BehaviorEval(eid, world.entities.get(eid).pos, 100)})
+            else:
+                world.add_entity({'tid': random.choice((1000, 1001, 1004, 1010))})
+        return world
+
+    print("{:>8} {:>12} {:>14} {:>14}".format("entities", "ticks/s", "index q/s", "scan q/s"))
+    for n in (100, 250, 500, 1000, 2000):
+        world = build(n)
+        start = time.time()
+        for t in range(TICKS):
+            world.consider(DT)
+            world.update(DT)
+        tps = TICKS / (time.time() - start)
+
+        eids = [eid for eid, ent in world.entities.all()][:200]
+        start = time.time()
+        for eid in eids: list(world.entities_within_range(eid, 200))
+        indexed = len(eids) / (time.time() - start)
+        start = time.time()
+        for eid in eids: list(brute_range(world, eid, 200))
+        scanned = len(eids) / (time.time() - start)
+
+        print("{:>8} {:>12.1f} {:>14.1f} {:>14.1f}".format(n, tps, indexed, scanned), flush=True)
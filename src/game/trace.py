@@ -1,9 +1,11 @@
 # state/behavior/outcome trace
 # single line, 1-agent
 
-import copy, re
+import bisect, copy, re
+from collections import deque
 from constants import *
 from components.cbehavior import *
+from snapshots import DeltaSnapshots
 
 ##########################################
 # Behavior KB
@@ -37,21 +39,105 @@ BEHAVIORS = {'gather' : (CBehaviorMoveAndGather, ((ARG_ENTITY, 'agent'), (ARG_EN
 
 def behavior_class(bname): return BEHAVIORS[bname][0]
 def behavior_params(bname): return BEHAVIORS[bname][1]
-def explode_behavior_sig(bsig):
-    """Return bname, [(acons, aname, aval)...]"""
+
+def parse_behavior_sig(bsig):
+    """BehaviorSig from the '(gather 2028 2013)' string form (events and older callers)."""
     m = re.search('\(([a-z]*) (.*)\)', bsig)
     if m is None:
         # as in (done)
-        return bsig[1:-1],[]
-    else:
-        bname = m.group(1)
-        argvals = m.group(2).split()
-        return bname,[(acons,aname,aval) for (acons,aname),aval in zip(behavior_params(bname),argvals)]
+        return BehaviorSig(bsig[1:-1], ())
+    bname = m.group(1)
+    argvals = m.group(2).split()
+    return BehaviorSig(bname, tuple((num(val) if acons == ARG_QUANTITY else int(val)
+                                     for (acons,aname),val in zip(behavior_params(bname),argvals))))
+
+def explode_behavior_sig(bsig):
+    """Return bname, [(acons, aname, aval)...]"""
+    if isinstance(bsig, str):
+        bsig = parse_behavior_sig(bsig)
+    if not bsig.args:
+        return bsig.name,[]
+    return bsig.name,[(acons,aname,aval) for (acons,aname),aval in zip(behavior_params(bsig.name),bsig.args)]
+
+def behavior_sig_generic(bsig, mapping):
+    """String form with argument values replaced by their labels in mapping, where they have one."""
+    return '({} {})'.format(bsig.name, ' '.join((mapping.get(aval) or str(aval) for aval in bsig.args)))
+
+##########################################
+# Loop detection
+##########################################
+
+# periods looping() looks for, in decisions: the trace is looping once its last p decisions
+# (agent and behavior sig) repeat the p before them
+LOOP_PERIODS = (2, 3, 4, 5, 6, 7, 8)
+
+class LoopDetector:
+    """
+    Repetition at the end of a sequence of (agent eid, behavior sig) keys, fed one key at a time.
+    For each period p, run counts the latest keys in a row that equal the key p before them;
+    p in a row means the last p keys repeat the p before them. Only the last max(periods)
+    keys are kept, so push and looping don't depend on the trace length.
+    """
+    def __init__(self, periods=LOOP_PERIODS):
+        self.periods = tuple(sorted(set(periods)))
+        self.recent = deque(maxlen=self.periods[-1])
+        self.runs = [0] * len(self.periods)
+        # keys pushed so far
+        self.seen = 0
+        self.looping = False
+
+    def push(self, key):
+        recent = self.recent
+        n = len(recent)
+        runs = self.runs
+        looping = False
+        for j, p in enumerate(self.periods):
+            if p <= n and recent[-p] == key:
+                runs[j] += 1
+                if runs[j] >= p:
+                    looping = True
+            else:
+                runs[j] = 0
+        recent.append(key)
+        self.seen += 1
+        self.looping = looping
+
+    def copy(self):
+        other = copy.copy(self)
+        other.recent = copy.copy(self.recent)
+        other.runs = list(self.runs)
+        return other
+
+    @staticmethod
+    def from_decisions(decisions, periods=LOOP_PERIODS):
+        """Detector state after decisions, from the last 2 * max(periods) of them (all that can matter)."""
+        loops = LoopDetector(periods)
+        tail = decisions[-2 * loops.periods[-1]:]
+        for dn in tail:
+            loops.push(loop_key(dn))
+        loops.seen = len(decisions)
+        return loops
+
+def loop_key(dn): return (dn.agent_eid, dn.behavior_sig())
 
 class Trace:
-    def __init__(self):
+    # decisions[:shared_upto] may be shared with a forked trace, copy before mutating
+    shared_upto = 0
+    # clocks of full-copy states, extended as states are added (never modified in place)
+    clock_index = ()
+    # decision index : node, for nodes not yet ended (None until first asked for, see active_decisions)
+    open_index = None
+    # LoopDetector fed as decisions are added (None on traces pickled before it, see looping)
+    loops = None
+
+    def __init__(self, keyframe_every=None, loop_periods=LOOP_PERIODS):
         self.decisions = []
-        self.states = []
+        self.loops = LoopDetector(loop_periods)
+        # full world copies, or keyframes plus deltas when keyframe_every is given
+        if keyframe_every is None:
+            self.states = []
+        else:
+            self.states = DeltaSnapshots(keyframe_every)
 
         # used to mark the trace to take a snapshot at the end of world update
         self.snapshot_state = False
@@ -63,36 +149,91 @@ class Trace:
     def snapshot(self, world):
         """Store a snapshot of the world if one has been requested."""
         if self.snapshot_state:
-            self.states.append(copy.deepcopy(world))
+            if isinstance(self.states, DeltaSnapshots):
+                self.states.capture(world)
+            else:
+                self.states.append(copy.deepcopy(world))
             self.snapshot_state = False
 
+    def state_clocks(self):
+        """Clocks of the stored states, in order (snapshots are taken as time advances)."""
+        if isinstance(self.states, DeltaSnapshots):
+            return self.states.clocks
+        index = self.clock_index
+        if len(index) != len(self.states):
+            if len(index) > len(self.states):
+                index = ()
+            self.clock_index = index = list(index) + [s.clock for s in self.states[len(index):]]
+        return index
+
+    def state_at(self, i):
+        if isinstance(self.states, DeltaSnapshots):
+            return self.states.world(i)
+        return self.states[i]
+
     def state(self, clock):
-        for s in self.states:
-            if s.clock == clock:
-                return s
-            elif s.clock > clock:
-                # missed it
-                return s
-        assert False, "Failed to retreive state at {} from {}".format(clock, ','.join([str(s.clock) for s in self.states]))
+        clocks = self.state_clocks()
+        # first state at the clock or, if it was missed, just after it
+        i = bisect.bisect_left(clocks, clock)
+        assert i < len(clocks), "Failed to retreive state at {} from {}".format(clock, ','.join([str(c) for c in clocks]))
+        return self.state_at(i)
+
+    ##############################################
+    # Copy-on-write forking (see World.fork)
+    ##############################################
+
+    def fork(self):
+        child = copy.copy(self)
+        child.decisions = list(self.decisions)
+        child.states = self.states.fork() if isinstance(self.states, DeltaSnapshots) else list(self.states)
+        child.shared_upto = self.shared_upto = len(self.decisions)
+        if self.open_index is not None:
+            child.open_index = dict(self.open_index)
+        if self.loops is not None:
+            child.loops = self.loops.copy()
+        return child
+
+    def own(self, i):
+        """Decision node i, copied first if it is shared with a fork."""
+        if i < self.shared_upto:
+            self.decisions[i] = copy.copy(self.decisions[i])
+            if self.open_index is not None and i in self.open_index:
+                self.open_index[i] = self.decisions[i]
+        return self.decisions[i]
 
     ##############################################
     # Decision nodes
     ##############################################
 
     def add_decision_node(self, clock, behavior_sig, agent_eid=None, instantaneous=None, status=None):
-        self.decisions.append(DecisionNode(clock, behavior_sig, agent_eid, instantaneous, status))
+        dn = DecisionNode(clock, behavior_sig, agent_eid, instantaneous, status)
+        if self.open_index is not None and dn.end_clock is None:
+            self.open_index[len(self.decisions)] = dn
+        if self.loops is not None and self.loops.seen == len(self.decisions):
+            self.loops.push(loop_key(dn))
+        self.decisions.append(dn)
         self.snapshot_state = True
 
+    def active_decisions(self):
+        """Decision nodes that haven't ended, in trace order. Kept up to date as nodes are added and ended."""
+        if self.open_index is None:
+            self.open_index = {i : dn for i, dn in enumerate(self.decisions) if dn.end_clock is None}
+        return self.open_index.values()
+
     def end_update(self, world, agent_eid, behavior_sig, status):
         # if was running, interrupted
         if status == RUNNING: status = INTERRUPT
-        for dn in reversed(self.decisions):
+        for i in range(len(self.decisions) - 1, -1, -1):
+            dn = self.decisions[i]
             if dn.agent_eid == agent_eid:
                 if dn.is_behavior('killed'):
                     continue
                 assert dn.behavior_sig() == behavior_sig, "Failed sig match {} <==> {}".format(dn.behavior_sig(), behavior_sig)
+                dn = self.own(i)
                 dn.status = status
                 dn.end_clock = world.clock
+                if self.open_index is not None:
+                    self.open_index.pop(i, None)
                 self.snapshot_state = True
                 return
         assert False, "End update had no prior trace behavior to update for agent {}\n{}".format(agent_eid, "\n".join(str(dn) for dn in self.decisions))
@@ -109,31 +250,20 @@ class Trace:
             self.snapshot(world)
 
     def death(self, agent_eid, target_eid, world):
-        self.add_decision_node(world.clock, '(killed {} {})'.format(agent_eid, target_eid),
+        self.add_decision_node(world.clock, BehaviorSig('killed', (agent_eid, target_eid)),
                                agent_eid=agent_eid, instantaneous=True, status=SUCCESS)
 
     def dehydration(self, agent_eid, world):
-        self.add_decision_node(world.clock, '(dehydrated {})'.format(agent_eid),
+        self.add_decision_node(world.clock, BehaviorSig('dehydrated', (agent_eid,)),
                                instantaneous=True, status=SUCCESS)
 
     def looping(self):
-        pattern = []
-        i=0
-        for dn in reversed(self.decisions):
-            if len(pattern) < 2:
-                pattern.append(dn)
-            elif dn.agent_eid == pattern[i].agent_eid and dn.behavior_sig == pattern[i].behavior_sig:
-                i += 1
-                if i == len(pattern):
-                    # matched the whole thing
-                    return True
-            elif i == 0:
-                # no match yet, extend pattern
-                pattern.append(dn)
-            else:
-                # pattern broken, done
-                return False
-        return False
+        """Whether the trace ends in a repeated run of decisions (see LoopDetector)."""
+        loops = self.loops
+        if loops is None or loops.seen != len(self.decisions):
+            # pickled before detectors, or decisions assigned directly
+            self.loops = loops = LoopDetector.from_decisions(self.decisions, loops.periods if loops else LOOP_PERIODS)
+        return loops.looping
 
     ##############################################
     # Clean-up at the end of the run
@@ -141,6 +271,9 @@ class Trace:
 
     def annotate_endings(self):
         """Update status/time for behaviors interrupted by end of the run or by death."""
+        for i in range(self.shared_upto):
+            self.own(i)
+        self.shared_upto = 0
         current = {}
         for dn in self.decisions:
             current[dn.agent_eid] = dn
@@ -158,6 +291,7 @@ class Trace:
             if dn.end_clock is None:
                 dn.status = INTERRUPT
                 dn.end_clock = self.decisions[-1].start_clock
+        self.open_index = None
 
     ##############################################
     # Reasoning about the trace
@@ -176,27 +310,25 @@ class DecisionNode:
     the same time.
 
     A DN with no agent is a non-behavioral event, used for book-keeping at this point.
+
+    behavior_sig is a BehaviorSig, or its string form for events like '(done)'.
     """
+    # BehaviorSig of behavior_name/behavior_args (nodes pickled before it was kept rebuild it)
+    bsig = None
 
     def __init__(self, clock, behavior_sig, agent_eid=None, instantaneous=False, status=None):
         self.behavior_args = {}
 
-        m = re.search('\(([a-z]*) (.*)\)', behavior_sig)
-        if m is None:
-            # as in (done)
-            self.behavior_name = behavior_sig[1:-1]
-
-        else:
-            self.behavior_name = m.group(1)
-            argvals = m.group(2).split()
-
+        if isinstance(behavior_sig, str):
+            behavior_sig = parse_behavior_sig(behavior_sig)
+        self.behavior_name = behavior_sig.name
+        if behavior_sig.args:
             cls,argcons = BEHAVIORS[self.behavior_name]
-            for (acons,aname),val in zip(argcons,argvals):
-                if acons == ARG_QUANTITY:
-                    self.behavior_args[aname] = (acons, num(val))
-                else:
-                    # entity and type ids
-                    self.behavior_args[aname] = (acons, int(val))
+            for (acons,aname),val in zip(argcons,behavior_sig.args):
+                # entity and type ids, quantities
+                self.behavior_args[aname] = (acons, val)
+            behavior_sig = BehaviorSig(self.behavior_name, tuple(self.arg_values()))
+        self.bsig = behavior_sig
 
         self.start_clock = clock
         self.status = status or RUNNING
@@ -217,7 +349,9 @@ class DecisionNode:
         else: return 0
 
     def behavior_sig(self):
-        return '({} {})'.format(self.behavior_name, ' '.join((str(v) for v in self.arg_values())))
+        if self.bsig is None:
+            self.bsig = BehaviorSig(self.behavior_name, tuple(self.arg_values()))
+        return self.bsig
 
     def behavior_sig_generic(self, mapping=None):
         cls,argcons = BEHAVIORS[self.behavior_name]
@@ -275,3 +409,126 @@ def num(s):
         return int(s)
     except ValueError:
         return float(s)
+
+
+##########################
+#  Benchmark: state lookup cost vs. trace length
+#  (run from src/game: python trace.py [trace dir])
+##########################
+
+if __name__ == '__main__':
+    import os, pickle, random, sys, time
+    from world import World
+
+    def linear_state(trace, clock):
+        # the original scan, for reference
+        for s in trace.states:
+            if s.clock >= clock:
+                return s
+
+    def timed(trace, clocks, lookup):
+        start = time.time()
+        for clock in clocks:
+            lookup(trace, clock)
+        return (time.time() - start) / len(clocks) * 1e6
+
+    if len(sys.argv) > 1:
+        # pickled (seed, trace) files, e.g. traces_05_withmobs
+        traces = []
+        for fname in sorted(os.listdir(sys.argv[1])):
+            with open(os.path.join(sys.argv[1], fname), 'rb') as f:
+                seed, trace = pickle.load(f)
+            if len(trace.states) > 0 and isinstance(trace.states, list):
+                traces.append(trace)
+    else:
+        # synthetic traces, one state per decision
+        random.seed(0)
+        world = World((600, 600))
+        traces = []
+        for n in (100, 1000, 10000, 100000):
+            trace = Trace()
+            clock = 0
+            for i in range(n):
+                clock += random.choice((0, 0.02, 0.1, 1.0))
+                s = copy.copy(world)
+                s.clock = clock
+                trace.states.append(s)
+            traces.append(trace)
+
+    print("{:>8} {:>12} {:>12}".format("states", "scan us", "bisect us"))
+    for trace in sorted(traces, key=lambda t: len(t.states)):
+        last = trace.states[-1].clock
+        clocks = [random.uniform(0, last) for i in range(1000)] + [s.clock for s in trace.states[::max(1, len(trace.states) // 1000)]]
+        for clock in clocks:
+            assert trace.state(clock) is linear_state(trace, clock)
+        print("{:>8} {:>12.2f} {:>12.2f}".format(len(trace.states), timed(trace, clocks, linear_state),
+                                                 timed(trace, clocks, Trace.state)), flush=True)
+
+    ##########################
+    #  Loop detection: detector vs. direct comparison of the trace's tail, and per-call
+    #  cost vs. the original backwards scan as the trace grows
+    ##########################
+
+    def tail_looping(trace, periods=LOOP_PERIODS):
+        keys = [loop_key(dn) for dn in trace.decisions]
+        return any(keys[-p:] == keys[-2 * p:-p] for p in periods if 2 * p <= len(keys))
+
+    def scan_looping(trace):
+        # the original scan (which compared the bound behavior_sig methods, so never matched)
+        pattern = []
+        i=0
+        for dn in reversed(trace.decisions):
+            if len(pattern) < 2:
+                pattern.append(dn)
+            elif dn.agent_eid == pattern[i].agent_eid and dn.behavior_sig == pattern[i].behavior_sig:
+                i += 1
+                if i == len(pattern):
+                    return True
+            elif i == 0:
+                pattern.append(dn)
+            else:
+                return False
+        return False
+
+    def random_decision(trace, clock, agents, targets):
+        agent = random.choice(agents)
+        trace.add_decision_node(clock, BehaviorSig(random.choice(('gather', 'attack')), (agent, random.choice(targets))), agent)
+
+    random.seed(1)
+    for periods in (LOOP_PERIODS, (1,), (3, 5, 16)):
+        for agents, targets in (((1,), (10, 11)), ((1, 2), (10, 11, 12)), ((1, 2, 3), tuple(range(10, 20)))):
+            trace = Trace(loop_periods=periods)
+            fires = 0
+            for i in range(3000):
+                if random.random() < 0.01:
+                    trace.add_event(World((600, 600)), '(done)')
+                else:
+                    random_decision(trace, i, agents, targets)
+                assert trace.looping() == tail_looping(trace, periods), (periods, i)
+                fires += trace.looping()
+                if i % 500 == 250:
+                    # forks and detectors rebuilt from the decisions agree with the original
+                    child = trace.fork()
+                    random_decision(child, i, agents, targets)
+                    assert child.looping() == tail_looping(child, periods)
+                    loose = Trace(loop_periods=periods)
+                    loose.decisions = list(child.decisions)
+                    assert loose.looping() == child.looping()
+            print("periods {} agents {} targets {}: looping after {} of 3000 decisions".format(
+                periods, len(agents), len(targets), fires))
+
+    print("{:>8} {:>12} {:>12}".format("decisions", "scan us", "detector us"))
+    trace = Trace()
+    for n in (100, 1000, 10000, 100000):
+        while len(trace.decisions) < n:
+            random_decision(trace, len(trace.decisions), (1, 2, 3), tuple(range(10, 100)))
+        calls = 100
+        start = time.time()
+        for i in range(calls):
+            scan_looping(trace)
+        t_scan = (time.time() - start) / calls * 1e6
+        start = time.time()
+        for i in range(calls):
+            trace.looping()
+        t_detector = (time.time() - start) / calls * 1e6
+        print("{:>8} {:>12.2f} {:>12.2f}".format(n, t_scan, t_detector), flush=True)
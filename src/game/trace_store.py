@@ -0,0 +1,209 @@
+##########################
+#  Columnar trace files
+#
+#  A trace's decision nodes as NumPy columns in an .npz, one row per node: start/end clock,
+#  status, agent eid, behavior id (into a names column) and the behavior args, padded to
+#  MAX_ARGS. World snapshots are kept apart in a SnapshotStore, under the key the .npz
+#  records, so statistics over decisions never read them. load_trace rebuilds the Trace.
+##########################
+
+import os, pickle
+import numpy as np
+
+from constants import *
+from components.cbehavior import BehaviorSig
+from trace import Trace, DecisionNode, BEHAVIORS, ARG_QUANTITY, behavior_params
+
+MAX_ARGS = max(len(params) for cls, params in BEHAVIORS.values())
+
+# agent column for events (no agent)
+NO_AGENT = -1
+
+class DecisionColumns:
+    """The decision nodes of one trace, column-wise."""
+    def __init__(self, seed, names, start, end, status, agent, behavior, argc, args, snapshots=None):
+        self.seed = seed
+        # behavior names, indexed by the behavior column
+        self.names = names
+        self.start = start          # float64
+        self.end = end              # float64, NaN while running
+        self.status = status        # int8
+        self.agent = agent          # int64, NO_AGENT for events
+        self.behavior = behavior    # int16
+        self.argc = argc            # int8
+        self.args = args            # float64 [rows, MAX_ARGS] (exact for ids)
+        # SnapshotStore key of the world snapshots
+        self.snapshots = snapshots
+
+    def __len__(self):
+        return len(self.start)
+
+    @staticmethod
+    def from_trace(seed, trace, snapshots=None):
+        n = len(trace.decisions)
+        names = []
+        ids = {}
+        cols = DecisionColumns(seed, names, np.empty(n), np.empty(n), np.empty(n, dtype=np.int8),
+                               np.empty(n, dtype=np.int64), np.empty(n, dtype=np.int16),
+                               np.zeros(n, dtype=np.int8), np.zeros((n, MAX_ARGS)), snapshots)
+        for i, dn in enumerate(trace.decisions):
+            sig = dn.behavior_sig()
+            if sig.name not in ids:
+                ids[sig.name] = len(names)
+                names.append(sig.name)
+            cols.start[i] = dn.start_clock
+            cols.end[i] = np.nan if dn.end_clock is None else dn.end_clock
+            cols.status[i] = dn.status
+            cols.agent[i] = NO_AGENT if dn.agent_eid is None else dn.agent_eid
+            cols.behavior[i] = ids[sig.name]
+            cols.argc[i] = len(sig.args)
+            cols.args[i, :len(sig.args)] = sig.args
+        return cols
+
+    def save(self, path):
+        np.savez_compressed(path, seed=np.int64(self.seed), names=np.array(self.names, dtype=str),
+                            start=self.start, end=self.end, status=self.status, agent=self.agent,
+                            behavior=self.behavior, argc=self.argc, args=self.args,
+                            snapshots=np.array('' if self.snapshots is None else self.snapshots))
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as f:
+            snapshots = str(f['snapshots'])
+            return DecisionColumns(int(f['seed']), [str(n) for n in f['names']], f['start'], f['end'], f['status'],
+                                   f['agent'], f['behavior'], f['argc'], f['args'], snapshots or None)
+
+    ########### per row ##############
+
+    def name(self, i):
+        return self.names[self.behavior[i]]
+
+    def sig(self, i):
+        name = self.names[self.behavior[i]]
+        argc = self.argc[i]
+        if argc == 0:
+            return BehaviorSig(name, ())
+        return BehaviorSig(name, tuple((float(v) if acons == ARG_QUANTITY else int(v))
+                                       for (acons, aname), v in zip(behavior_params(name), self.args[i, :argc])))
+
+    def node(self, i):
+        agent = int(self.agent[i])
+        dn = DecisionNode(float(self.start[i]), self.sig(i), None if agent == NO_AGENT else agent)
+        # (the constructor reads status 0, SUCCESS, as not given)
+        dn.status = int(self.status[i])
+        dn.end_clock = None if np.isnan(self.end[i]) else float(self.end[i])
+        return dn
+
+    ########### whole trace ##############
+
+    def behavior_counts(self):
+        """behavior name : decision count."""
+        counts = np.bincount(self.behavior, minlength=len(self.names))
+        return {name : int(ct) for name, ct in zip(self.names, counts)}
+
+    def trace(self, store=None):
+        """The Trace these columns came from, with its snapshots if given the store they're in."""
+        trace = Trace()
+        trace.decisions = [self.node(i) for i in range(len(self))]
+        if store is not None and self.snapshots is not None:
+            trace.states = store.get(self.snapshots)
+        return trace
+
+class SnapshotStore:
+    """World snapshots of traces (a trace's states, list or DeltaSnapshots), one pickle per key."""
+    def __init__(self, dir):
+        self.dir = dir
+        os.makedirs(dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.dir, "{}.pkl".format(key))
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+    def keys(self):
+        return sorted(fn[:-4] for fn in os.listdir(self.dir) if fn.endswith('.pkl'))
+
+    def put(self, key, states):
+        # written under a temporary name first, so a killed run never leaves a partial file
+        path = self.path(key)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(states, f)
+        os.replace(path + '.tmp', path)
+
+    def get(self, key):
+        with open(self.path(key), 'rb') as f:
+            return pickle.load(f)
+
+def save_trace(path, seed, trace, store=None, key=None):
+    """Write trace's decisions to path (.npz), and its snapshots to store under key (the file name by default)."""
+    if store is not None:
+        key = key or os.path.splitext(os.path.basename(path))[0]
+        store.put(key, trace.states)
+    DecisionColumns.from_trace(seed, trace, key if store is not None else None).save(path)
+
+def load_trace(path, store=None):
+    """(seed, trace) from a save_trace file. Without the store, the trace has no snapshots."""
+    cols = DecisionColumns.load(path)
+    return cols.seed, cols.trace(store)
+
+
+##########################
+#  Convert a directory of pickled (seed, trace) files, check the round trip, and compare
+#  file sizes and the time to count behaviors over the whole directory
+#  (run from src/game: python trace_store.py <trace dir> <out dir>)
+##########################
+
+if __name__ == '__main__':
+    import sys, time
+
+    src, out = sys.argv[1], sys.argv[2]
+    store = SnapshotStore(os.path.join(out, 'snapshots'))
+    files = sorted(fn for fn in os.listdir(src) if fn.endswith('.pkl'))
+
+    def same_node(a, b):
+        return (a.start_clock, a.end_clock, a.status, a.agent_eid, a.behavior_name, a.behavior_args, a.behavior_sig()) == \
+               (b.start_clock, b.end_clock, b.status, b.agent_eid, b.behavior_name, b.behavior_args, b.behavior_sig())
+
+    pickled_bytes = columnar_bytes = 0
+    for fn in files:
+        with open(os.path.join(src, fn), 'rb') as f:
+            seed, trace = pickle.load(f)
+        path = os.path.join(out, fn[:-4] + '.npz')
+        save_trace(path, seed, trace, store)
+        seed2, trace2 = load_trace(path, store)
+        assert seed2 == seed and len(trace2.decisions) == len(trace.decisions)
+        assert all(same_node(a, b) for a, b in zip(trace.decisions, trace2.decisions)), fn
+        assert list(trace2.state_clocks()) == list(trace.state_clocks())
+        pickled_bytes += os.path.getsize(os.path.join(src, fn))
+        columnar_bytes += os.path.getsize(path)
+    snapshot_bytes = sum(os.path.getsize(store.path(k)) for k in store.keys())
+
+    def pickled_counts():
+        counts = {}
+        for fn in files:
+            with open(os.path.join(src, fn), 'rb') as f:
+                seed, trace = pickle.load(f)
+            for dn in trace.decisions:
+                counts[dn.behavior_name] = counts.get(dn.behavior_name, 0) + 1
+        return counts
+
+    def columnar_counts():
+        counts = {}
+        for fn in files:
+            for name, ct in DecisionColumns.load(os.path.join(out, fn[:-4] + '.npz')).behavior_counts().items():
+                counts[name] = counts.get(name, 0) + ct
+        return counts
+
+    start = time.time()
+    ref = pickled_counts()
+    t_pickled = time.time() - start
+    start = time.time()
+    got = columnar_counts()
+    t_columnar = time.time() - start
+    assert got == ref
+
+    print("{} traces round trip; behavior counts: pickled {:.2f}s, columnar {:.2f}s ({:.1f}x)".format(
+        len(files), t_pickled, t_columnar, t_pickled / t_columnar))
+    print("bytes: pickled {:.0f} KB, decisions {:.0f} KB, snapshots {:.0f} KB".format(
+        pickled_bytes / 1024, columnar_bytes / 1024, snapshot_bytes / 1024))
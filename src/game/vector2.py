@@ -1,11 +1,26 @@
 import math
 
 class vector2:
+    """
+    2D vector. Entity positions are shared between components, snapshots and forked worlds, so a
+    vector that may be referenced elsewhere is replaced, never modified. The in-place methods
+    (iadd, isub, imul, normalize_inplace) are for temporaries only.
+    """
+    __slots__ = ('x', 'y')
 
     def __init__(self, xy):
         self.x = xy[0]
         self.y = xy[1]
 
+    def __getstate__(self):
+        return (self.x, self.y)
+
+    def __setstate__(self, state):
+        # traces pickled before __slots__ carry the instance dict
+        if isinstance(state, dict):
+            state = (state['x'], state['y'])
+        self.x, self.y = state
+
     def __str__(self):
         return "({:.0f},{:.0f})".format(self.x, self.y)
 
@@ -29,21 +44,110 @@ class vector2:
     def magnitude(self):
         return math.sqrt(self.x*self.x + self.y*self.y)
 
+    def magnitude_sq(self):
+        return self.x*self.x + self.y*self.y
+
+    def distance_sq(self, other):
+        """Squared distance to other, for range checks without the temporary or the sqrt."""
+        dx = self.x - other.x
+        dy = self.y - other.y
+        return dx*dx + dy*dy
+
     def normalized(self, m=None):
         m = m or self.magnitude()
-        ans = vector2(self.xy())
-        ans.x /= m
-        ans.y /= m
-        return ans
+        return vector2((self.x / m, self.y / m))
 
     def scale(self, s):
-        ans = vector2(self.xy())
-        ans.x *= s
-        ans.y *= s
-        return ans
+        return vector2((self.x * s, self.y * s))
 
     def dot(self, v):
         return self.x * v.x + self.y * v.y
 
+    ########### in-place (temporaries only) ##############
+
+    def iadd(self, other):
+        self.x += other.x
+        self.y += other.y
+        return self
+
+    def isub(self, other):
+        self.x -= other.x
+        self.y -= other.y
+        return self
+
+    def imul(self, s):
+        self.x *= s
+        self.y *= s
+        return self
+
+    def normalize_inplace(self, m=None):
+        m = m or self.magnitude()
+        self.x /= m
+        self.y /= m
+        return self
+
 # statics
 zero = vector2((0, 0))
+
+
+##########################
+#  Microbenchmarks against the previous (dict-based, allocating) vector
+#  (run from src/game: python vector2.py)
+##########################
+
+if __name__ == '__main__':
+    import pickle, timeit
+
+    class vector2_dict:
+        def __init__(self, xy):
+            self.x = xy[0]
+            self.y = xy[1]
+
+        def xy(self):
+            return (self.x,self.y)
+
+        def __sub__(self, other):
+            return vector2_dict(((self.x - other.x), (self.y - other.y)))
+
+        def __add__(self, other):
+            if(type(other) == int):
+                return vector2_dict(((self.x + other), (self.y + other)))
+            return vector2_dict(((self.x + other.x), (self.y + other.y)))
+
+        def __mul__(self, s):
+            return vector2_dict(((self.x * s), (self.y * s)))
+
+        def magnitude(self):
+            return math.sqrt(self.x*self.x + self.y*self.y)
+
+        def normalized(self, m=None):
+            m = m or self.magnitude()
+            ans = vector2_dict(self.xy())
+            ans.x /= m
+            ans.y /= m
+            return ans
+
+    N = 200000
+    env = {'a' : vector2((3.5, 4.25)), 'b' : vector2((100.0, -20.0)), 'pos' : vector2((10.0, 10.0)),
+           'da' : vector2_dict((3.5, 4.25)), 'db' : vector2_dict((100.0, -20.0)), 'dpos' : vector2_dict((10.0, 10.0)),
+           'r' : 50.0, 'step' : 2.0}
+    cases = (
+        ("construct", "vector2_dict((1.0, 2.0))", "vector2((1.0, 2.0))"),
+        ("a - b", "da - db", "a - b"),
+        ("range check", "(da - db).magnitude() <= r", "a.distance_sq(b) <= r * r"),
+        ("move step", "dpos + (db - dpos).normalized() * step",
+                      "(b - pos).normalize_inplace().imul(step).iadd(pos)"),
+        ("normalized", "da.normalized()", "a.normalized()"),
+    )
+    print("{:<14} {:>12} {:>12} {:>8}".format("op", "dict ns", "slots ns", "speedup"))
+    for name, old, new in cases:
+        t_old = min(timeit.repeat(old, globals=dict(env, vector2_dict=vector2_dict), number=N, repeat=3)) / N * 1e9
+        t_new = min(timeit.repeat(new, globals=dict(env, vector2=vector2), number=N, repeat=3)) / N * 1e9
+        print("{:<14} {:>12.1f} {:>12.1f} {:>7.2f}x".format(name, t_old, t_new, t_old / t_new))
+
+    # same results as the allocating forms
+    a, b, pos = env['a'], env['b'], env['pos']
+    assert (b - pos).normalize_inplace().imul(2.0).iadd(pos).xy() == (pos + (b - pos).normalized() * 2.0).xy()
+    assert a.distance_sq(b) == (a - b).magnitude_sq()
+    assert pickle.loads(pickle.dumps(a)).xy() == a.xy()
+    print("pickle bytes: dict {}, slots {}".format(len(pickle.dumps(env['da'])), len(pickle.dumps(a))))
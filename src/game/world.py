@@ -1,16 +1,40 @@
-import random
+import random, copy, time, weakref
 
 import data
+import eventlog
 from components import *
+from components.cstore import ComponentStore
+from profiler import UPDATE, SWEEP
 from vector2 import vector2
 
+# per-tick store updates, in order (and whether the update takes dt)
+UPDATES = (('agents', True), ('mob', True), ('behaviors', True), ('moving', True), ('gathering', True),
+           ('crafting', True), ('eat', True), ('heal', True), ('attacking', True), ('drink', True),
+           ('memory', False), ('tag', False), ('finisher', True), ('stun', True), ('relationship', False),
+           ('trap', True), ('decay', True))
+
 
 class World:
-    def __init__(self, dim=(1024, 768), trace=None, grid_step=16, mem_step=256, simulation=False):
+    # copy-on-write state, see fork()
+    cow_memo = None
+    # size of cow_memo when it was seeded (larger once this world has thawed something)
+    cow_seeded = 0
+    cow_ancestors = ()
+    trace = None
+    # optional FrameProfiler, see profiler.py
+    profiler = None
+    # optional eventlog.Log for this world, see log
+    logger = None
+
+    def __init__(self, dim=(1024, 768), trace=None, grid_step=16, mem_step=256, simulation=False, index_cells=8,
+                 columnar=False):
         self.dim = dim
         self.grid_step = grid_step
+        # spatial index cell size, in grid steps
+        self.index_cells = index_cells
         self.next_eid = 2000
         self.mem_step = mem_step
+        self.trace = trace
 
         self.agents = cagent.ComponentStoreAgent(self)
         self.attacking = cattack.ComponentStoreAttack(self, trace)
@@ -19,19 +43,33 @@ class World:
         self.decay = cdecay.ComponentStoreDecay(self)
         self.drink = cthirst.ComponentStoreDrink(self, trace)
         self.eat = ceat.ComponentStoreEat(self)
-        self.entities = centity.ComponentStoreEntity(self)
+        if columnar:
+            # numpy-backed rows, and the vectorized systems that use them
+            from components import centity_columns
+            self.entities = centity_columns.ComponentStoreEntityColumns(self)
+        else:
+            self.entities = centity.ComponentStoreEntity(self)
         self.finisher = cfinisher.ComponentStoreFinisher(self)
         self.gathering = cgather.ComponentStoreGather(self)
         self.heal = cheal.ComponentStoreHeal(self)
         self.inventories = cinventory.ComponentStoreInv(self)
         self.memory = cmemory.ComponentStoreMemory(self)
         self.mob = cmob.ComponentStoreMob(self)
-        self.moving = cmove.ComponentStoreMove(self)
+        if columnar:
+            from components import cmove_batch
+            self.moving = cmove_batch.ComponentStoreMoveBatch(self)
+        else:
+            self.moving = cmove.ComponentStoreMove(self)
         self.relationship = crelation.ComponentStoreRelation(self)
         self.stun = cstun.ComponentStoreStun(self)
         self.tag = ctag.ComponentStoreTag(self)
         self.trap = ctrap.ComponentStoreTrap(self)
 
+        # eid : names of the stores holding a component for it
+        self.registry = {}
+        for name, store in self.component_stores():
+            store.name = name
+
         self.simulation = simulation
         self.clock = 0
 
@@ -39,6 +77,82 @@ class World:
         #self.mem_dim = [d/mem_step for d in dim]
         #self.memory = [[set()]*self.mem_dim[1] for i in range(self.mem_dim[0])]
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('cow_memo', None)
+        state.pop('cow_ancestors', None)
+        state.pop('cow_seeded', None)
+        state.pop('profiler', None)
+        state.pop('logger', None)
+        return state
+
+    @property
+    def log(self):
+        """Where components send messages: world.logger if set, else the live or simulation log."""
+        if self.logger is not None:
+            return self.logger
+        return eventlog.SIMULATION if self.simulation else eventlog.LIVE
+
+    ##################### copy-on-write forking #########################
+
+    def fork(self):
+        """
+        Cheap copy-on-write child world. Stores share their current components with the child,
+        and whichever side accesses a component first (get/all) takes its own copy.
+        """
+        # Components thawed since the last fork were copied under the current memo, and may reference
+        # frozen ones (an agent's active behavior). Those have to be copied under the same memo, so
+        # take the rest now, before the memo is replaced.
+        if self.cow_memo is not None and len(self.cow_memo) > self.cow_seeded:
+            for name, store in self.component_stores():
+                if store.frozen:
+                    store.thaw_all()
+
+        child = copy.copy(self)
+        # rollouts aren't profiled as frames, and log wherever their simulation flag says
+        child.profiler = None
+        child.logger = None
+        # values are frozensets, replaced rather than modified
+        child.registry = dict(self.registry)
+        trace = self.trace and self.trace.fork()
+        child.trace = trace
+        for name, store in self.component_stores():
+            setattr(child, name, store.fork(child, trace))
+
+        # the child remaps everything this world remaps, plus this world's own objects
+        child.cow_ancestors = [(weakref.ref(o), role) for role, o in self.cow_objects().items()]
+        child.cow_ancestors.extend(((ref, role) for ref, role in self.cow_ancestors if ref() is not None))
+        child.cow_memo = child.cow_seed()
+        child.cow_seeded = len(child.cow_memo)
+        # shared components are now frozen on this side too
+        self.cow_memo = self.cow_seed()
+        self.cow_seeded = len(self.cow_memo)
+        return child
+
+    def component_stores(self):
+        return [(name, v) for name, v in vars(self).items() if isinstance(v, ComponentStore)]
+
+    def cow_objects(self):
+        """World-level objects that components may reference, by role."""
+        objects = {'world' : self}
+        if self.trace is not None:
+            objects['trace'] = self.trace
+        for name, store in self.component_stores():
+            objects[name] = store
+            for role, o in store.cow_objects().items():
+                objects[name + '.' + role] = o
+        return objects
+
+    def cow_seed(self):
+        """Deepcopy memo used when thawing: ancestor world-level objects map to ours."""
+        mine = self.cow_objects()
+        memo = {id(o) : o for o in mine.values()}
+        for ref, role in self.cow_ancestors:
+            o = ref()
+            if o is not None and role in mine:
+                memo[id(o)] = mine[role]
+        return memo
+
     def eid(self):
         self.next_eid += 1
         return self.next_eid
@@ -111,17 +225,15 @@ class World:
 
     def entities_within_range(self, focus_eid, range):
         focus_ent = self.entities.get(focus_eid)
-        for eid,ent in self.entities.all():
-            if eid != focus_eid:
-                if (focus_ent.pos - ent.pos).magnitude() <= range:
-                    yield eid,ent
+        for ent in self.entities.index.within_range(focus_ent.pos, range):
+            if ent.eid != focus_eid:
+                yield ent.eid,ent
 
     def agents_within_range(self, focus_eid, range):
         focus_ent = self.entities.get(focus_eid)
-        for eid, ent in self.entities.all():
-            if eid != focus_eid and self.agents.get(eid) is not None:
-                if (focus_ent.pos - ent.pos).magnitude() <= range:
-                    yield eid, ent
+        for ent in self.entities.index.within_range(focus_ent.pos, range):
+            if ent.eid != focus_eid and self.agents.get(ent.eid) is not None:
+                yield ent.eid, ent
 
     # utilities
 
@@ -134,7 +246,7 @@ class World:
 
     # helper method for tagging system. Used to determine if something still exists
     def living(self, target_eid):
-        for eid, ent in self.entities.all():
+        for eid in self.entities.cc:
             if eid is target_eid:
                 return True
         return False
@@ -144,11 +256,9 @@ class World:
         cand = None
         while not cand:
             cand = self.rand_grid()
-            for eid,ent in self.entities.all():
-                if self.grid_pos(ent.pos) == cand:
-                    # no good
-                    cand = None
-                    break
+            if self.entity_at_grid_pos(cand) is not None:
+                # no good
+                cand = None
         # found when loops ends
         return self.grid_center(cand)
 
@@ -176,9 +286,8 @@ class World:
         return vector2(((gp[0]+0.5)*self.grid_step, (gp[1]+0.5)*self.grid_step))
 
     def entity_at_grid_pos(self, gp):
-        for eid, ent in self.entities.all():
-            if self.grid_pos(ent.pos) == gp:
-                return ent
+        for ent in self.entities.index.at_cell(self.grid_center(gp), self.grid_step):
+            return ent
         return None
 
     ##################### memory cells #########################
@@ -193,49 +302,132 @@ class World:
 
     def update(self, dt):
         self.clock += dt
+        profiler = self.profiler
+        if profiler is not None: profiler.begin_frame(self.clock)
+
+        # agent update, apply proposed decisions, then simulation updates
+        for name, takes_dt in UPDATES:
+            store = getattr(self, name)
+            args = (dt,) if takes_dt else ()
+            if profiler is None:
+                store.update(*args)
+            else:
+                self.profiled(profiler, name, UPDATE, len(store.cc), store.update, args)
+
+        # clean up: components their own systems marked for removal...
+        deleted = self.entities.remove_ids
+        for name, store in self.component_stores():
+            if store.remove_ids and store is not self.entities:
+                if profiler is None:
+                    store.sweep(())
+                else:
+                    self.profiled(profiler, name, SWEEP, len(store.remove_ids), store.sweep, ((),))
+        # ...then those of removed entities, only from the stores that hold them
+        if deleted:
+            if profiler is None:
+                self.sweep_deleted(deleted)
+            else:
+                self.profiled(profiler, 'deleted', SWEEP, len(deleted), self.sweep_deleted, (deleted,))
 
-        # agent update, apply proposed decisions
-        self.agents.update(dt)
-        self.mob.update(dt)
-        # simulation updates
-        self.behaviors.update(dt)
-        self.moving.update(dt)
-        self.gathering.update(dt)
-        self.crafting.update(dt)
-        self.eat.update(dt)
-        self.heal.update(dt)
-        self.attacking.update(dt)
-        self.drink.update(dt)
-        self.memory.update()
-        self.tag.update()
-        self.finisher.update(dt)
-        self.stun.update(dt)
-        self.relationship.update()
-        self.trap.update(dt)
-        self.decay.update(dt)
-
-
-        # clean up
-        self.agents.sweep(self.entities.remove_ids)
-        self.mob.sweep(self.entities.remove_ids)
-        self.behaviors.sweep(self.entities.remove_ids)
-        self.moving.sweep(self.entities.remove_ids)
-        self.gathering.sweep(self.entities.remove_ids)
-        self.crafting.sweep(self.entities.remove_ids)
-        self.eat.sweep(self.entities.remove_ids)
-        self.attacking.sweep(self.entities.remove_ids)
-        self.drink.sweep(self.entities.remove_ids)
-        self.memory.sweep(self.entities.remove_ids)
-        self.tag.sweep(self.entities.remove_ids)
-        self.finisher.sweep(self.entities.remove_ids)
-        self.stun.sweep(self.entities.remove_ids)
-        self.relationship.sweep(self.entities.remove_ids)
-        self.trap.sweep(self.entities.remove_ids)
-        self.decay.sweep(self.entities.remove_ids)
-        self.heal.sweep(self.entities.remove_ids)
-
-
-        self.entities.sweep(set())
+        if profiler is None:
+            self.entities.sweep(set())
+        else:
+            self.profiled(profiler, 'entities', SWEEP, len(deleted), self.entities.sweep, (set(),))
+            profiler.end_frame()
 
         # snapshot world, if needed
         #if trace: trace.snapshot(self)
+
+    def sweep_deleted(self, deleted):
+        for eid in deleted:
+            for name in self.registry.get(eid, ()):
+                store = getattr(self, name)
+                if store.sweep_with_entity and store is not self.entities:
+                    store.drop(eid)
+
+    def profiled(self, profiler, name, phase, components, fn, args):
+        start = time.perf_counter()
+        fn(*args)
+        profiler.record(name, phase, start, time.perf_counter(), components)
+
+
+##########################
+#  Fork checks and cost: references shared between stores (an agent and its active behavior)
+#  stay shared across repeated forks and partial thaws on either side, forks stay isolated from
+#  their parent, and fork + one tick vs. deepcopy + one tick
+#  (run from src/game: python world.py [spec])
+##########################
+
+if __name__ == '__main__':
+    import sys, io, contextlib
+    from runner import RunnerPassThrough
+    from worldspec import Worldspec
+
+    spec = sys.argv[1] if len(sys.argv) > 1 else 'balance'
+    DIM = (768, 768)
+    eventlog.LIVE = eventlog.NULL
+
+    def consistent(w):
+        for store in (w.agents, w.mob, w.behaviors):
+            store.thaw_all()
+        for store in (w.agents, w.mob):
+            for eid, a in store.cc.items():
+                b = w.behaviors.cc.get(eid)
+                if a.active_behavior is not None and b is not None and a.active_behavior is not b:
+                    return False
+        return True
+
+    def owned(w):
+        """ids of every component w holds (after taking its own copies)."""
+        ids = set()
+        for name, store in w.component_stores():
+            store.thaw_all()
+            ids.update((id(c) for c in store.cc.values()))
+        return ids
+
+    random.seed(3)
+    worldspec = Worldspec(DIM, 3, ((2004, 1),), ((3000, 1),))
+    r = RunnerPassThrough(DIM, DIM, 0.02)
+    with contextlib.redirect_stdout(io.StringIO()):
+        r.setup(worldspec.spec[spec])
+    for i in range(100):
+        r.advance(0.02)
+    w = r.world
+
+    # forks of forks, with one side touching only some stores before the next fork
+    worlds = [w]
+    for i in range(30):
+        parent = random.choice(worlds)
+        touched = random.choice((parent.agents, parent.behaviors, parent.mob, parent.moving))
+        for eid in list(touched.cc)[:random.randint(0, len(touched.cc))]:
+            touched.get(eid)
+        child = parent.fork()
+        if random.random() < 0.5:
+            child.simulation = True
+            child.consider(0.02)
+            child.update(0.02)
+        worlds.append(child)
+    assert all(consistent(x) for x in worlds), "agent and behavior stores disagree"
+    ids = [owned(x) for x in worlds]
+    assert all(not (ids[i] & ids[j]) for i in range(len(ids)) for j in range(i)), "forks share components"
+    print("{} forked worlds: shared references consistent, components isolated".format(len(worlds)))
+
+    # a search frame: K rollouts of one tick each from the live world, then the live world's own tick
+    # (which copies whatever it touches again, since the fork froze it too)
+    def frame_ms(branch, rollouts, frames=20):
+        start = time.time()
+        for i in range(frames):
+            for k in range(rollouts):
+                c = branch(w)
+                c.simulation = True
+                c.consider(0.02)
+                c.update(0.02)
+            w.consider(0.02)
+            w.update(0.02)
+        return (time.time() - start) / frames * 1e3
+
+    print("{:>8} {:>12} {:>12}".format("rollouts", "deepcopy ms", "fork ms"))
+    for rollouts in (0, 1, 5, 20):
+        t_copy = frame_ms(copy.deepcopy, rollouts)
+        t_fork = frame_ms(World.fork, rollouts)
+        print("{:>8} {:>12.2f} {:>12.2f}".format(rollouts, t_copy, t_fork), flush=True)